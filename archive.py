@@ -0,0 +1,242 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from balance import invoice_amount, to_milli
+from storage import UNKNOWN_YEAR, invoice_matches
+from summaries import Summaries
+
+ARCHIVE_SUFFIX = "_archive"
+
+# عدد السنوات المؤرشفة المحملة في الذاكرة
+ARCHIVE_CACHE_SIZE = 2
+
+
+def archive_dir_for(path):
+    """مجلد الأرشيف المجاور لملف البيانات أو مجلد السنوات"""
+    return os.path.splitext(path.rstrip("/\\"))[0] + ARCHIVE_SUFFIX
+
+
+class YearArchive:
+    """السنوات المقفلة: ملف JSON مضغوط (gzip) لكل سنة، للقراءة فقط.
+
+    كل ملف يحفظ فواتير السنة مع رصيدها الافتتاحي والختامي، ويتم تحميله عند أول طلب.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, year):
+        return os.path.join(self.directory, f"{year:04d}.json.gz")
+
+    def years(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:4]) for name in names if name.endswith(".json.gz") and name[:4].isdigit())
+
+    def __contains__(self, year):
+        return os.path.exists(self._path(year))
+
+    def load(self, year):
+        with self._lock:
+            data = self._cache.get(year)
+            if data is None:
+                with gzip.open(self._path(year), "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._cache[year] = data
+                while len(self._cache) > ARCHIVE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(year)
+            return data
+
+    def write(self, year, data):
+        """كتابة السنة بأمان (ملف مؤقت ثم fsync ثم os.replace)"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(year)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(data, ensure_ascii=False, default=dict).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._cache.pop(year, None)
+
+    def _pending_path(self):
+        return os.path.join(self.directory, "closing.json")
+
+    def pending_close(self):
+        """السنة التي كتب أرشيفها ولم يكتمل حذف فواتيرها وترحيل رصيدها (None إذا لا يوجد)"""
+        try:
+            with open(self._pending_path(), "r", encoding="utf-8") as f:
+                return json.load(f)["year"]
+        except FileNotFoundError:
+            return None
+
+    def begin_close(self, year):
+        path = self._pending_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"year": year}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def end_close(self):
+        try:
+            os.remove(self._pending_path())
+        except FileNotFoundError:
+            pass
+
+
+class ArchivedStorage:
+    """مخزن الدفتر الحالي مع السنوات المقفلة من الأرشيف.
+
+    استعلام سنة مؤرشفة يقرأ من الأرشيف، وباقي العمليات تنفذ على المخزن الحالي.
+    لا يمكن إضافة أو تعديل فاتورة في سنة مقفلة.
+    """
+
+    def __init__(self, live, archive):
+        self.live = live
+        self.archive = archive
+        self._archived_summaries = {}  # السنة المقفلة -> ملخصها (لا يتغير بعد الإقفال)
+        self._archived_years = archive.years()
+        pending = archive.pending_close()
+        if pending is not None:
+            print(f"إكمال إقفال السنة المالية {pending} الذي انقطع")
+            self._finish_close(pending, archive.load(pending))
+
+    def __getattr__(self, name):
+        return getattr(self.live, name)
+
+    def is_archived(self, year):
+        return year in self.archive
+
+    def opening_balance(self, year):
+        """الرصيد الافتتاحي للسنة: من الأرشيف للسنة المقفلة وإلا الرصيد الافتتاحي الحالي"""
+        if self.is_archived(year):
+            return self.archive.load(year)["opening_balance"]
+        return self.live.get_initial_balance()
+
+    def years(self):
+        return sorted(set(self.live.years()) | set(self.archive.years()))
+
+    def summaries(self):
+        """ملخص الدفتر الحالي مع السنوات المقفلة (ملخص كل سنة مقفلة يحسب مرة واحدة)"""
+        summaries = Summaries().merge(self.live.summaries())
+        for year in self.archive.years():
+            archived = self._archived_summaries.get(year)
+            if archived is None:
+                archived = self._archived_summaries[year] = Summaries(self.archive.load(year)["invoice_items"])
+            summaries.merge(archived)
+        return summaries
+
+    def refresh(self):
+        """مثل refresh المخزن الحالي، مع إعادة التحميل إذا أقفل برنامج آخر سنة"""
+        changes = self.live.refresh()
+        years = self.archive.years()
+        if years != self._archived_years:
+            self._archived_years = years
+            return None
+        return changes
+
+    def _archived_invoices(self, year, date_from=None, date_to=None, text=None):
+        invoices = self.archive.load(year)["invoice_items"]
+        if date_from is None and date_to is None and not text:
+            return list(invoices)
+        return [invoice for invoice in invoices if invoice_matches(invoice, year, date_from, date_to, text)]
+
+    def query(self, year=None, date_from=None, date_to=None, text=None):
+        if year is not None:
+            if self.is_archived(year):
+                return self._archived_invoices(year, date_from, date_to, text)
+            return self.live.query(year, date_from, date_to, text)
+
+        first = int(date_from[:4]) if date_from else None
+        last = int(date_to[:4]) if date_to else None
+        results = []
+        for archived_year in self.archive.years():
+            if (first is None or archived_year >= first) and (last is None or archived_year <= last):
+                results.extend(self._archived_invoices(archived_year, date_from, date_to, text))
+        return results + self.live.query(None, date_from, date_to, text)
+
+    def _check_open(self, invoice):
+        try:
+            year = int(invoice["date"][:4])
+        except ValueError:
+            return
+        if self.is_archived(year):
+            raise ValueError(f"السنة المالية {year} مقفلة ولا يمكن إضافة أو تعديل فواتيرها")
+
+    def add_invoice(self, invoice):
+        self._check_open(invoice)
+        self.live.add_invoice(invoice)
+
+    def add_invoices(self, invoices):
+        for invoice in invoices:
+            self._check_open(invoice)
+        self.live.add_invoices(invoices)
+
+    def update_invoice(self, invoice_id, new_invoice):
+        self._check_open(new_invoice)
+        self.live.update_invoice(invoice_id, new_invoice)
+
+    def close_year(self, year):
+        """إقفال سنة منتهية: نقل فواتيرها إلى الأرشيف وترحيل رصيدها الختامي كرصيد افتتاحي.
+
+        الأرشيف يكتب أولاً ثم تحذف الفواتير من الدفتر الحالي، لذلك لا تضيع أي فاتورة
+        عند انقطاع الإقفال. الحذف وترحيل الرصيد عمليتان منفصلتان، لذلك تسجل السنة في الأرشيف
+        قبلهما وتمسح بعد حفظهما؛ إذا انقطع الإقفال بينهما يكمل عند فتح الدفتر. ترجع الرصيد الختامي.
+
+        الرصيد الافتتاحي في الدفتر الحالي مشترك بين كل السنوات المفتوحة؛ قبل أي إقفال هو
+        رصيد أول الدفتر، وبعد الإقفال يصبح الرصيد بعد آخر سنة مقفلة، لذلك تتغير أرصدة كل
+        السنوات المفتوحة التالية (مثلاً balance --year للسنة التالية).
+        """
+        if year >= datetime.date.today().year:
+            raise ValueError(f"السنة المالية {year} لم تنته بعد")
+        live_years = self.live.years()
+        if year not in live_years:
+            raise ValueError(f"لا توجد فواتير في السنة المالية {year}")
+        older = [other for other in live_years if UNKNOWN_YEAR < other < year]
+        if older:
+            raise ValueError(f"يجب إقفال السنة المالية {older[0]} أولاً")
+
+        invoices = [dict(invoice) for invoice in self.live.query(year=year)]
+        opening = self.live.get_initial_balance()
+        closing = (to_milli(opening) + sum(invoice_amount(invoice) for invoice in invoices)) / 1000
+        data = {
+            "year": year,
+            "opening_balance": opening,
+            "closing_balance": closing,
+            "invoice_items": invoices,
+        }
+        self.archive.write(year, data)
+        self.archive.begin_close(year)
+        self._finish_close(year, data)
+        self._archived_years = self.archive.years()
+        return closing
+
+    def _finish_close(self, year, data):
+        """حذف فواتير السنة المؤرشفة الباقية في الدفتر الحالي وترحيل رصيدها الختامي"""
+        archived_ids = {invoice["id"] for invoice in data["invoice_items"]}
+        remaining = [invoice["id"] for invoice in self.live.query(year=year) if invoice["id"] in archived_ids]
+        if remaining:
+            self.live.delete_invoices(remaining)
+        self.live.set_initial_balance(data["closing_balance"])
+        # التسجيل يمسح فقط بعد كتابة الحذف والرصيد على القرص
+        if self.live.sync():
+            self.archive.end_close()
+
+    def finished_years(self):
+        """السنوات المنتهية التي لم تقفل بعد بترتيب الإقفال"""
+        current_year = datetime.date.today().year
+        return [year for year in self.live.years() if UNKNOWN_YEAR < year < current_year]
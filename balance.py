@@ -0,0 +1,144 @@
+import datetime
+
+
+def to_milli(amount):
+    """تحويل المبلغ إلى عدد صحيح بالألف (العملة بثلاث خانات عشرية)"""
+    return round((amount or 0.0) * 1000)
+
+
+def invoice_amount(invoice):
+    """صافي حركة الفاتورة بالألف: المدين يزيد الرصيد والدائن ينقصه"""
+    return to_milli(invoice.get("debit", 0.0)) - to_milli(invoice.get("credit", 0.0))
+
+
+def ledger_key(invoice):
+    """ترتيب الدفتر: حسب التاريخ ثم حسب المعرف"""
+    return (invoice["date"], invoice["id"])
+
+
+class FenwickTree:
+    """شجرة فنويك لمجاميع البادئة مع تحديث نقطة في O(log n)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, index, delta):
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index):
+        """مجموع العناصر من 0 حتى index شاملاً"""
+        total = 0
+        i = min(index, self.size - 1) + 1
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class BalanceIndex:
+    """فهرس الرصيد التراكمي لسنة مالية واحدة.
+
+    الحركات مجمعة حسب اليوم في شجرة فنويك، لذلك تكلفة الإضافة والتعديل والحذف
+    والاستعلام عن الرصيد في أي تاريخ هي O(log n). الحركات داخل اليوم الواحد
+    مرتبة حسب المعرف.
+    """
+
+    def __init__(self, year, invoices=()):
+        self.year = year
+        self.first_day = datetime.date(year, 1, 1).toordinal()
+        self.days = datetime.date(year, 12, 31).toordinal() - self.first_day + 1
+        self.tree = FenwickTree(self.days)
+        self.day_entries = {}  # اليوم -> {المعرف: المبلغ}
+        for invoice in invoices:
+            try:
+                self.add(invoice)
+            except ValueError:
+                print(f"تنسيق تاريخ غير صالح: {invoice['date']}")
+
+    def _day(self, date_str):
+        day = datetime.date.fromisoformat(date_str).toordinal() - self.first_day
+        if not 0 <= day < self.days:
+            raise ValueError(f"التاريخ {date_str} خارج السنة المالية {self.year}")
+        return day
+
+    def contains_date(self, date_str):
+        try:
+            self._day(date_str)
+        except ValueError:
+            return False
+        return True
+
+    def add(self, invoice):
+        day = self._day(invoice["date"])
+        amount = invoice_amount(invoice)
+        self.day_entries.setdefault(day, {})[invoice["id"]] = amount
+        self.tree.add(day, amount)
+
+    def remove(self, invoice):
+        day = self._day(invoice["date"])
+        entries = self.day_entries[day]
+        amount = entries.pop(invoice["id"])
+        if not entries:
+            del self.day_entries[day]
+        self.tree.add(day, -amount)
+
+    def total(self):
+        """صافي حركات السنة بالألف"""
+        return self.tree.prefix_sum(self.days - 1)
+
+    def balance_as_of(self, date_str):
+        """صافي الحركات حتى نهاية التاريخ المحدد بالألف"""
+        try:
+            day = datetime.date.fromisoformat(date_str).toordinal() - self.first_day
+        except ValueError:
+            return self.total()
+        if day < 0:
+            return 0
+        return self.tree.prefix_sum(day)
+
+    def copy(self):
+        """نسخة مستقلة تستخدم في خيوط الخلفية (مثل التصدير)"""
+        other = BalanceIndex.__new__(BalanceIndex)
+        other.year = self.year
+        other.first_day = self.first_day
+        other.days = self.days
+        other.tree = FenwickTree(self.days)
+        other.tree.tree = list(self.tree.tree)
+        other.day_entries = {day: dict(entries) for day, entries in self.day_entries.items()}
+        return other
+
+    def running_balances(self, invoices):
+        """الرصيد بعد كل فاتورة لقائمة مرتبة بترتيب الدفتر بالألف (None للتاريخ غير الصالح).
+
+        يحسب مجموع البادئة مرة واحدة لكل يوم، لذلك التكلفة O(n log n) للقائمة كاملة.
+        """
+        current_day = None
+        cumulative = {}
+        for invoice in invoices:
+            try:
+                day = self._day(invoice["date"])
+            except ValueError:
+                yield None
+                continue
+            if day != current_day:
+                current_day = day
+                running = self.tree.prefix_sum(day - 1) if day > 0 else 0
+                cumulative = {}
+                entries = self.day_entries.get(day, {})
+                for invoice_id in sorted(entries):
+                    running += entries[invoice_id]
+                    cumulative[invoice_id] = running
+            yield cumulative.get(invoice["id"])
+
+    def balance_after(self, invoice):
+        """صافي الحركات حتى هذه الفاتورة شاملاً بترتيب الدفتر بالألف"""
+        day = self._day(invoice["date"])
+        balance = self.tree.prefix_sum(day - 1) if day > 0 else 0
+        for invoice_id, amount in self.day_entries.get(day, {}).items():
+            if invoice_id <= invoice["id"]:
+                balance += amount
+        return balance
@@ -0,0 +1,277 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from binary_snapshot import binary_snapshot_path_for
+from ledger import Ledger
+from storage import JsonStorage, journal_path_for, previous_journal_path_for
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_YEARS = (2023, 2024, 2025)
+DEFAULT_SEED = 1
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+# عدد صفوف تصدير PDF (كل 30 صفاً صفحة، لذلك لا يتم تصدير مليون فاتورة)
+PDF_ROWS = 3000
+
+# بيانات واقعية: (البيان، مدين أم لا، أقل مبلغ، أكبر مبلغ)
+DESCRIPTIONS = [
+    ("مبيعات نقدية", True, 5, 2500),
+    ("تحصيل من عميل", True, 50, 10000),
+    ("إيداع من البنك", True, 500, 20000),
+    ("سولار", False, 20, 400),
+    ("بنزين", False, 10, 150),
+    ("إيجار المحل", False, 1000, 3000),
+    ("رواتب الموظفين", False, 2000, 15000),
+    ("كهرباء", False, 50, 900),
+    ("مياه", False, 10, 120),
+    ("صيانة المعدات", False, 30, 2000),
+    ("مشتريات بضاعة", False, 100, 8000),
+    ("نقل وشحن", False, 15, 600),
+    ("هاتف وإنترنت", False, 20, 250),
+    ("ضيافة", False, 5, 80),
+    ("أدوات مكتبية", False, 5, 300),
+    ("عمولة بنكية", False, 1, 50),
+]
+
+
+def generate_ledger(count, years=DEFAULT_YEARS, seed=DEFAULT_SEED):
+    """دفتر صناعي بنفس البذرة ينتج نفس البيانات دائماً.
+
+    التواريخ موزعة على السنوات بترتيب الإدخال تقريباً (مع بعض الفواتير المتأخرة).
+    """
+    rng = random.Random(seed)
+    first = datetime.date(min(years), 1, 1).toordinal()
+    last = datetime.date(max(years), 12, 31).toordinal()
+    date_strings = {}
+    items = []
+    for invoice_id in range(1, count + 1):
+        ordinal = first + (last - first) * invoice_id // count
+        if rng.random() < 0.05:
+            ordinal = max(first, ordinal - rng.randint(1, 30))
+        date_str = date_strings.get(ordinal)
+        if date_str is None:
+            date_str = datetime.date.fromordinal(ordinal).isoformat()
+            date_strings[ordinal] = date_str
+        description, is_debit, low, high = rng.choice(DESCRIPTIONS)
+        if rng.random() < 0.3:
+            description = f"{description} - {rng.randint(1, 500)}"
+        amount = round(rng.uniform(low, high), 3)
+        items.append({
+            "invoice_number": str(100000 + invoice_id),
+            "date": date_str,
+            "description": description,
+            "debit": amount if is_debit else 0.0,
+            "credit": 0.0 if is_debit else amount,
+            "id": invoice_id,
+        })
+    return {"initial_balance": 1000.0, "journal_seq": 0, "next_id": count + 1, "invoice_items": items}
+
+
+def ledger_file(workdir, count, seed):
+    """ملف الدفتر الصناعي (يتم إنشاؤه مرة واحدة لكل حجم وبذرة)"""
+    path = os.path.join(workdir, f"ledger-{count}-{seed}.json")
+    if not os.path.exists(path):
+        data = generate_ledger(count, seed=seed)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def measure(function, repeat, setup=None, teardown=None):
+    """زمن التنفيذ بالثواني لكل تكرار مع أقل قيمة والوسيط.
+
+    إذا حددت setup يتم تمرير نتيجتها إلى الدالة ولا يدخل زمنها في القياس.
+    """
+    runs = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            function(argument)
+        else:
+            function()
+        runs.append(time.perf_counter() - start)
+        if teardown is not None:
+            teardown(argument)
+    return {"runs": runs, "min": min(runs), "median": statistics.median(runs)}
+
+
+def fresh_copy(source, directory):
+    """نسخة جديدة من الدفتر بدون سجل أو لقطة ثنائية"""
+    path = os.path.join(directory, "ledger.json")
+    for leftover in (path, journal_path_for(path), previous_journal_path_for(path), binary_snapshot_path_for(path)):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    shutil.copyfile(source, path)
+    return path
+
+
+def run_core(source, rundir, year, repeat, pdf_rows):
+    from exporters import export_excel, export_pdf
+
+    results = {}
+
+    def open_copy(binary_snapshot):
+        return JsonStorage(fresh_copy(source, rundir), binary_snapshot=binary_snapshot, background_frame=False)
+
+    def load(storage):
+        storage.get_initial_balance()
+
+    def close(storage):
+        storage.close()
+
+    results["load_json"] = measure(load, repeat, lambda: open_copy(False), close)
+
+    def open_with_snapshot():
+        storage = open_copy(True)
+        storage.get_initial_balance()
+        storage.close()  # كتابة اللقطة الثنائية
+        return JsonStorage(storage.path, background_frame=False)
+
+    results["load_snapshot"] = measure(load, repeat, open_with_snapshot, close)
+
+    storage = JsonStorage(fresh_copy(source, rundir), binary_snapshot=False, background_frame=False)
+    storage.compact_threshold = sys.maxsize  # الدمج يقاس منفرداً
+    ledger = Ledger(storage)
+    invoice = {"invoice_number": "1", "date": f"{year}-06-01", "description": "سولار", "debit": 0.0, "credit": 10.0}
+
+    def add_durable():
+        storage.add_invoice(dict(invoice))
+        storage.sync()
+
+    # إضافة فاتورة حتى كتابتها على القرص (نفس معنى القياس قبل الكتابة في الخلفية)
+    results["save_add_invoice"] = measure(add_durable, repeat)
+    # ما ينتظره خيط الواجهة فقط: التعديل في الذاكرة وإضافة السطر إلى طابور الكتابة
+    results["save_add_invoice_queued"] = measure(lambda: storage.add_invoice(dict(invoice)), repeat)
+
+    def add_one():
+        storage.add_invoice(dict(invoice))
+        return storage
+
+    # إعادة كتابة ملف البيانات كاملاً (ما كان يفعله كل حفظ قبل السجل)
+    results["save_compact"] = measure(lambda s: s.flush(), repeat, add_one)
+
+    results["year_query"] = measure(lambda: ledger.year(year), repeat)
+    results["date_query"] = measure(lambda: storage.query(year=year, date_from=f"{year}-04-01",
+                                                          date_to=f"{year}-06-30"), repeat)
+    results["text_query_cold"] = measure(lambda: storage.query(year=year, text="سولار"), 1)
+    results["text_query"] = measure(lambda: storage.query(year=year, text="سولار"), repeat)
+
+    invoices, balances = ledger.view(year)
+    results["running_balance"] = measure(lambda: sum(1 for _ in balances.running_balances(invoices)), repeat)
+
+    initial_balance = ledger.initial_balance()
+    excel_path = os.path.join(rundir, "export.xlsx")
+    results["export_excel"] = measure(lambda: export_excel(excel_path, invoices, balances, initial_balance), repeat)
+    results["export_excel"]["rows"] = len(invoices)
+
+    pdf_path = os.path.join(rundir, "export.pdf")
+    try:
+        results["export_pdf"] = measure(
+            lambda: export_pdf(pdf_path, invoices[:pdf_rows], balances, initial_balance), repeat)
+        results["export_pdf"]["rows"] = min(pdf_rows, len(invoices))
+    except (OSError, ImportError, RuntimeError) as e:
+        results["export_pdf"] = {"skipped": str(e)}
+    storage.close()
+    return results
+
+
+def run_qt(source, rundir, year, repeat):
+    """مسارات النافذة (تحديث القائمة والبحث) بدون شاشة عبر منصة offscreen"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt6.QtCore import QDate, Qt, QThreadPool
+        from PyQt6.QtWidgets import QApplication
+    except ImportError as e:
+        return {"skipped": str(e)}
+    from main import InvoicesWindow
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = {}
+    storage = JsonStorage(fresh_copy(source, rundir), binary_snapshot=False)
+    windows = []
+    results["window_open"] = measure(lambda: windows.append(InvoicesWindow(None, storage)), 1)
+    window = windows[0]
+    window.year_combo.setCurrentIndex(window.year_combo.findText(f"السنة المالية {year}"))
+    results["update_invoice_list"] = measure(window.update_invoice_list, repeat)
+
+    def sort_by(column, order):
+        window.tree.sortByColumn(column, order)
+        window.model.invoice_at(0)
+
+    # أول فرز يبني ترتيب العمود، وبعده تغيير الاتجاه بدون فرز
+    results["sort_column_first"] = measure(lambda: sort_by(4, Qt.SortOrder.AscendingOrder), 1)
+    results["sort_column_switch"] = measure(
+        lambda: (sort_by(4, Qt.SortOrder.DescendingOrder), sort_by(4, Qt.SortOrder.AscendingOrder)), repeat)
+    sort_by(-1, Qt.SortOrder.AscendingOrder)
+
+    def search(text):
+        window.search_edit.setText(text)
+        window.filter_invoices()
+        # انتظار خيط البحث ثم تسليم نتيجته إلى النافذة
+        while window.search_in_flight:
+            QThreadPool.globalInstance().waitForDone()
+            app.processEvents()
+
+    results["filter_invoices_text"] = measure(lambda: search("سولار"), repeat)
+    window.date_from_edit.setDate(QDate(year, 4, 1))
+    window.date_to_edit.setDate(QDate(year, 6, 30))
+    results["filter_invoices_date"] = measure(lambda: search(""), repeat)
+    window.close()
+    storage.close()
+    return results
+
+
+def run(sizes, repeat, seed, workdir, qt=True, pdf_rows=PDF_ROWS):
+    year = DEFAULT_YEARS[-1]
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "year": year,
+        "sizes": {},
+    }
+    os.makedirs(workdir, exist_ok=True)
+    for count in sizes:
+        print(f"الحجم {count}...", file=sys.stderr)
+        source = ledger_file(workdir, count, seed)
+        rundir = tempfile.mkdtemp(prefix="run-", dir=workdir)
+        try:
+            results = run_core(source, rundir, year, repeat, pdf_rows)
+            if qt:
+                results["qt"] = run_qt(source, rundir, year, repeat)
+        finally:
+            shutil.rmtree(rundir, ignore_errors=True)
+        report["sizes"][str(count)] = results
+    return report
+
+
+if __name__ == "__main__":
+    # python benchmark.py --sizes 10000 100000 --repeat 3 --output results.json
+    parser = argparse.ArgumentParser(description="قياس أداء الدفتر على بيانات صناعية")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "box-benchmark"),
+                        help="مجلد الدفاتر الصناعية (يعاد استخدامها بين التشغيلات)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--pdf-rows", type=int, default=PDF_ROWS)
+    parser.add_argument("--no-qt", action="store_true", help="تخطي مسارات النافذة")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.repeat, args.seed, args.workdir, qt=not args.no_qt, pdf_rows=args.pdf_rows)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"تم حفظ النتائج في {args.output}")
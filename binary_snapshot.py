@@ -0,0 +1,379 @@
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import MutableMapping
+
+from balance import to_milli
+from records import DATE_PATTERN, FIELD_SET, Invoice
+
+# ملف ثنائي بجانب ملف البيانات يفتح بـ mmap بدلاً من قراءة ملف JSON كاملاً:
+#   الترويسة: المعرف والإصدار وعدد الفواتير والنصوص وتوقيع ملف JSON والمجموع الاختباري
+#   أعمدة ثابتة العرض: المعرف والمدين والدائن (int64 بالألف) والتاريخ (int32 بصيغة yyyymmdd)
+#   ورقم النص لرقم الفاتورة وللبيان (uint32)
+#   جدول النصوص: إزاحات (uint32) ثم النصوص بترميز UTF-8
+BINARY_SNAPSHOT_MAGIC = b"BOXSNAP\0"
+BINARY_SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<8sHQQQqqdqqI")
+
+
+def binary_snapshot_path_for(path):
+    """مسار اللقطة الثنائية المجاورة لملف البيانات"""
+    return os.path.splitext(path)[0] + ".snap"
+
+
+def file_signature(path):
+    """حجم ملف JSON ووقت تعديله، تحفظ في اللقطة لمعرفة إن كانت قديمة"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def date_to_int(date_str):
+    return int(date_str[:4]) * 10000 + int(date_str[5:7]) * 100 + int(date_str[8:10])
+
+
+def int_to_date(value):
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+def _fixed_amount(value):
+    """المبلغ بالألف إذا كان يحفظ بدون فقدان دقة، وإلا None"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    milli = to_milli(value)
+    return milli if milli / 1000 == value else None
+
+
+def write_binary_snapshot(path, state, signature):
+    """كتابة لقطة ثنائية للدفتر بشكل آمن (ملف مؤقت ثم os.replace).
+
+    ترجع False بدون كتابة إذا كانت البيانات لا تناسب الصيغة الثابتة
+    (حقول إضافية أو تاريخ غير صالح أو مبلغ بأكثر من ثلاث خانات عشرية).
+    """
+    if sys.byteorder != "little":
+        return False
+
+    ids, debits, credits = array("q"), array("q"), array("q")
+    dates, numbers, descriptions = array("i"), array("I"), array("I")
+    strings = {}
+    for invoice in list(state["invoices"].values()):
+        debit = _fixed_amount(invoice.get("debit"))
+        credit = _fixed_amount(invoice.get("credit"))
+        if (invoice.keys() != FIELD_SET or debit is None or credit is None
+                or not isinstance(invoice["invoice_number"], str)
+                or not isinstance(invoice["description"], str)
+                or not DATE_PATTERN.fullmatch(invoice["date"])):
+            print(f"تعذر كتابة اللقطة الثنائية بسبب الفاتورة رقم {invoice.get('id')}")
+            return False
+        ids.append(invoice["id"])
+        debits.append(debit)
+        credits.append(credit)
+        dates.append(date_to_int(invoice["date"]))
+        numbers.append(strings.setdefault(invoice["invoice_number"], len(strings)))
+        descriptions.append(strings.setdefault(invoice["description"], len(strings)))
+
+    offsets = array("I", [0])
+    encoded = []
+    for value in strings:
+        data = value.encode("utf-8")
+        encoded.append(data)
+        offsets.append(offsets[-1] + len(data))
+    blob = b"".join(encoded)
+
+    body = b"".join([
+        ids.tobytes(), debits.tobytes(), credits.tobytes(), dates.tobytes(),
+        numbers.tobytes(), descriptions.tobytes(), offsets.tobytes(), blob,
+    ])
+    header = HEADER.pack(
+        BINARY_SNAPSHOT_MAGIC, BINARY_SNAPSHOT_VERSION, len(ids), len(strings), len(blob),
+        state["journal_seq"], state["next_id"], float(state["initial_balance"]),
+        signature[0], signature[1], zlib.crc32(body))
+
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"خطأ في حفظ اللقطة الثنائية: {e}")
+        return False
+    return True
+
+
+def _read_header(mm):
+    if len(mm) < HEADER.size:
+        return None
+    fields = HEADER.unpack_from(mm)
+    if fields[0] != BINARY_SNAPSHOT_MAGIC or fields[1] != BINARY_SNAPSHOT_VERSION:
+        return None
+    return fields
+
+
+def binary_snapshot_is_current(path, signature):
+    """هل اللقطة موجودة ومكتوبة من نسخة ملف JSON الحالية (تقرأ الترويسة فقط)"""
+    try:
+        with open(path, "rb") as f:
+            fields = _read_header(f.read(HEADER.size))
+    except FileNotFoundError:
+        return False
+    return fields is not None and (fields[8], fields[9]) == tuple(signature)
+
+
+def open_binary_snapshot(path, signature):
+    """فتح اللقطة بـ mmap، أو None إذا لم تكن موجودة أو كانت قديمة أو تالفة"""
+    if sys.byteorder != "little" or signature is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # ملف فارغ أو لا يمكن فتحه
+        return None
+
+    fields = _read_header(mm)
+    if fields is None:
+        print("ملف اللقطة الثنائية غير صالح. سيتم التحميل من ملف JSON")
+        mm.close()
+        return None
+    if (fields[8], fields[9]) != tuple(signature):
+        # تم تعديل ملف JSON بعد كتابة اللقطة
+        mm.close()
+        return None
+
+    snapshot = BinarySnapshot(mm, fields)
+    if not snapshot.verify(fields[10]):
+        print("ملف اللقطة الثنائية تالف. سيتم التحميل من ملف JSON")
+        snapshot.close()
+        return None
+    return snapshot
+
+
+class BinarySnapshot:
+    """أعمدة اللقطة كـ memoryview على ملف mmap، لا يتم نسخ أي صف قبل طلبه"""
+
+    def __init__(self, mm, fields):
+        count, string_count, blob_size = fields[2], fields[3], fields[4]
+        self.mm = mm
+        self.count = count
+        self.journal_seq = fields[5]
+        self.next_id = fields[6]
+        self.initial_balance = fields[7]
+        self._views = []
+        self._strings = {}
+        self._dates = {}
+
+        view = memoryview(mm)
+        self._views.append(view)
+        offset = HEADER.size
+        columns = []
+        for fmt, size, length in (("q", 8, count), ("q", 8, count), ("q", 8, count),
+                                  ("i", 4, count), ("I", 4, count), ("I", 4, count),
+                                  ("I", 4, string_count + 1)):
+            column = view[offset:offset + size * length].cast(fmt)
+            self._views.append(column)
+            columns.append(column)
+            offset += size * length
+        self.ids, self.debits, self.credits, self.dates, self.numbers, self.descriptions, self.offsets = columns
+        self.blob = view[offset:offset + blob_size]
+        self._views.append(self.blob)
+        self._size = offset + blob_size
+
+    def verify(self, checksum):
+        if self._size != len(self.mm):
+            return False
+        # المجموع الاختباري يحسب في C على الملف المعين بدون نسخه
+        return zlib.crc32(self._views[0][HEADER.size:]) == checksum
+
+    def string(self, index):
+        try:
+            return self._strings[index]
+        except KeyError:
+            value = str(self.blob[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+            self._strings[index] = value
+            return value
+
+    def date(self, position):
+        # التواريخ تتكرر كثيراً، لذلك يتم تنسيق كل تاريخ مرة واحدة فقط
+        value = self.dates[position]
+        try:
+            return self._dates[value]
+        except KeyError:
+            date_str = self._dates[value] = int_to_date(value)
+            return date_str
+
+    def field(self, position, key):
+        """قراءة حقل واحد من صف (الواجهة التي تستخدمها Invoice)"""
+        if key == "date":
+            return self.date(position)
+        if key == "debit":
+            return self.debits[position] / 1000
+        if key == "credit":
+            return self.credits[position] / 1000
+        if key == "id":
+            return self.ids[position]
+        if key == "invoice_number":
+            return self.string(self.numbers[position])
+        if key == "description":
+            return self.string(self.descriptions[position])
+        raise KeyError(key)
+
+    def extra_keys(self, position):
+        return ()
+
+    def state(self):
+        """حالة الدفتر بنفس صيغة build_state مع فواتير تقرأ عند الحاجة"""
+        return {
+            "initial_balance": self.initial_balance,
+            "journal_seq": self.journal_seq,
+            "next_id": self.next_id,
+            "invoices": SnapshotInvoices(self),
+        }
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.mm.close()
+
+
+class SnapshotInvoices(MutableMapping):
+    """قاموس الفواتير حسب المعرف فوق اللقطة الثنائية.
+
+    الفواتير تقرأ من أعمدة اللقطة مباشرة (Invoice)، والإضافات والتعديلات والحذف
+    تحفظ فوق اللقطة مع الحفاظ على ترتيب الإدخال كما في القاموس العادي.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._positions = None  # المعرف - _base -> موقع الصف، يبنى عند أول بحث بالمعرف
+        self._base = 0
+        self._replaced = {}  # معرف في اللقطة -> الفاتورة بعد التعديل، أو None بعد الحذف
+        self._added = {}
+        self._deleted = 0
+
+    def _position(self, invoice_id):
+        positions = self._positions
+        if positions is None:
+            # المعرفات متتالية لذلك يكفي array بدلاً من قاموس، من أصغر معرف في اللقطة حتى أكبرها
+            # (المعرفات عامة في الدفتر المقسم، فلا يبدأ من صفر)
+            ids = self.snapshot.ids
+            self._base = min(ids, default=0)
+            positions = array("q", [-1]) * (max(ids, default=-1) - self._base + 1)
+            for position, snapshot_id in enumerate(ids):
+                positions[snapshot_id - self._base] = position
+            self._positions = positions
+        if isinstance(invoice_id, int) and 0 <= invoice_id - self._base < len(positions):
+            position = positions[invoice_id - self._base]
+            if position >= 0:
+                return position
+        return None
+
+    def _invoice_at(self, position):
+        return Invoice(self.snapshot, position)
+
+    def __getitem__(self, invoice_id):
+        invoice = self._added.get(invoice_id)
+        if invoice is not None:
+            return invoice
+        if invoice_id in self._replaced:
+            invoice = self._replaced[invoice_id]
+            if invoice is None:
+                raise KeyError(invoice_id)
+            return invoice
+        position = self._position(invoice_id)
+        if position is None:
+            raise KeyError(invoice_id)
+        return self._invoice_at(position)
+
+    def __setitem__(self, invoice_id, invoice):
+        if (invoice_id in self._added or self._position(invoice_id) is None
+                or (invoice_id in self._replaced and self._replaced[invoice_id] is None)):
+            self._added[invoice_id] = invoice
+        else:
+            self._replaced[invoice_id] = invoice
+
+    def __delitem__(self, invoice_id):
+        if invoice_id in self._added:
+            del self._added[invoice_id]
+            return
+        position = self._position(invoice_id)
+        if position is None or (invoice_id in self._replaced and self._replaced[invoice_id] is None):
+            raise KeyError(invoice_id)
+        self._replaced[invoice_id] = None
+        self._deleted += 1
+
+    def __len__(self):
+        return self.snapshot.count - self._deleted + len(self._added)
+
+    def __iter__(self):
+        replaced = dict(self._replaced)
+        for invoice_id in self.snapshot.ids:
+            if invoice_id not in replaced or replaced[invoice_id] is not None:
+                yield invoice_id
+        yield from list(self._added)
+
+    def values(self):
+        """كل الفواتير بترتيب الإدخال (قائمة جديدة، آمنة للاستخدام من خيط آخر)"""
+        replaced = dict(self._replaced)
+        invoices = []
+        for position, invoice_id in enumerate(self.snapshot.ids):
+            if invoice_id in replaced:
+                if replaced[invoice_id] is not None:
+                    invoices.append(replaced[invoice_id])
+            else:
+                invoices.append(self._invoice_at(position))
+        invoices.extend(list(self._added.values()))
+        return invoices
+
+    def years(self):
+        """السنوات من عمود التاريخ مباشرة مع سنوات الفواتير المعدلة والمضافة"""
+        replaced = dict(self._replaced)
+        dates = self.snapshot.dates
+        if replaced:
+            years = {dates[position] // 10000
+                     for position, invoice_id in enumerate(self.snapshot.ids) if invoice_id not in replaced}
+        else:
+            years = {date // 10000 for date in dates}
+        changed = [invoice for invoice in replaced.values() if invoice is not None]
+        for invoice in changed + list(self._added.values()):
+            try:
+                years.add(int(invoice["date"][:4]))
+            except ValueError:
+                pass
+        return sorted(years)
+
+    def select(self, year, date_from, date_to, matches):
+        """الفواتير ضمن السنة ونطاق التاريخ بترتيب الإدخال.
+
+        الفلترة على عمود التاريخ الثابت مباشرة، ولا يفك إلا الصف المطابق.
+        """
+        low, high = 0, 99991231
+        if year is not None:
+            low, high = year * 10000 + 101, year * 10000 + 1231
+        if date_from is not None:
+            low = max(low, date_to_int(date_from))
+        if date_to is not None:
+            high = min(high, date_to_int(date_to))
+
+        replaced = dict(self._replaced)
+        dates = self.snapshot.dates
+        results = []
+        for position, invoice_id in enumerate(self.snapshot.ids):
+            if invoice_id in replaced:
+                invoice = replaced[invoice_id]
+                if invoice is not None and matches(invoice, year, date_from, date_to):
+                    results.append(invoice)
+            elif low <= dates[position] <= high:
+                results.append(self._invoice_at(position))
+        for invoice in list(self._added.values()):
+            if matches(invoice, year, date_from, date_to):
+                results.append(invoice)
+        return results
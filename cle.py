@@ -1,32 +1,29 @@
-import json
-import os
-
-DATA_FILE = "accounting_data.json"
-
-def clear_invoices():
-    try:
-        # تحميل البيانات الحالية (إذا كانت موجودة)
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        # إذا لم يتم العثور على الملف، فلا حاجة لعمل أي شيء
-        print("ملف البيانات غير موجود. لا يوجد فواتير للمسح.")
-        return
-    except json.JSONDecodeError:
-        # إذا كان هناك خطأ في قراءة JSON، فسيتم إنشاء بيانات جديدة
-        print("خطأ في قراءة ملف البيانات. سيتم إنشاء بيانات جديدة.")
-        data = {}
-
-    # مسح قائمة الفواتير
-    data["invoice_items"] = []
-
-    # حفظ البيانات المحدثة في الملف
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-        print("تم مسح جميع الفواتير بنجاح.")
-    except Exception as e:
-        print(f"خطأ في حفظ البيانات: {e}")
-
-# تشغيل الدالة لمسح الفواتير
-clear_invoices()
\ No newline at end of file
+import sys
+
+from storage import open_storage
+
+
+def close_finished_years():
+    """إقفال كل السنوات المنتهية بالترتيب بدلاً من مسح الفواتير.
+
+    فواتير كل سنة تنقل إلى الأرشيف (تبقى متاحة للعرض والبحث)، ورصيدها الختامي
+    يرحل كرصيد افتتاحي للسنة التالية، فيبقى ملف البيانات صغيراً بدون فقدان أي بيانات.
+    """
+    storage = open_storage()
+    try:
+        years = storage.finished_years()
+        if not years:
+            print("لا توجد سنوات منتهية لإقفالها.")
+            return
+        for year in years:
+            closing = storage.close_year(year)
+            print(f"تم إقفال السنة المالية {year}، الرصيد المرحل: {closing:.3f}")
+    except (OSError, ValueError) as e:
+        print(f"خطأ في إقفال السنة المالية: {e}")
+        sys.exit(1)
+    finally:
+        storage.close()
+
+
+# تشغيل الدالة لإقفال السنوات المنتهية
+close_finished_years()
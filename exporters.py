@@ -0,0 +1,213 @@
+import os
+import queue
+
+from balance import to_milli
+
+EXPORT_HEADERS = ["رقم الفاتورة", "التاريخ", "البيان", "مدين", "دائن", "الرصيد"]
+
+# عدد الصفوف بين كل تحديث للتقدم وفحص طلب الإلغاء
+EXPORT_CHUNK_SIZE = 5000
+
+PDF_ROWS_PER_PAGE = 30
+PDF_FONT_NAME = "BoxArabic"
+
+# خط يدعم العربية يضمن في ملف PDF؛ يمكن تحديده بمتغير البيئة BOX_PDF_FONT
+PDF_FONT_CANDIDATES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "Amiri-Regular.ttf"),
+    "C:\\Windows\\Fonts\\tahoma.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+]
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def view_rows(invoices, balances, initial_balance):
+    """صفوف التصدير بترتيب الدفتر مع الرصيد التراكمي الفعلي"""
+    opening = to_milli(initial_balance)
+    for invoice, balance in zip(invoices, balances.running_balances(invoices)):
+        yield [
+            invoice["invoice_number"],
+            invoice["date"],
+            invoice["description"],
+            invoice.get("debit", 0.0),
+            invoice.get("credit", 0.0),
+            None if balance is None else (opening + balance) / 1000,
+        ]
+
+
+def _report_progress(done, total, progress, is_cancelled):
+    if progress is not None:
+        progress(done, total)
+    if is_cancelled is not None and is_cancelled():
+        raise ExportCancelled()
+
+
+def export_excel(path, invoices, balances, initial_balance, progress=None, is_cancelled=None,
+                 chunk_size=EXPORT_CHUNK_SIZE):
+    """تصدير الفواتير إلى Excel صفاً بصف بذاكرة ثابتة (وضع constant_memory)"""
+    import xlsxwriter
+
+    total = len(invoices)
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        worksheet = workbook.add_worksheet()
+        worksheet.right_to_left()
+        header_format = workbook.add_format({"bold": True, "align": "center", "bg_color": "#f8f9fa"})
+        amount_format = workbook.add_format({"num_format": "0.000"})
+        worksheet.set_column(0, 1, 14)
+        worksheet.set_column(2, 2, 40)
+        worksheet.set_column(3, 5, 14, amount_format)
+        worksheet.write_row(0, 0, EXPORT_HEADERS, header_format)
+
+        row_number = 0
+        for row_number, row in enumerate(view_rows(invoices, balances, initial_balance), start=1):
+            worksheet.write_row(row_number, 0, row)
+            if row_number % chunk_size == 0:
+                _report_progress(row_number, total, progress, is_cancelled)
+        _report_progress(row_number, total, progress, None)
+    except ExportCancelled:
+        workbook.close()
+        os.remove(path)
+        raise
+    workbook.close()
+
+
+def find_pdf_font():
+    font_path = os.environ.get("BOX_PDF_FONT")
+    if font_path:
+        return font_path
+    for candidate in PDF_FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError("لم يتم العثور على خط يدعم العربية. حدد مسار الخط في متغير البيئة BOX_PDF_FONT")
+
+
+def arabic_text(text):
+    """تشكيل الحروف العربية وترتيبها للعرض من اليمين لليسار (reportlab لا يقوم بذلك)"""
+    try:
+        import arabic_reshaper
+        from bidi.algorithm import get_display
+    except ImportError:
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+
+def _pdf_page_table(rows, carried_forward, font_name):
+    """جدول صفحة واحدة: العناوين ثم الرصيد المنقول ثم الصفوف ثم الرصيد المرحل"""
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+
+    def rtl(cells):
+        return list(reversed(cells))
+
+    data = [rtl([arabic_text(header) for header in EXPORT_HEADERS])]
+    data.append(rtl(["", "", arabic_text("رصيد منقول"), "", "", f"{carried_forward:.3f}"]))
+    balance = carried_forward
+    for invoice_number, date, description, debit, credit, row_balance in rows:
+        if row_balance is not None:
+            balance = row_balance
+        data.append(rtl([
+            arabic_text(invoice_number),
+            date,
+            arabic_text(description),
+            f"{debit:.3f}",
+            f"{credit:.3f}",
+            "" if row_balance is None else f"{row_balance:.3f}",
+        ]))
+    data.append(rtl(["", "", arabic_text("رصيد مرحل"), "", "", f"{balance:.3f}"]))
+
+    style = TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+        ("FONTNAME", (0, 0), (-1, -1), font_name),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("FONTSIZE", (0, 0), (-1, 0), 10),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.gray),
+        ("BACKGROUND", (0, 1), (-1, 1), colors.lightgrey),
+        ("BACKGROUND", (0, -1), (-1, -1), colors.lightgrey),
+    ])
+    column_widths = list(reversed([65, 65, 200, 60, 60, 70]))
+    return Table(data, colWidths=column_widths, style=style, repeatRows=1), balance
+
+
+def _pdf_process_main(path, rows, opening, font_path, progress_queue):
+    """بناء ملف PDF في عملية منفصلة وإرسال التقدم عبر الطابور"""
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.platypus import SimpleDocTemplate, PageBreak
+
+        pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, font_path))
+
+        elements = []
+        balance = opening
+        for start in range(0, len(rows), PDF_ROWS_PER_PAGE):
+            if elements:
+                elements.append(PageBreak())
+            table, balance = _pdf_page_table(rows[start:start + PDF_ROWS_PER_PAGE], balance, PDF_FONT_NAME)
+            elements.append(table)
+        if not elements:
+            table, balance = _pdf_page_table([], balance, PDF_FONT_NAME)
+            elements.append(table)
+
+        total = len(rows)
+
+        def on_page(canvas, doc):
+            progress_queue.put(("progress", min(doc.page * PDF_ROWS_PER_PAGE, total)))
+
+        doc = SimpleDocTemplate(path, pagesize=A4)
+        doc.build(elements, onFirstPage=on_page, onLaterPages=on_page)
+    except Exception as e:
+        progress_queue.put(("error", str(e)))
+        return
+    progress_queue.put(("done", None))
+
+
+def export_pdf(path, invoices, balances, initial_balance, progress=None, is_cancelled=None):
+    """تصدير الفواتير إلى PDF مقسمة إلى صفحات، مع بناء الملف في عملية منفصلة"""
+    font_path = find_pdf_font()
+    rows = []
+    for row in view_rows(invoices, balances, initial_balance):
+        rows.append(row)
+        if len(rows) % EXPORT_CHUNK_SIZE == 0 and is_cancelled is not None and is_cancelled():
+            raise ExportCancelled()
+
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    progress_queue = context.Queue()
+    process = context.Process(target=_pdf_process_main,
+                              args=(path, rows, initial_balance, font_path, progress_queue),
+                              daemon=True)
+    process.start()
+    total = len(rows)
+    try:
+        while True:
+            if is_cancelled is not None and is_cancelled():
+                process.terminate()
+                process.join()
+                if os.path.exists(path):
+                    os.remove(path)
+                raise ExportCancelled()
+            try:
+                kind, value = progress_queue.get(timeout=0.2)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError("توقفت عملية إنشاء ملف PDF بشكل غير متوقع")
+                continue
+            if kind == "progress" and progress is not None:
+                progress(value, total)
+            elif kind == "error":
+                raise RuntimeError(value)
+            elif kind == "done":
+                break
+    finally:
+        process.join()
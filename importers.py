@@ -0,0 +1,187 @@
+import csv
+import itertools
+import json
+import os
+
+from validation import MAX_AMOUNT, parse_amount, parse_date, validate_invoice
+
+IMPORT_EXTENSIONS = (".csv", ".xlsx", ".json")
+
+# عدد الصفوف في كل دفعة تحقق، وبين كل تحديث للتقدم وفحص طلب الإلغاء
+IMPORT_CHUNK_SIZE = 5000
+
+# أسماء الأعمدة المقبولة: عناوين ملف التصدير بالعربية أو أسماء الحقول
+COLUMN_ALIASES = {
+    "رقم الفاتورة": "invoice_number",
+    "invoice_number": "invoice_number",
+    "number": "invoice_number",
+    "التاريخ": "date",
+    "date": "date",
+    "البيان": "description",
+    "الوصف": "description",
+    "description": "description",
+    "مدين": "debit",
+    "debit": "debit",
+    "دائن": "credit",
+    "credit": "credit",
+    "المبلغ": "amount",
+    "amount": "amount",
+}
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class ImportResult:
+    """نتيجة قراءة ملف الاستيراد: الفواتير الصالحة وعدد المكرر والأخطاء حسب رقم الصف"""
+
+    def __init__(self, path):
+        self.path = path
+        self.invoices = []
+        self.duplicates = 0
+        self.errors = []
+        self.rows = 0
+
+
+def _canonical(row):
+    canonical = {}
+    for key, value in row.items():
+        if isinstance(key, str):
+            field = COLUMN_ALIASES.get(key.strip().lower())
+            if field is not None:
+                canonical[field] = value
+    return canonical
+
+
+def read_csv_rows(path):
+    # utf-8-sig لأن Excel يضيف BOM عند الحفظ كـ CSV
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row_number, row in enumerate(csv.DictReader(f), start=2):
+            yield row_number, _canonical(row)
+
+
+def read_xlsx_rows(path):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if headers is None:
+            return
+        for row_number, values in enumerate(rows, start=2):
+            if all(value is None or value == "" for value in values):
+                continue
+            yield row_number, _canonical(dict(zip(headers, values)))
+    finally:
+        workbook.close()
+
+
+def read_json_rows(path):
+    """قائمة سجلات (مثل revenues.json) أو ملف بيانات البرنامج (invoice_items)"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("invoice_items", [])
+    for row_number, row in enumerate(data, start=1):
+        yield row_number, _canonical(row) if isinstance(row, dict) else {}
+
+
+def read_rows(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return read_csv_rows(path)
+    if extension == ".xlsx":
+        return read_xlsx_rows(path)
+    if extension == ".json":
+        return read_json_rows(path)
+    raise ValueError(f"نوع ملف غير مدعوم: {extension}")
+
+
+def _cell_text(value):
+    # Excel يقرأ رقم الفاتورة 1001 كـ 1001.0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value if value is not None else "").strip()
+
+
+def row_to_invoice(row, default_number):
+    """تحويل صف إلى فاتورة بنفس شروط نافذة الإضافة (ValueError برسالة الخطأ)"""
+    debit = parse_amount(row.get("debit"))
+    credit = parse_amount(row.get("credit"))
+    if "amount" in row and not debit and not credit:
+        amount = parse_amount(row["amount"])
+        # الإيرادات (مثل revenues.json) مدين، والمبالغ السالبة (مثل كشف البنك) دائن
+        if amount >= 0:
+            debit = amount
+        else:
+            credit = -amount
+    if min(debit, credit) < 0 or max(debit, credit) > MAX_AMOUNT:
+        raise ValueError("مبلغ غير صالح")
+
+    # الملفات بدون رقم فاتورة (مثل revenues.json) تأخذ رقماً ثابتاً من اسم الملف ورقم الصف
+    invoice_number = _cell_text(row["invoice_number"] if "invoice_number" in row else default_number)
+    description = _cell_text(row.get("description"))
+    error = validate_invoice(invoice_number, description, debit, credit)
+    if error is not None:
+        raise ValueError(error[1])
+    return {
+        "invoice_number": invoice_number,
+        "date": parse_date(row.get("date")),
+        "description": description,
+        "debit": debit,
+        "credit": credit,
+    }
+
+
+def _report_progress(done, progress, is_cancelled):
+    if progress is not None:
+        progress(done, 0)
+    if is_cancelled is not None and is_cancelled():
+        raise ImportCancelled()
+
+
+def read_import_file(path, storage, progress=None, is_cancelled=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """قراءة ملف الاستيراد والتحقق منه على دفعات بدون حفظ أي شيء.
+
+    المكرر (نفس رقم الفاتورة والتاريخ) في الملف أو في الدفتر يتم تجاهله؛ فواتير الدفتر
+    تقرأ مرة واحدة لكل سنة في الملف إلى فهرس hash. صفوف السنوات المقفلة أخطاء.
+    """
+    result = ImportResult(path)
+    prefix = os.path.splitext(os.path.basename(path))[0]
+    existing = {}  # السنة -> مفاتيح (رقم الفاتورة، التاريخ) في الدفتر، أو None للسنة المقفلة
+    is_archived = getattr(storage, "is_archived", None)
+    seen = set()
+    rows = read_rows(path)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        for row_number, row in chunk:
+            try:
+                invoice = row_to_invoice(row, f"{prefix}-{row_number}")
+            except ValueError as e:
+                result.errors.append((row_number, str(e)))
+                continue
+            key = (invoice["invoice_number"], invoice["date"])
+            year = int(invoice["date"][:4])
+            if year not in existing:
+                if is_archived is not None and is_archived(year):
+                    existing[year] = None
+                else:
+                    existing[year] = {
+                        (str(other["invoice_number"]).strip(), other["date"])
+                        for other in storage.query(year=year)
+                    }
+            if existing[year] is None:
+                result.errors.append((row_number, f"السنة المالية {year} مقفلة"))
+                continue
+            if key in seen or key in existing[year]:
+                result.duplicates += 1
+                continue
+            seen.add(key)
+            result.invoices.append(invoice)
+        result.rows += len(chunk)
+        _report_progress(result.rows, progress, is_cancelled)
+    return result
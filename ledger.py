@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import sys
+
+from balance import BalanceIndex, ledger_key, to_milli
+from storage import invoice_matches, open_storage
+
+EXPORT_FORMATS = ("xlsx", "pdf")
+SUMMARY_GROUPS = ("month", "year", "description")
+
+
+def fiscal_year(year=None, date_from=None, date_to=None):
+    """السنة المالية للطلب: المحددة أو سنة نطاق التاريخ أو السنة الحالية"""
+    years = {int(date[:4]) for date in (date_from, date_to) if date}
+    if year is not None:
+        years.add(year)
+    if len(years) > 1:
+        raise ValueError("يجب أن يكون نطاق التاريخ ضمن سنة مالية واحدة")
+    return years.pop() if years else datetime.date.today().year
+
+
+def closing_balance(balances, initial_balance, date_to=None):
+    """رصيد الصندوق في نهاية الفترة من فهرس الرصيد"""
+    net = balances.total() if date_to is None else balances.balance_as_of(date_to)
+    return (to_milli(initial_balance) + net) / 1000
+
+
+class Ledger:
+    """منطق الدفتر بدون واجهة: فواتير السنة المالية وفهرس رصيدها والفلترة والتصدير.
+
+    تستخدمه نافذة الفواتير وسطر الأوامر، لذلك لا يعتمد على Qt.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def initial_balance(self):
+        return self.storage.get_initial_balance()
+
+    def opening_balance(self, year):
+        """الرصيد الافتتاحي للسنة (السنة المقفلة لها رصيدها المحفوظ في الأرشيف)"""
+        if hasattr(self.storage, "opening_balance"):
+            return self.storage.opening_balance(year)
+        return self.initial_balance()
+
+    def is_archived(self, year):
+        return hasattr(self.storage, "is_archived") and self.storage.is_archived(year)
+
+    def summaries(self):
+        """مجاميع الدفتر حسب الشهر والسنة والبيان"""
+        return self.storage.summaries()
+
+    def year(self, year):
+        """فواتير السنة بترتيب الإدخال مع فهرس الرصيد المبني منها"""
+        invoices = self.storage.query(year=year)
+        return invoices, BalanceIndex(year, invoices)
+
+    def view(self, year, date_from=None, date_to=None, text=None):
+        """الفواتير المطابقة بترتيب الدفتر مع فهرس رصيد السنة كاملة.
+
+        الرصيد يحسب دائماً من كل فواتير السنة، لذلك تتم الفلترة على نفس نتيجة الاستعلام.
+        """
+        invoices, balances = self.year(year)
+        if date_from or date_to or text:
+            invoices = [invoice for invoice in invoices
+                        if invoice_matches(invoice, date_from=date_from, date_to=date_to, text=text)]
+        return sorted(invoices, key=ledger_key), balances
+
+    def export(self, path, export_format, year, date_from=None, date_to=None, text=None, progress=None):
+        from exporters import export_excel, export_pdf
+
+        export_function = {"xlsx": export_excel, "pdf": export_pdf}[export_format]
+        invoices, balances = self.view(year, date_from, date_to, text)
+        export_function(path, invoices, balances, self.opening_balance(year), progress=progress)
+        return len(invoices)
+
+
+def _date_argument(value):
+    from validation import parse_date
+
+    try:
+        return parse_date(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ledger.py", description="تقارير الصندوق بدون واجهة")
+    parser.add_argument("--data", help="ملف البيانات (JSON أو SQLite أو مجلد السنوات) أو عنوان خادم الدفتر "
+                             "(http://المضيف:المنفذ)، الافتراضي BOX_DATA_FILE")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_filters(command):
+        command.add_argument("--year", type=int)
+        command.add_argument("--from", dest="date_from", type=_date_argument)
+        command.add_argument("--to", dest="date_to", type=_date_argument)
+
+    balance = commands.add_parser("balance", help="رصيد الصندوق في نهاية السنة أو في تاريخ محدد")
+    add_filters(balance)
+
+    query = commands.add_parser("query", help="طباعة الفواتير المطابقة مع الرصيد (مفصولة بـ Tab)")
+    add_filters(query)
+    query.add_argument("--text")
+
+    export = commands.add_parser("export", help="تصدير الفواتير المطابقة إلى Excel أو PDF")
+    add_filters(export)
+    export.add_argument("--text")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="xlsx")
+    export.add_argument("--output", help="الافتراضي invoices.<الصيغة>")
+
+    summary = commands.add_parser("summary", help="مجاميع المدين والدائن حسب الشهر أو السنة أو البيان")
+    summary.add_argument("--by", choices=SUMMARY_GROUPS, default="month")
+    summary.add_argument("--year", type=int)
+    summary.add_argument("--month", help="yyyy-MM (للتجميع حسب البيان)")
+
+    close_year = commands.add_parser("close-year", help="إقفال سنة منتهية ونقل فواتيرها إلى الأرشيف")
+    close_year.add_argument("--year", type=int, required=True)
+    return parser
+
+
+def run(args):
+    if args.command == "close-year":
+        storage = open_storage(args.data, background_frame=False)
+        try:
+            closing = storage.close_year(args.year)
+        finally:
+            storage.close()
+        print(f"تم إقفال السنة المالية {args.year}، الرصيد المرحل: {closing:.3f}")
+        return
+
+    if args.command == "summary":
+        storage = open_storage(args.data, background_frame=False)
+        try:
+            summaries = Ledger(storage).summaries()
+            if args.by == "month":
+                rows = summaries.by_month(args.year)
+            elif args.by == "year":
+                rows = summaries.by_year()
+            else:
+                rows = summaries.by_description(args.year, args.month)
+        finally:
+            storage.close()
+        for row in rows:
+            print(f"{row['label']}\t{row['debit']:.3f}\t{row['credit']:.3f}\t{row['net']:.3f}\t{row['count']}")
+        return
+
+    year = fiscal_year(args.year, args.date_from, args.date_to)
+    storage = open_storage(args.data, background_frame=False)
+    try:
+        ledger = Ledger(storage)
+        if args.command == "balance":
+            _, balances = ledger.year(year)
+            print(f"{closing_balance(balances, ledger.opening_balance(year), args.date_to):.3f}")
+        elif args.command == "query":
+            from exporters import view_rows
+
+            invoices, balances = ledger.view(year, args.date_from, args.date_to, args.text)
+            for row in view_rows(invoices, balances, ledger.opening_balance(year)):
+                print("\t".join("" if value is None else str(value) for value in row))
+        else:
+            output = args.output or f"invoices.{args.format}"
+            count = ledger.export(output, args.format, year, args.date_from, args.date_to, args.text)
+            print(f"تم تصدير {count} فاتورة إلى {output}")
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    # python ledger.py balance --year 2025
+    # python ledger.py --data ledger.db query --text سولار --year 2025
+    # python ledger.py export --format xlsx --from 2025-01-01 --to 2025-03-31 --output q1.xlsx
+    # python ledger.py summary --by description --month 2025-03
+    # python ledger.py close-year --year 2024
+    arguments = build_parser().parse_args()
+    try:
+        run(arguments)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"خطأ: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import json
+import sys
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import perf
+from storage import open_storage
+from validation import parse_amount, parse_date
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# العمليات المسموح بها من العملاء: القراءة تنفذ مباشرة، والتعديل يجمع في دفعات
+READ_METHODS = ("get_initial_balance", "query", "years", "get_invoice", "load", "summaries",
+                "is_archived", "opening_balance", "finished_years")
+WRITE_METHODS = ("add_invoice", "add_invoices", "update_invoice", "delete_invoice", "delete_invoices",
+                 "set_initial_balance", "close_year")
+
+# الأخطاء التي ترجع للعميل بنوعها (غيرها خطأ في الخادم)
+CLIENT_ERRORS = (KeyError, ValueError, TypeError)
+
+# عدد التعديلات الأخيرة المحفوظة للعملاء المتأخرين؛ العميل الأقدم منها يعيد التحميل
+CHANGES_KEPT = 10000
+
+# أطول انتظار لطلب التعديلات الجديدة (بالثواني)
+MAX_CHANGES_WAIT = 30
+
+# الفترة بين كل فحص لتعديلات البرامج الأخرى على ملف البيانات (بالثواني)
+WATCH_INTERVAL = 1.0
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+def _error_message(error):
+    # KeyError يضع رسالته بين علامتي تنصيص في str
+    return str(error.args[0]) if isinstance(error, KeyError) and error.args else str(error)
+
+
+def client_invoice(value):
+    """الفاتورة من العميل بالحقول والأنواع التي يتوقعها المخزن (ValueError لغير ذلك).
+
+    المعرف لا يؤخذ من العميل؛ المخزن يعطي المعرف التالي.
+    """
+    if not isinstance(value, dict):
+        raise ValueError("الفاتورة يجب أن تكون كائن JSON")
+    try:
+        return {
+            "invoice_number": str(value["invoice_number"]),
+            "date": parse_date(value["date"]),
+            "description": str(value["description"]),
+            "debit": parse_amount(value.get("debit")),
+            "credit": parse_amount(value.get("credit")),
+        }
+    except KeyError as e:
+        raise ValueError(f"حقل ناقص في الفاتورة: {e.args[0]}")
+
+
+class LedgerServer:
+    """خادم دفتر محلي (HTTP/JSON) يملك المخزن وتتصل به نوافذ الفواتير على عدة أجهزة.
+
+    كل عمليات المخزن تنفذ في خيط واحد، فلا يتداخل تعديلان. التعديلات التي تصل معاً تطبق
+    كدفعة واحدة ثم تكتب على القرص بـ sync واحد قبل الرد عليها كلها.
+
+    كل تعديل يضاف إلى سجل تعديلات مرقم، والعملاء ينتظرون الجديد منه بطلب
+    GET /changes?since=<رقم> (انتظار طويل) بدلاً من إعادة تحميل الدفتر.
+    """
+
+    def __init__(self, path=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.storage = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._server = None
+        self._writes = None
+        self._tasks = []
+        self._connections = set()
+        self._seq = 0
+        self._events = deque(maxlen=CHANGES_KEPT)  # (الرقم، العميل، التعديل)
+        self._new_events = None
+        self._closing = False
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def start(self):
+        """فتح المخزن وبدء الاستماع؛ المنفذ 0 يختار منفذاً متاحاً (self.port بعد البدء)"""
+        self.storage = await self._run(open_storage, self.path, False)
+        self._writes = asyncio.Queue()
+        self._new_events = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tasks = [asyncio.create_task(self._commit_main()), asyncio.create_task(self._watch_main())]
+
+    async def close(self):
+        self._closing = True
+        self._new_events.set()
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        for task in self._tasks:
+            task.cancel()
+        await self._run(self.storage.close)
+        self._executor.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"خادم الدفتر يعمل على http://{self.host}:{self.port}")
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _handle(self, reader, writer):
+        """اتصال واحد يبقى مفتوحاً لعدة طلبات (HTTP/1.1 keep-alive)"""
+        self._connections.add(writer)
+        try:
+            while not self._closing:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                status, data = await self._dispatch(method, target, body)
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        name = url.path.strip("/")
+        try:
+            if method == "GET" and name == "changes":
+                query = urllib.parse.parse_qs(url.query)
+                return 200, self._encode(await self._changes(
+                    int(query.get("since", ["-1"])[0]),
+                    min(float(query.get("wait", ["0"])[0]), MAX_CHANGES_WAIT),
+                    query.get("client", [""])[0]))
+            if method != "POST" or name not in READ_METHODS + WRITE_METHODS:
+                return 404, self._encode({"error": f"عملية غير معروفة: {method} {url.path}", "type": "ValueError"})
+            request = json.loads(body or b"{}")
+            if not isinstance(request, dict) or not isinstance(request.get("arguments", {}), dict):
+                raise ValueError("صيغة الطلب غير صحيحة")
+            arguments = request.get("arguments", {})
+            if name in READ_METHODS:
+                return await self._run(self._read, name, arguments)
+            future = asyncio.get_running_loop().create_future()
+            self._writes.put_nowait((name, arguments, request.get("client", ""), future))
+            return await future
+        except (ValueError, KeyError) as e:
+            return 400, self._encode({"error": str(e), "type": "ValueError"})
+
+    @staticmethod
+    def _encode(payload):
+        return json.dumps(payload, ensure_ascii=False, default=dict).encode("utf-8")
+
+    def _read(self, name, arguments):
+        """عملية قراءة في خيط المخزن، مع تحويل النتيجة إلى JSON في نفس الخيط"""
+        try:
+            result = getattr(self.storage, name)(**arguments)
+        except CLIENT_ERRORS as e:
+            return 400, self._encode({"error": _error_message(e), "type": type(e).__name__})
+        except Exception as e:
+            print(f"خطأ في خادم الدفتر ({name}): {e}")
+            return 500, self._encode({"error": str(e), "type": "RuntimeError"})
+        if name == "summaries":
+            # [الشهر، البيان، المدين، الدائن، العدد] بالألف كما في Summaries.merge
+            result = [[month, result.labels.get(description, description), debit, credit, count]
+                      for (month, description), (debit, credit, count) in result.descriptions.items()]
+        return 200, self._encode({"result": result})
+
+    def _write(self, name, arguments):
+        """تطبيق تعديل واحد وإرجاع نتيجته مع التعديلات التي يرسلها للعملاء الآخرين"""
+        storage = self.storage
+        if name == "add_invoice":
+            invoice = client_invoice(arguments["invoice"])
+            storage.add_invoice(invoice)
+            return invoice["id"], [{"old": None, "new": invoice}]
+        if name == "add_invoices":
+            invoices = [client_invoice(invoice) for invoice in arguments["invoices"]]
+            storage.add_invoices(invoices)
+            return [invoice["id"] for invoice in invoices], [{"old": None, "new": invoice} for invoice in invoices]
+        if name == "update_invoice":
+            new_invoice = client_invoice(arguments["new_invoice"])
+            old_invoice = dict(storage.get_invoice(arguments["invoice_id"]))
+            storage.update_invoice(arguments["invoice_id"], new_invoice)
+            return None, [{"old": old_invoice, "new": new_invoice}]
+        if name in ("delete_invoice", "delete_invoices"):
+            invoice_ids = arguments.get("invoice_ids", [arguments.get("invoice_id")])
+            old_invoices = [dict(storage.get_invoice(invoice_id)) for invoice_id in invoice_ids]
+            getattr(storage, name)(**arguments)
+            return None, [{"old": invoice, "new": None} for invoice in old_invoices]
+        if name == "set_initial_balance":
+            storage.set_initial_balance(arguments["value"])
+            return None, [{"initial_balance": arguments["value"]}]
+        # إقفال سنة يغير الأرشيف والرصيد الافتتاحي، فيعيد العملاء التحميل
+        return getattr(storage, name)(**arguments), [{"reload": True}]
+
+    def _commit(self, batch):
+        """تطبيق دفعة تعديلات بالترتيب ثم كتابتها على القرص مرة واحدة (في خيط المخزن)"""
+        responses = []
+        with perf.timed("server_commit") as op:
+            for name, arguments, client, _ in batch:
+                try:
+                    result, events = self._write(name, arguments)
+                except CLIENT_ERRORS as e:
+                    responses.append((400, self._encode({"error": _error_message(e), "type": type(e).__name__}), client, []))
+                    continue
+                except Exception as e:
+                    print(f"خطأ في خادم الدفتر ({name}): {e}")
+                    responses.append((500, self._encode({"error": str(e), "type": "RuntimeError"}), client, []))
+                    continue
+                responses.append((200, self._encode({"result": result}), client, events))
+            # عند فشل الكتابة تبقى التعديلات في الذاكرة ويعاد المحاولة مع الدفعة التالية،
+            # والخطأ يطبع في نافذة الخادم كما في وضع الملف المحلي
+            self.storage.sync()
+            op.rows = len(batch)
+        return responses
+
+    async def _commit_main(self):
+        while True:
+            batch = [await self._writes.get()]
+            while not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            responses = await self._run(self._commit, batch)
+            for (status, data, client, events), (_, _, _, future) in zip(responses, batch):
+                self._publish(client, events)
+                if not future.done():
+                    future.set_result((status, data))
+
+    def _watch(self):
+        """تعديلات البرامج الأخرى على ملف البيانات (مثلاً cle.py) بصيغة سجل التعديلات"""
+        initial_balance = self.storage.get_initial_balance()
+        changes = self.storage.refresh()
+        if changes is None:
+            return [{"reload": True}]
+        events = [{"old": old_invoice, "new": new_invoice} for old_invoice, new_invoice in changes]
+        balance = self.storage.get_initial_balance()
+        if balance != initial_balance:
+            events.append({"initial_balance": balance})
+        return events
+
+    async def _watch_main(self):
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            try:
+                events = await self._run(self._watch)
+            except (OSError, ValueError) as e:
+                print(f"تعذر قراءة تعديلات ملف البيانات: {e}")
+                continue
+            self._publish("", events)
+
+    def _publish(self, client, events):
+        if not events:
+            return
+        for event in events:
+            self._seq += 1
+            self._events.append((self._seq, client, event))
+        # إيقاظ كل العملاء المنتظرين ثم حدث جديد للانتظار التالي
+        self._new_events.set()
+        self._new_events = asyncio.Event()
+
+    async def _changes(self, since, wait, client):
+        """التعديلات بعد الرقم since (بدون تعديلات العميل نفسه)، مع الانتظار حتى wait ثانية.
+
+        since=-1 يرجع الرقم الحالي فقط؛ العميل الأقدم من السجل المحفوظ أو من تشغيل سابق
+        للخادم يحصل على reload.
+        """
+        if since < 0:
+            return {"seq": self._seq, "events": []}
+        if since == self._seq and wait > 0 and not self._closing:
+            try:
+                await asyncio.wait_for(self._new_events.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        first = self._events[0][0] if self._events else self._seq + 1
+        if since > self._seq or since + 1 < first:
+            return {"seq": self._seq, "events": [{"reload": True}]}
+        return {
+            "seq": self._seq,
+            "events": [event for seq, sender, event in self._events if seq > since and sender != client],
+        }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ledger_server.py", description="خادم دفتر مشترك بين عدة أجهزة")
+    parser.add_argument("--data", help="ملف البيانات (JSON أو SQLite أو مجلد السنوات)، الافتراضي BOX_DATA_FILE")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="0.0.0.0 للاتصال من أجهزة أخرى (بدون تحقق من الهوية، للشبكة المحلية فقط)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    return parser
+
+
+if __name__ == "__main__":
+    # python ledger_server.py --data ledger.db --host 0.0.0.0
+    # على كل جهاز: BOX_DATA_FILE=http://<جهاز الخادم>:8765 python main.py
+    arguments = build_parser().parse_args()
+    try:
+        asyncio.run(LedgerServer(arguments.data, arguments.host, arguments.port).serve_forever())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"خطأ: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -1,19 +1,36 @@
+import time
+
+STARTUP_BEGIN = time.perf_counter()
+
+import os
+import re
 import sys
-import json
+import bisect
 import datetime
+import functools
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QLabel, QPushButton, QMenuBar, QMenu,
-                             QTreeWidget, QTreeWidgetItem, QDialog, QFormLayout, QLineEdit,
+                             QTreeView, QDialog, QFormLayout, QLineEdit,
                              QDialogButtonBox, QDateEdit, QMessageBox, QComboBox, QHeaderView,
-                             QFileDialog, QInputDialog, QSpacerItem, QSizePolicy)
-from PyQt6.QtCore import Qt, QDate, QSize, QSortFilterProxyModel
-from PyQt6.QtGui import QIcon, QFont, QKeySequence, QDoubleValidator, QShortcut
-import pandas as pd
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+                             QFileDialog, QInputDialog, QSpacerItem, QSizePolicy, QProgressDialog,
+                             QTableWidget, QTableWidgetItem, QTabWidget)
+from PyQt6.QtCore import (Qt, QDate, QSize, QAbstractTableModel,
+                          QModelIndex, QTimer, QThreadPool, QRunnable, QObject, pyqtSignal)
+from PyQt6.QtGui import QIcon, QFont, QKeySequence, QDoubleValidator, QShortcut, QPixmap, QGuiApplication
+
+PYQT_IMPORTED = time.perf_counter()
+
+# pandas و reportlab و xlsxwriter يتم استيرادها عند أول استخدام فقط
+import perf
+from storage import open_storage, invoice_matches
+from balance import ledger_key, to_milli
+from ledger import Ledger, closing_balance
+from exporters import ExportCancelled, export_excel, export_pdf
+from importers import ImportCancelled, read_import_file
+from validation import validate_invoice
+
+IMPORTS_DONE = time.perf_counter()
 
-DATA_FILE = "accounting_data.json"
 
 class MainApp(QMainWindow):
     def __init__(self):
@@ -22,6 +39,9 @@ class MainApp(QMainWindow):
         self.setWindowTitle("برنامج المحاسبة")
         self.showMaximized()
 
+        self.storage = None
+        self.session = None
+        self.invoices_window = None
         self.create_menu()
         self.create_central_widget()
 
@@ -35,6 +55,18 @@ class MainApp(QMainWindow):
         invoices_menu = menu_bar.addMenu("الفواتير")
         open_invoices_action = invoices_menu.addAction("فتح الفواتير")
         open_invoices_action.triggered.connect(self.open_invoices_window)
+        new_window_action = invoices_menu.addAction("نافذة فواتير جديدة")
+        new_window_action.triggered.connect(self.open_new_invoices_window)
+        close_year_action = invoices_menu.addAction("إقفال السنة المالية")
+        close_year_action.triggered.connect(self.close_fiscal_year)
+
+        performance_menu = menu_bar.addMenu("الأداء")
+        self.perf_action = performance_menu.addAction("تفعيل قياس الأداء")
+        self.perf_action.setCheckable(True)
+        self.perf_action.setChecked(perf.is_enabled())
+        self.perf_action.toggled.connect(perf.set_enabled)
+        show_perf_action = performance_menu.addAction("عرض الأداء")
+        show_perf_action.triggered.connect(self.open_performance_dialog)
 
         menu_bar.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
 
@@ -48,23 +80,546 @@ class MainApp(QMainWindow):
 
         self.setCentralWidget(central_widget)
 
+    def get_storage(self):
+        """مخزن البيانات المشترك: يتم تحميل ملف البيانات مرة واحدة فقط"""
+        if self.storage is None:
+            self.storage = open_storage()
+            report_storage_errors(self.storage, self)
+        return self.storage
+
+    def get_session(self):
+        """جلسة الدفتر المشتركة بين كل نوافذ الفواتير"""
+        if self.session is None:
+            self.session = LedgerSession(self.get_storage(), self)
+        return self.session
+
     def open_invoices_window(self):
-        self.invoices_window = InvoicesWindow(self)
-        self.invoices_window.show()
+        """إظهار نافذة الفواتير؛ يتم إنشاؤها مرة واحدة ثم يعاد إظهارها كما هي"""
+        if self.invoices_window is None:
+            self.invoices_window = InvoicesWindow(self, session=self.get_session())
+        window = self.invoices_window
+        if window.isMinimized():
+            window.showNormal()
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    def open_new_invoices_window(self):
+        """نافذة إضافية على نفس الجلسة (مثلاً لعرض سنتين معاً)، تحذف عند إغلاقها"""
+        window = InvoicesWindow(self, session=self.get_session())
+        window.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        window.show()
+
+    def close_fiscal_year(self):
+        """إقفال أقدم سنة منتهية: نقل فواتيرها إلى الأرشيف وترحيل رصيدها الختامي"""
+        storage = self.get_storage()
+        years = storage.finished_years()
+        if not years:
+            QMessageBox.information(self, "إقفال السنة المالية", "لا توجد سنوات منتهية لإقفالها.")
+            return
+        # السنوات تقفل بالترتيب لأن رصيد كل سنة يرحل إلى التي بعدها
+        year = years[0]
+        message = (f"سيتم نقل فواتير السنة المالية {year} إلى الأرشيف وترحيل رصيدها الختامي "
+                   f"كرصيد افتتاحي للسنة التالية.\n")
+        # الرصيد الافتتاحي مشترك بين السنوات المفتوحة، فيتغير رصيد كل سنة بعد السنة المقفلة
+        later = [other for other in storage.years() if other > year]
+        if later:
+            message += (f"الرصيد الافتتاحي الحالي ({storage.get_initial_balance():.3f}) سيستبدل برصيد نهاية "
+                        f"السنة {year}، لذلك ستتغير أرصدة السنوات المفتوحة التالية: "
+                        f"{'، '.join(str(other) for other in later)}.\n")
+        answer = QMessageBox.question(self, "إقفال السنة المالية", message + "هل تريد المتابعة؟")
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            closing = storage.close_year(year)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "خطأ", f"تعذر إقفال السنة المالية: {e}")
+            return
+        storage.flush_in_background()
+        QMessageBox.information(self, "إقفال السنة المالية",
+                                f"تم إقفال السنة المالية {year}.\nالرصيد المرحل: {closing:.3f}")
+        self.get_session().ledger_changed.emit()
+
+    def open_performance_dialog(self):
+        self.performance_dialog = PerformanceDialog(self)
+        self.performance_dialog.show()
+
+    def closeEvent(self, event):
+        # نوافذ الفواتير تستخدم نفس المخزن، لذلك تغلق قبل إغلاقه
+        for window in self.findChildren(InvoicesWindow):
+            window.close()
+        if self.session is not None:
+            self.session.watch_timer.stop()
+        if self.storage is not None:
+            self.storage.close()
+        super().closeEvent(event)
+
+
+# الفترة بين كل فحص لتعديلات البرامج الأخرى على ملف البيانات (بالمللي ثانية)
+WATCH_INTERVAL_MS = 1000
+
+# التعديلات الخارجية الأكثر من هذا العدد يعاد بعدها تحميل السنة المعروضة بدلاً من تطبيقها واحداً واحداً
+EXTERNAL_CHANGES_LIMIT = 500
+
+
+class LedgerSession(QObject):
+    """الدفتر المفتوح المشترك بين نوافذ الفواتير: مخزن واحد في الذاكرة.
+
+    النافذة التي تعدل الدفتر ترسل التعديل كإشارة، فتتحدث كل النوافذ (المخفية أيضاً)
+    تدريجياً بدون إعادة تحميل. تعديلات البرامج الأخرى (cle.py وسطر الأوامر) تقرأ كل
+    WATCH_INTERVAL_MS وترسل بنفس الإشارات، وتعديلات الأجهزة الأخرى على خادم الدفتر
+    تقرأ فور وصولها.
+    """
+
+    invoice_added = pyqtSignal(object)
+    invoice_removed = pyqtSignal(object)
+    initial_balance_changed = pyqtSignal(float)
+    # تغيير كبير (استيراد أو إقفال سنة): كل نافذة تعيد تحميل السنة المعروضة
+    ledger_changed = pyqtSignal()
+    # وصلت تعديلات من خادم الدفتر (من خيط الانتظار، لذلك عبر إشارة إلى خيط الواجهة)
+    changes_received = pyqtSignal()
+
+    def __init__(self, storage, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self.ledger = Ledger(storage)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setInterval(WATCH_INTERVAL_MS)
+        self.watch_timer.timeout.connect(self.check_external_changes)
+        self.watch_timer.start()
+        self.changes_received.connect(self.check_external_changes)
+        storage.add_change_listener(self.changes_received.emit)
+
+    def check_external_changes(self):
+        initial_balance = self.storage.get_initial_balance()
+        try:
+            changes = self.storage.refresh()
+        except (OSError, ValueError) as e:
+            print(f"تعذر قراءة تعديلات ملف البيانات: {e}")
+            return
+        if changes is None or len(changes) > EXTERNAL_CHANGES_LIMIT:
+            self.ledger_changed.emit()
+            return
+        for old_invoice, new_invoice in changes:
+            if old_invoice is not None:
+                self.invoice_removed.emit(old_invoice)
+            if new_invoice is not None:
+                self.invoice_added.emit(new_invoice)
+        balance = self.storage.get_initial_balance()
+        if balance != initial_balance:
+            self.initial_balance_changed.emit(balance)
 
 
-class InvoicesWindow(QMainWindow):
+@functools.lru_cache(maxsize=None)
+def cached_icon(path, size=48):
+    """أيقونة مصغرة إلى حجم الزر مرة واحدة لكل البرنامج (الصور الأصلية كبيرة، delete.png وحده 225 KB)"""
+    pixmap = QPixmap(path)
+    if pixmap.isNull():
+        print(f"تعذر تحميل الأيقونة: {path}")
+        return QIcon()
+    ratio = QGuiApplication.primaryScreen().devicePixelRatio() if QGuiApplication.primaryScreen() else 1.0
+    pixmap = pixmap.scaled(round(size * ratio), round(size * ratio), Qt.AspectRatioMode.KeepAspectRatio,
+                           Qt.TransformationMode.SmoothTransformation)
+    pixmap.setDevicePixelRatio(ratio)
+    return QIcon(pixmap)
+
+
+class StorageErrorSignals(QObject):
+    failed = pyqtSignal(str)
+
+
+def report_storage_errors(storage, parent):
+    """عرض أخطاء الحفظ في الخلفية في رسالة (الإشارة تنقل الخطأ من خيط الكتابة إلى خيط الواجهة)"""
+    signals = StorageErrorSignals(parent)
+    signals.failed.connect(lambda message: QMessageBox.critical(parent, "خطأ في الحفظ", message))
+    storage.add_error_listener(signals.failed.emit)
+
+
+# مهلة انتظار توقف الكتابة قبل تنفيذ البحث (بالمللي ثانية)
+SEARCH_DEBOUNCE_MS = 250
+
+
+class QueryWorkerSignals(QObject):
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+
+class QueryWorker(QRunnable):
+    """تنفيذ استعلام البحث في خيط خلفي وإرسال النتيجة مع رقم الطلب"""
+
+    def __init__(self, storage, generation, current_filter):
+        super().__init__()
+        self.storage = storage
+        self.generation = generation
+        self.current_filter = current_filter
+        self.signals = QueryWorkerSignals()
+
+    def run(self):
+        try:
+            results = self.storage.query(**self.current_filter)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        self.signals.finished.emit(self.generation, results)
+
+
+class ExportWorkerSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class ExportWorker(QRunnable):
+    """تنفيذ دالة تصدير في خيط خلفي مع إرسال التقدم وإمكانية الإلغاء"""
+
+    def __init__(self, export_function, path, *args):
+        super().__init__()
+        self.export_function = export_function
+        self.path = path
+        self.args = args
+        self.signals = ExportWorkerSignals()
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            with perf.timed(self.export_function.__name__) as op:
+                op.rows = len(self.args[0])
+                self.export_function(self.path, *self.args,
+                                     progress=self.signals.progress.emit,
+                                     is_cancelled=lambda: self._cancelled)
+                op.bytes_written = os.path.getsize(self.path)
+        except ExportCancelled:
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(self.path)
+
+
+class ImportWorkerSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class ImportWorker(QRunnable):
+    """قراءة ملف الاستيراد والتحقق منه في خيط خلفي؛ الحفظ يتم في الخيط الرئيسي دفعة واحدة"""
+
+    def __init__(self, path, storage):
+        super().__init__()
+        self.path = path
+        self.storage = storage
+        self.signals = ImportWorkerSignals()
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            with perf.timed("import") as op:
+                op.bytes_read = os.path.getsize(self.path)
+                result = read_import_file(self.path, self.storage,
+                                          progress=self.signals.progress.emit,
+                                          is_cancelled=lambda: self._cancelled)
+                op.rows = result.rows
+        except ImportCancelled:
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(result)
+
+
+NATURAL_PARTS = re.compile(r"(\d+)")
+
+# مفتاح الرصيد للفواتير خارج السنة (بدون رصيد) حتى تظهر في أول الترتيب
+NO_BALANCE = -(1 << 62)
+
+
+def natural_key(text):
+    """ترتيب طبيعي لأرقام الفواتير: INV-2 قبل INV-10"""
+    text = str(text)
+    if text.isdigit():  # الحالة الغالبة: رقم فقط
+        return ((0, int(text), ""),)
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part.casefold())
+                 for part in NATURAL_PARTS.split(text) if part)
+
+
+@functools.lru_cache(maxsize=4096)
+def date_ordinal(date_str):
+    """رقم اليوم للفرز (التواريخ غير الصحيحة في أول الترتيب)"""
+    try:
+        return datetime.date.fromisoformat(date_str).toordinal()
+    except ValueError:
+        return 0
+
+
+class InvoiceTableModel(QAbstractTableModel):
+    """نموذج جدول الفواتير: يتم تنسيق الخلايا فقط عند رسمها.
+
+    الفواتير محفوظة بترتيب الدفتر (التاريخ ثم المعرف) وتعرض الأحدث أولاً،
+    والرصيد في كل صف يقرأ من فهرس الرصيد التراكمي.
+
+    الفرز بالنقر على العنوان يستخدم مفاتيح حسب نوع العمود (المبالغ بالمللي، والتاريخ
+    برقم اليوم، ورقم الفاتورة بالترتيب الطبيعي). ترتيب كل عمود يبنى مرة واحدة ثم يحدث
+    بالإضافة والحذف، لذلك تغيير العمود أو الاتجاه لا يعيد الفرز.
+    """
+
+    HEADERS = ["الرقم", "رقم الفاتورة", "التاريخ", "البيان", "مدين", "دائن", "الرصيد"]
+    BALANCE_COLUMN = 6
+
+    SORT_KEYS = {
+        1: lambda invoice: natural_key(invoice["invoice_number"]),
+        2: lambda invoice: date_ordinal(invoice["date"]),
+        3: lambda invoice: invoice["description"].casefold(),
+        4: lambda invoice: to_milli(invoice.get("debit", 0.0)),
+        5: lambda invoice: to_milli(invoice.get("credit", 0.0)),
+    }
+
     def __init__(self, parent=None):
         super().__init__(parent)
+        self._invoices = []
+        self._keys = []
+        self._balances = None
+        self._initial_balance = 0
+        # العمود -1 أو 0 هو ترتيب الدفتر، وباقي الأعمدة من _sorted
+        self._sort_column = -1
+        self._sort_order = Qt.SortOrder.DescendingOrder
+        self._sorted = {}
+
+    def set_invoices(self, invoices, balances, initial_balance):
+        """استبدال الصفوف المعروضة"""
+        self.beginResetModel()
+        self._invoices = sorted(invoices, key=ledger_key)
+        self._keys = [ledger_key(invoice) for invoice in self._invoices]
+        self._balances = balances
+        self._initial_balance = to_milli(initial_balance)
+        self._sorted = {}
+        self.endResetModel()
+
+    def set_initial_balance(self, initial_balance):
+        # تغيير الرصيد الافتتاحي يزيح كل الأرصدة بنفس المقدار ولا يغير ترتيبها
+        self._initial_balance = to_milli(initial_balance)
+        self.balances_changed()
+
+    def balances_changed(self):
+        """إعادة رسم عمود الرصيد فقط (يتم حسابه عند الرسم)"""
+        if self._invoices:
+            self.dataChanged.emit(self.index(0, self.BALANCE_COLUMN),
+                                  self.index(len(self._invoices) - 1, self.BALANCE_COLUMN))
+
+    def _balance_key(self, invoice):
+        try:
+            return self._balances.balance_after(invoice)
+        except ValueError:
+            return NO_BALANCE
+
+    def _sort_key(self, column, invoice):
+        if column == self.BALANCE_COLUMN:
+            return self._balance_key(invoice)
+        return self.SORT_KEYS[column](invoice)
+
+    def _column_keys(self, column):
+        """مفاتيح العمود لكل الفواتير بترتيب الدفتر"""
+        if column == self.BALANCE_COLUMN:
+            return [NO_BALANCE if balance is None else balance
+                    for balance in self._balances.running_balances(self._invoices)]
+        return list(map(self.SORT_KEYS[column], self._invoices))
+
+    def _entries(self, column):
+        """ترتيب العمود تصاعدياً: (مفاتيح (المفتاح، مفتاح الدفتر)، الفواتير) كقائمتين متوازيتين"""
+        entries = self._sorted.get(column)
+        if entries is None:
+            with perf.timed("sort_column") as op:
+                keys = self._column_keys(column)
+                # الفرز مستقر والفواتير بترتيب الدفتر، فالقيم المتساوية تبقى بترتيب الدفتر
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                entries = ([(keys[i], self._keys[i]) for i in order], [self._invoices[i] for i in order])
+                op.rows = len(order)
+            self._sorted[column] = entries
+        return entries
+
+    def _by_ledger(self):
+        return self._sort_column <= 0
+
+    def _ascending(self):
+        return self._sort_order == Qt.SortOrder.AscendingOrder
+
+    def _row_of_index(self, index, count):
+        """رقم الصف المعروض لموضع في ترتيب مكون من count عنصر"""
+        return index if self._ascending() else count - 1 - index
+
+    def _row_of_invoice(self, invoice):
+        key = ledger_key(invoice)
+        if self._by_ledger():
+            index = bisect.bisect_left(self._keys, key)
+        else:
+            index = bisect.bisect_left(self._entries(self._sort_column)[0],
+                                       (self._sort_key(self._sort_column, invoice), key))
+        return self._row_of_index(index, len(self._invoices))
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        """يستدعيه العرض عند النقر على عنوان عمود؛ العمود -1 يعيد ترتيب الدفتر (الأحدث أولاً)"""
+        if column < 0:
+            order = Qt.SortOrder.DescendingOrder
+        if column == self._sort_column and order == self._sort_order:
+            return
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        invoices = [self.invoice_at(index.row()) for index in persistent]
+        self._sort_column = column
+        self._sort_order = order
+        self.changePersistentIndexList(persistent, [
+            self.index(self._row_of_invoice(invoice), index.column())
+            for invoice, index in zip(invoices, persistent)
+        ])
+        self.layoutChanged.emit()
+
+    def _balance_order_changes(self):
+        """إضافة أو حذف فاتورة يغير أرصدة ما بعدها، فترتيب عمود الرصيد يعاد بناؤه"""
+        self._sorted.pop(self.BALANCE_COLUMN, None)
+        return self._sort_column == self.BALANCE_COLUMN
+
+    def insert_invoice(self, invoice):
+        key = ledger_key(invoice)
+        position = bisect.bisect_left(self._keys, key)
+        if self._balance_order_changes():
+            self.beginResetModel()
+            self._insert(position, key, invoice)
+            self.endResetModel()
+            return
+        row = self._row_of_invoice(invoice) + (0 if self._ascending() else 1)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._insert(position, key, invoice)
+        self.endInsertRows()
+
+    def _insert(self, position, key, invoice):
+        self._invoices.insert(position, invoice)
+        self._keys.insert(position, key)
+        for column, (keys, invoices) in self._sorted.items():
+            entry = (self._sort_key(column, invoice), key)
+            index = bisect.bisect_left(keys, entry)
+            keys.insert(index, entry)
+            invoices.insert(index, invoice)
+
+    def remove_invoice(self, invoice):
+        key = ledger_key(invoice)
+        position = bisect.bisect_left(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            return
+        invoice = self._invoices[position]
+        if self._balance_order_changes():
+            self.beginResetModel()
+            self._remove(position, key, invoice)
+            self.endResetModel()
+            return
+        row = self._row_of_invoice(invoice)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self._remove(position, key, invoice)
+        self.endRemoveRows()
+
+    def _remove(self, position, key, invoice):
+        for column, (keys, invoices) in self._sorted.items():
+            index = bisect.bisect_left(keys, (self._sort_key(column, invoice), key))
+            del keys[index]
+            del invoices[index]
+        del self._invoices[position]
+        del self._keys[position]
+
+    def invoice_at(self, row):
+        index = self._row_of_index(row, len(self._invoices))
+        if self._by_ledger():
+            return self._invoices[index]
+        return self._entries(self._sort_column)[1][index]
+
+    def export_snapshot(self):
+        """نسخة من الصفوف المعروضة (بترتيب الدفتر) وفهرس الرصيد للتصدير في الخلفية"""
+        return list(self._invoices), self._balances.copy()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._invoices)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            return Qt.AlignmentFlag.AlignCenter
+
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+
+        row = index.row()
+        column = index.column()
+        invoice = self.invoice_at(row)
+        if column == 0:
+            return str(row + 1)
+        if column == 1:
+            return invoice["invoice_number"]
+        if column == 2:
+            return invoice["date"]
+        if column == 3:
+            return invoice["description"]
+        if column == 4:
+            return f"{invoice.get('debit', 0.0):.3f}"
+        if column == 5:
+            return f"{invoice.get('credit', 0.0):.3f}"
+        try:
+            balance = self._initial_balance + self._balances.balance_after(invoice)
+        except ValueError:
+            return ""
+        return f"{balance / 1000:.3f}"
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal:
+            if role == Qt.ItemDataRole.DisplayRole:
+                return self.HEADERS[section]
+            if role == Qt.ItemDataRole.TextAlignmentRole:
+                return Qt.AlignmentFlag.AlignCenter
+        return None
+
+
+class InvoicesWindow(QMainWindow):
+    def __init__(self, parent=None, storage=None, session=None):
+        super().__init__(parent)
 
         self.setWindowTitle("نافذة الفواتير")
         self.setGeometry(200, 200, 800, 600)
 
+        # النافذة تغلق المخزن فقط إذا فتحته بنفسها
+        self.owns_storage = storage is None and session is None
+        if session is None:
+            session = LedgerSession(open_storage() if storage is None else storage, self)
+        self.session = session
+        self.storage = session.storage
+        if self.owns_storage:
+            report_storage_errors(self.storage, self)
+        self.ledger = session.ledger
+        self.search_generation = 0
+        self.search_in_flight = False
         self.initial_balance = self.load_initial_balance()
-        self.invoice_items = self.load_invoice_items()
         self.selected_year = datetime.datetime.now().year
         self.create_widgets()
         self.update_invoice_list()
+        session.invoice_added.connect(self.invoice_added)
+        session.invoice_removed.connect(self.invoice_removed)
+        session.initial_balance_changed.connect(self.initial_balance_changed)
+        session.ledger_changed.connect(self.ledger_changed)
 
     def create_widgets(self):
         central_widget = QWidget()
@@ -131,10 +686,14 @@ class InvoicesWindow(QMainWindow):
         self.cash_balance_label.setStyleSheet("font-weight: bold; color: #2c3e50;")
         layout.addWidget(self.cash_balance_label)
 
-        # شجرة الفواتير
-        self.tree = QTreeWidget()
-        self.tree.setHeaderLabels(["الرقم", "رقم الفاتورة", "التاريخ", "البيان", "مدين", "دائن", "الرصيد"])
+        # جدول الفواتير (النموذج يفرز بنفسه بمفاتيح حسب نوع العمود)
+        self.model = InvoiceTableModel(self)
+
+        self.tree = QTreeView()
+        self.tree.setModel(self.model)
+        self.tree.setUniformRowHeights(True)  # تسريع الرسم للجداول الكبيرة
         self.tree.setSortingEnabled(True)
+        self.tree.sortByColumn(-1, Qt.SortOrder.AscendingOrder)  # عرض الترتيب الأصلي حتى ينقر المستخدم على عنوان
         self.tree.setRootIsDecorated(False)
         self.tree.setAlternatingRowColors(True)  # تلوين الصفوف بالتناوب
         
@@ -149,6 +708,7 @@ class InvoicesWindow(QMainWindow):
             }
         """
         self.tree.header().setStyleSheet(header_style)
+        self.tree.header().setDefaultAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.tree)
 
         # تعيين عرض الأعمدة
@@ -171,7 +731,12 @@ class InvoicesWindow(QMainWindow):
         self.search_label.setFixedWidth(50)
         self.search_edit = QLineEdit()
         self.search_edit.setPlaceholderText("ابحث في رقم الفاتورة أو الوصف...")
-        self.search_edit.textChanged.connect(self.filter_invoices)
+        # تأجيل البحث حتى يتوقف المستخدم عن الكتابة
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.filter_invoices)
+        self.search_edit.textChanged.connect(self.search_timer.start)
         self.search_edit.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.search_edit.setFixedWidth(150)  # تحديد عرض خانة البحث
         
@@ -238,6 +803,16 @@ class InvoicesWindow(QMainWindow):
         self.export_pdf_button.clicked.connect(self.export_to_pdf)
         export_layout.addWidget(self.export_pdf_button)
 
+        self.import_button = QPushButton("استيراد")
+        self.import_button.setFixedWidth(120)
+        self.import_button.clicked.connect(self.import_invoices)
+        export_layout.addWidget(self.import_button)
+
+        self.summaries_button = QPushButton("الملخصات")
+        self.summaries_button.setFixedWidth(120)
+        self.summaries_button.clicked.connect(self.open_summaries_dialog)
+        export_layout.addWidget(self.summaries_button)
+
         layout.addLayout(export_layout)
 
         # أزرار التحكم الرئيسية
@@ -248,7 +823,7 @@ class InvoicesWindow(QMainWindow):
         button_size = QSize(48, 48)
 
         exit_button = QPushButton()
-        exit_button.setIcon(QIcon("exit.png"))
+        exit_button.setIcon(cached_icon("exit.png"))
         exit_button.setIconSize(button_size)
         exit_button.setFixedSize(button_size)
         exit_button.clicked.connect(self.close)
@@ -256,26 +831,26 @@ class InvoicesWindow(QMainWindow):
         exit_button.setToolTip("خروج (Ctrl+Q)")
         hbox_buttons.addWidget(exit_button)
 
-        delete_button = QPushButton()
-        delete_button.setIcon(QIcon("delete.png"))
-        delete_button.setIconSize(button_size)
-        delete_button.setFixedSize(button_size)
-        delete_button.clicked.connect(self.delete_invoice)
-        delete_button.setShortcut(QKeySequence("Delete"))
-        delete_button.setToolTip("حذف (Delete)")
-        hbox_buttons.addWidget(delete_button)
-
-        edit_button = QPushButton()
-        edit_button.setIcon(QIcon("edit.png"))
-        edit_button.setIconSize(button_size)
-        edit_button.setFixedSize(button_size)
-        edit_button.clicked.connect(self.edit_invoice)
-        edit_button.setShortcut(QKeySequence("Ctrl+E"))
-        edit_button.setToolTip("تعديل (Ctrl+E)")
-        hbox_buttons.addWidget(edit_button)
+        self.delete_button = QPushButton()
+        self.delete_button.setIcon(cached_icon("delete.png"))
+        self.delete_button.setIconSize(button_size)
+        self.delete_button.setFixedSize(button_size)
+        self.delete_button.clicked.connect(self.delete_invoice)
+        self.delete_button.setShortcut(QKeySequence("Delete"))
+        self.delete_button.setToolTip("حذف (Delete)")
+        hbox_buttons.addWidget(self.delete_button)
+
+        self.edit_button = QPushButton()
+        self.edit_button.setIcon(cached_icon("edit.png"))
+        self.edit_button.setIconSize(button_size)
+        self.edit_button.setFixedSize(button_size)
+        self.edit_button.clicked.connect(self.edit_invoice)
+        self.edit_button.setShortcut(QKeySequence("Ctrl+E"))
+        self.edit_button.setToolTip("تعديل (Ctrl+E)")
+        hbox_buttons.addWidget(self.edit_button)
 
         add_button = QPushButton()
-        add_button.setIcon(QIcon("add.png"))
+        add_button.setIcon(cached_icon("add.png"))
         add_button.setIconSize(button_size)
         add_button.setFixedSize(button_size)
         add_button.clicked.connect(self.open_add_invoice_dialog)
@@ -290,79 +865,111 @@ class InvoicesWindow(QMainWindow):
         self.setCentralWidget(central_widget)
 
     def populate_year_combo(self):
-        """تعبئة قائمة السنوات"""
+        """تعبئة قائمة السنوات من السنوات التي فيها بيانات مع السنة الحالية"""
         current_year = QDate.currentDate().year()
-        years = [str(year) for year in range(current_year - 4, current_year + 2)]
+        years = sorted(set(self.storage.years()) | {current_year}, reverse=True)  # ترتيب تنازلي للسنوات
         self.year_combo.clear()
-        for year in reversed(years):  # ترتيب تنازلي للسنوات
+        for year in years:
             self.year_combo.addItem(f"السنة المالية {year}")
-        
+
         # تحديد السنة الحالية كقيمة افتراضية
-        current_year_index = years.index(str(current_year))
-        self.year_combo.setCurrentIndex(len(years) - 1 - current_year_index)  # تعديل المؤشر بسبب الترتيب العكسي
+        self.year_combo.setCurrentIndex(years.index(current_year))
+
+    def ensure_year_listed(self, date_str):
+        """إضافة سنة الفاتورة إلى القائمة إذا لم تكن موجودة دون تغيير السنة المحددة"""
+        try:
+            year = int(date_str[:4])
+        except ValueError:
+            return
+        if self.year_combo.findText(f"السنة المالية {year}") != -1:
+            return
+        years = [int(self.year_combo.itemText(i).split(" ")[-1]) for i in range(self.year_combo.count())]
+        position = sum(1 for listed in years if listed > year)
+        self.year_combo.blockSignals(True)
+        self.year_combo.insertItem(position, f"السنة المالية {year}")
+        self.year_combo.blockSignals(False)
 
     def add_invoice_item(self, invoice_number, date, description, debit, credit):
         try:
             debit = float(debit) if debit else 0.0
             credit = float(credit) if credit else 0.0
-            self.invoice_items.append({"invoice_number": invoice_number, "date": date, "description": description, "debit": debit, "credit": credit})
-            self.save_invoice_items()
-            self.update_invoice_list()
         except ValueError as e:
             QMessageBox.critical(self, "خطأ", f"الرجاء إدخال مبلغ صحيح في خانتي مدين أو دائن. {e}")
+            return
+        invoice = {"invoice_number": invoice_number, "date": date, "description": description, "debit": debit, "credit": credit}
+        try:
+            self.storage.add_invoice(invoice)
+        except (OSError, ValueError) as e:
+            # مثلاً تاريخ في سنة مالية مقفلة أو انقطاع الاتصال بخادم الدفتر
+            QMessageBox.critical(self, "خطأ", str(e))
+            return
+        self.session.invoice_added.emit(invoice)
 
     def update_invoice_list(self):
         """تحديث قائمة الفواتير بدون تطبيق فلترة"""
-        self.tree.clear()
-        current_balance = self.initial_balance
         selected_year = int(self.year_combo.currentText().split(" ")[-1])
-        serial_number = 1
-
-        filtered_invoices = []
-        for invoice in self.invoice_items:
-            date_str = invoice["date"]
-            try:
-                year = int(date_str[:4])
-                if year == selected_year:
-                    filtered_invoices.append(invoice)
-            except ValueError:
-                print(f"Invalid date format: {date_str}")
-                continue
-
-        filtered_invoices.reverse()  # لعرض البيانات الأحدث أولاً
-        
-        for invoice in filtered_invoices:
-            debit = invoice.get("debit", 0.0)
-            credit = invoice.get("credit", 0.0)
-            balance_str = f"{current_balance:.3f}"
-            debit_str = f"{debit:.3f}"
-            credit_str = f"{credit:.3f}"
-
-            item = QTreeWidgetItem([
-                str(serial_number),
-                invoice["invoice_number"],
-                invoice["date"],
-                invoice["description"],
-                debit_str,
-                credit_str,
-                balance_str
-            ])
-
-            # تطبيق محاذاة للوسط لجميع الأعمدة
-            for col in range(self.tree.columnCount()):
-                item.setTextAlignment(col, Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
-
-            self.tree.addTopLevelItem(item)
-            current_balance += debit - credit
-            serial_number += 1
-
-        # تعيين محاذاة عناوين الأعمدة للوسط
-        header = self.tree.header()
-        for col in range(self.tree.columnCount()):
-            header.setDefaultAlignment(Qt.AlignmentFlag.AlignCenter)
 
+        # أي بحث جارٍ أصبح قديماً
+        self.search_timer.stop()
+        self.search_generation += 1
+        self.search_in_flight = False
+
+        # السنة المقفلة تعرض من الأرشيف برصيدها الافتتاحي وللقراءة فقط
+        archived = self.ledger.is_archived(selected_year)
+        for widget in (self.edit_button, self.delete_button, self.update_balance_button, self.initial_balance_edit):
+            widget.setEnabled(not archived)
+        self.initial_balance = self.ledger.opening_balance(selected_year)
+        self.initial_balance_edit.setText(f"{self.initial_balance:.3f}")
+
+        with perf.timed("update_invoice_list") as op:
+            year_invoices, self.balances = self.ledger.year(selected_year)
+            self.show_invoices(year_invoices, {"year": selected_year})
+            op.rows = len(year_invoices)
+
+    def show_invoices(self, invoices, current_filter):
+        """عرض الفواتير في الجدول وتحديث رصيد الصندوق"""
+        self.current_filter = current_filter
+        with perf.timed("populate_table") as op:
+            self.model.set_invoices(invoices, self.balances, self.initial_balance)
+            op.rows = len(invoices)
+        self.update_cash_balance()
+        self.refresh_summaries()
+
+    def update_cash_balance(self):
+        """رصيد الصندوق في نهاية الفترة المعروضة من فهرس الرصيد"""
+        current_balance = closing_balance(self.balances, self.initial_balance, self.current_filter.get("date_to"))
         self.cash_balance_label.setText(f"رصيد الصندوق: {current_balance:.3f}")
-        self.cash_balance_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+    def invoice_added(self, invoice):
+        """تحديث الفهرس والجدول بفاتورة جديدة دون إعادة بناء القائمة"""
+        self.ensure_year_listed(invoice["date"])
+        if self.balances.contains_date(invoice["date"]):
+            self.balances.add(invoice)
+        if invoice_matches(invoice, **self.current_filter):
+            self.model.insert_invoice(invoice)
+        self.model.balances_changed()
+        self.update_cash_balance()
+        self.refresh_summaries()
+        if self.search_in_flight:
+            self.filter_invoices()
+
+    def invoice_removed(self, invoice):
+        """حذف فاتورة من الفهرس والجدول دون إعادة بناء القائمة"""
+        if self.balances.contains_date(invoice["date"]):
+            self.balances.remove(invoice)
+        self.model.remove_invoice(invoice)
+        self.model.balances_changed()
+        self.update_cash_balance()
+        self.refresh_summaries()
+        if self.search_in_flight:
+            self.filter_invoices()
+
+    def selected_invoice(self):
+        """إرجاع الفاتورة المحددة في الجدول أو None"""
+        index = self.tree.currentIndex()
+        if not index.isValid():
+            return None
+        return self.model.invoice_at(index.row())
 
     def open_add_invoice_dialog(self):
         dialog = AddInvoiceDialog(self)
@@ -377,37 +984,46 @@ class InvoicesWindow(QMainWindow):
             new_balance = float(self.initial_balance_edit.text())
             self.initial_balance = new_balance
             self.save_initial_balance()
-            self.update_invoice_list()
             print(f"تم تحديث الرصيد الافتتاحي إلى: {self.initial_balance}")
-            self.initial_balance_edit.setText(str(f"{self.initial_balance:.3f}"))
+            self.session.initial_balance_changed.emit(self.initial_balance)
         except ValueError:
             QMessageBox.critical(self, "خطأ", "الرجاء إدخال رقم صحيح للرصيد الافتتاحي.")
+        except OSError as e:
+            # مثلاً انقطاع الاتصال بخادم الدفتر
+            QMessageBox.critical(self, "خطأ", f"تعذر حفظ الرصيد الافتتاحي: {e}")
+
+    def initial_balance_changed(self, value):
+        """الرصيد الافتتاحي الحالي تغير (من هذه النافذة أو غيرها)؛ السنوات المقفلة لها رصيدها الخاص"""
+        selected_year = int(self.year_combo.currentText().split(" ")[-1])
+        if self.ledger.is_archived(selected_year):
+            return
+        self.initial_balance = value
+        self.model.set_initial_balance(self.initial_balance)
+        self.update_cash_balance()
+        self.initial_balance_edit.setText(str(f"{self.initial_balance:.3f}"))
+
+    def ledger_changed(self):
+        """إعادة تحميل السنة المعروضة بعد تغيير كبير في الدفتر المشترك"""
+        for year in self.storage.years():
+            self.ensure_year_listed(str(year))
+        self.update_invoice_list()
 
     def edit_invoice(self):
-        selected_item = self.tree.currentItem()
-        if selected_item is None:
+        selected_invoice = self.selected_invoice()
+        if selected_invoice is None:
             QMessageBox.warning(self, "تنبيه", "الرجاء تحديد فاتورة لتعديلها.")
             return
 
-        serial_number = selected_item.text(0)
-        invoice_number = selected_item.text(1)
-        date = selected_item.text(2)
-        description = selected_item.text(3)
-        debit = selected_item.text(4)
-        credit = selected_item.text(5)
-        balance = selected_item.text(6)
-
-
         dialog = AddInvoiceDialog(self)
         dialog.setWindowTitle("تعديل الفاتورة")
-        dialog.invoice_number_edit.setText(invoice_number)
-        try:
-           dialog.date_edit.setDate(QDate.fromString(date, "yyyy-MM-dd"))
-        except ValueError:
-           dialog.date_edit.setDate(QDate.currentDate())
-        dialog.description_edit.setText(description)
-        dialog.debit_edit.setText(debit)
-        dialog.credit_edit.setText(credit)
+        dialog.invoice_number_edit.setText(selected_invoice["invoice_number"])
+        date = QDate.fromString(selected_invoice["date"], "yyyy-MM-dd")
+        dialog.date_edit.setDate(date if date.isValid() else QDate.currentDate())
+        dialog.description_edit.setText(selected_invoice["description"])
+        if selected_invoice.get("debit", 0.0):
+            dialog.debit_edit.setText(f"{selected_invoice['debit']:.3f}")
+        if selected_invoice.get("credit", 0.0):
+            dialog.credit_edit.setText(f"{selected_invoice['credit']:.3f}")
 
         result = dialog.exec()
 
@@ -416,174 +1032,103 @@ class InvoicesWindow(QMainWindow):
             try:
                 new_debit = float(new_debit) if new_debit else 0.0
                 new_credit = float(new_credit) if new_credit else 0.0
-
-                for i, invoice in enumerate(self.invoice_items):
-                    old_debit = float(debit) if debit else 0.0
-                    old_credit = float(credit) if credit else 0.0
-
-                    if (invoice["invoice_number"] == invoice_number and
-                        invoice["date"] == date and
-                        invoice["description"] == description and
-                        invoice["debit"] == old_debit and
-                        invoice["credit"] == old_credit):
-
-                        self.invoice_items[i] = {"invoice_number": new_invoice_number, "date": new_date, "description": new_description, "debit": new_debit, "credit": new_credit}
-                        break
-
-                self.save_invoice_items()
-                self.update_invoice_list()
             except ValueError as e:
                 QMessageBox.critical(self, "خطأ", f"الرجاء إدخال مبلغ صحيح في خانتي مدين أو دائن. {e}")
+                return
+
+            new_invoice = {"invoice_number": new_invoice_number, "date": new_date, "description": new_description, "debit": new_debit, "credit": new_credit}
+            try:
+                self.storage.update_invoice(selected_invoice["id"], new_invoice)
+            except (OSError, ValueError) as e:
+                QMessageBox.critical(self, "خطأ", str(e))
+                return
+            except KeyError:
+                # حذفت من جهاز آخر قبل وصول التعديل
+                QMessageBox.critical(self, "خطأ", "الفاتورة لم تعد موجودة.")
+                return
+            self.session.invoice_removed.emit(selected_invoice)
+            self.session.invoice_added.emit(new_invoice)
 
     def delete_invoice(self):
-        selected_item = self.tree.currentItem()
-        if selected_item is None:
+        selected_invoice = self.selected_invoice()
+        if selected_invoice is None:
             QMessageBox.warning(self, "تنبيه", "الرجاء تحديد فاتورة لحذفها.")
             return
 
-        serial_number = selected_item.text(0)
-        invoice_number = selected_item.text(1)
-        date = selected_item.text(2)
-        description = selected_item.text(3)
-        debit = selected_item.text(4)
-        credit = selected_item.text(5)
-        balance = selected_item.text(6)
-
         confirm = QMessageBox.question(self, "تأكيد الحذف", "هل أنت متأكد من أنك تريد حذف هذه الفاتورة؟",
                                          QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
 
         if confirm == QMessageBox.StandardButton.Yes:
-            debit = float(debit) if debit else 0.0
-            credit = float(credit) if credit else 0.0
-
-            self.invoice_items = [
-                invoice
-                for invoice in self.invoice_items
-                if not (
-                    invoice["invoice_number"] == invoice_number
-                    and invoice["date"] == date
-                    and invoice["description"] == description
-                    and invoice["debit"] == debit
-                    and invoice["credit"] == credit
-                )
-            ]
-            self.save_invoice_items()
-            self.update_invoice_list()
+            try:
+                self.storage.delete_invoice(selected_invoice["id"])
+            except OSError as e:
+                QMessageBox.critical(self, "خطأ", str(e))
+                return
+            except KeyError:
+                QMessageBox.critical(self, "خطأ", "الفاتورة لم تعد موجودة.")
+                return
+            self.session.invoice_removed.emit(selected_invoice)
 
     def load_initial_balance(self):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("initial_balance", 0.0)
-        except FileNotFoundError:
-            return 0.0
-        except json.JSONDecodeError:
-            print("خطأ في قراءة ملف البيانات. سيتم استخدام رصيد افتتاحي 0.0")
-            return 0.0
+        return self.ledger.initial_balance()
 
     def save_initial_balance(self):
-        data = self.load_data()
-        data["initial_balance"] = self.initial_balance
-        self.save_data(data)
-
-    def load_invoice_items(self):
-         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("invoice_items", [])
-         except FileNotFoundError:
-            return []
-         except json.JSONDecodeError:
-            print("خطأ في قراءة ملف البيانات. سيتم تحميل قائمة فواتير فارغة")
-            return []
-
-    def save_invoice_items(self):
-        data = self.load_data()
-        data["invoice_items"] = self.invoice_items
-        self.save_data(data)
-
-    def load_data(self):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
-        except json.JSONDecodeError:
-            print("خطأ في قراءة ملف البيانات. سيتم إنشاء بيانات جديدة")
-            return {}
-
-    def save_data(self, data):
-        try:
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"خطأ في حفظ البيانات: {e}")
+        self.storage.set_initial_balance(self.initial_balance)
+
+    def open_summaries_dialog(self):
+        selected_year = int(self.year_combo.currentText().split(" ")[-1])
+        self.summaries_dialog = SummariesDialog(self.ledger, selected_year, self)
+        self.summaries_dialog.show()
+
+    def refresh_summaries(self):
+        """تحديث نافذة الملخصات المفتوحة (المجاميع محدثة في المخزن، فالتحديث قراءة فقط)"""
+        dialog = getattr(self, "summaries_dialog", None)
+        if dialog is not None and dialog.isVisible():
+            dialog.refresh()
+
+    def closeEvent(self, event):
+        # حفظ ما تبقى من البيانات عند الإغلاق
+        if self.owns_storage:
+            self.storage.close()
+        else:
+            # البرنامج ما زال يعمل، لذلك لا داعي لانتظار القرص
+            self.storage.flush_in_background()
+        super().closeEvent(event)
 
     def filter_invoices(self):
+        """تنفيذ البحث في خيط خلفي، وتجاهل نتائج أي بحث أقدم"""
+        self.search_timer.stop()
         search_text = self.search_edit.text().strip()
         date_from = self.date_from_edit.date().toString("yyyy-MM-dd")
         date_to = self.date_to_edit.date().toString("yyyy-MM-dd")
         
-        self.tree.clear()
-        current_balance = self.initial_balance
         selected_year = int(self.year_combo.currentText().split(" ")[-1])
-        serial_number = 1
-
-        filtered_invoices = []
-        for invoice in self.invoice_items:
-            date_str = invoice["date"]
-            try:
-                # التحقق من السنة
-                year = int(date_str[:4])
-                if year != selected_year:
-                    continue
-
-                # التحقق من نص البحث
-                if search_text and search_text not in invoice["invoice_number"] and search_text not in invoice["description"]:
-                    continue
-
-                # التحقق من نطاق التاريخ
-                invoice_date = QDate.fromString(date_str, "yyyy-MM-dd")
-                from_date = QDate.fromString(date_from, "yyyy-MM-dd")
-                to_date = QDate.fromString(date_to, "yyyy-MM-dd")
-                
-                if invoice_date < from_date or invoice_date > to_date:
-                    continue
-
-                filtered_invoices.append(invoice)
-            except ValueError:
-                print(f"تنسيق تاريخ غير صالح: {date_str}")
-                continue
-
-        filtered_invoices.reverse()  # لعرض البيانات الأحدث أولاً
-        
-        for invoice in filtered_invoices:
-            debit = invoice.get("debit", 0.0)
-            credit = invoice.get("credit", 0.0)
-            balance_str = f"{current_balance:.3f}"
-            debit_str = f"{debit:.3f}"
-            credit_str = f"{credit:.3f}"
-
-            item = QTreeWidgetItem([
-                str(serial_number),
-                invoice["invoice_number"],
-                invoice["date"],
-                invoice["description"],
-                debit_str,
-                credit_str,
-                balance_str
-            ])
-
-            # تطبيق محاذاة للوسط لجميع الأعمدة
-            for col in range(self.tree.columnCount()):
-                item.setTextAlignment(col, Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
-
-            self.tree.addTopLevelItem(item)
-            current_balance += debit - credit
-            serial_number += 1
-
-        self.cash_balance_label.setText(f"رصيد الصندوق: {current_balance:.3f}")
-        self.cash_balance_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        if self.balances.year != selected_year:
+            _, self.balances = self.ledger.year(selected_year)
+
+        current_filter = {"year": selected_year, "date_from": date_from, "date_to": date_to, "text": search_text}
+        self.search_generation += 1
+        self.search_in_flight = True
+        self.search_started = time.perf_counter()
+        worker = QueryWorker(self.storage, self.search_generation, current_filter)
+        worker.signals.finished.connect(
+            lambda generation, results: self.search_finished(generation, results, current_filter))
+        worker.signals.failed.connect(self.search_failed)
+        QThreadPool.globalInstance().start(worker)
+
+    def search_finished(self, generation, results, current_filter):
+        if generation != self.search_generation:
+            return  # نتيجة بحث قديم
+        self.search_in_flight = False
+        self.show_invoices(results, current_filter)
+        # الزمن الذي ينتظره المستخدم: من بدء البحث حتى عرض النتائج
+        perf.record("filter_invoices", time.perf_counter() - self.search_started, len(results))
+
+    def search_failed(self, generation, message):
+        if generation != self.search_generation:
+            return
+        self.search_in_flight = False
+        QMessageBox.critical(self, "خطأ", f"تعذر تنفيذ البحث: {message}")
 
     def show_all_invoices(self):
         """عرض جميع الفواتير للسنة المحددة"""
@@ -599,52 +1144,107 @@ class InvoicesWindow(QMainWindow):
         self.update_invoice_list()
 
     def export_to_excel(self):
-        import xlsxwriter
-        workbook = xlsxwriter.Workbook("invoices.xlsx")
-        worksheet = workbook.add_worksheet()
-        worksheet.write(0, 0, "رقم الفاتورة")
-        worksheet.write(0, 1, "التاريخ")
-        worksheet.write(0, 2, "البيان")
-        worksheet.write(0, 3, "مدين")
-        worksheet.write(0, 4, "دائن")
-        worksheet.write(0, 5, "الرصيد")
-        row = 1
-        for invoice in self.invoice_items:
-            worksheet.write(row, 0, invoice["invoice_number"])
-            worksheet.write(row, 1, invoice["date"])
-            worksheet.write(row, 2, invoice["description"])
-            worksheet.write(row, 3, invoice["debit"])
-            worksheet.write(row, 4, invoice["credit"])
-            worksheet.write(row, 5, invoice["debit"] - invoice["credit"])
-            row += 1
-        workbook.close()
-        QMessageBox.information(self, "تم التصدير", "تم تصدير الفواتير إلى ملف Excel بنجاح.")
+        path, _ = QFileDialog.getSaveFileName(self, "تصدير إلى Excel", "invoices.xlsx", "Excel (*.xlsx)")
+        if not path:
+            return
+        invoices, balances = self.model.export_snapshot()
+        self.start_export(ExportWorker(export_excel, path, invoices, balances, self.initial_balance),
+                          len(invoices), "Excel")
+
+    def start_export(self, worker, total, format_name):
+        """تشغيل التصدير في الخلفية مع نافذة تقدم لا تمنع استخدام النافذة"""
+        self.export_excel_button.setEnabled(False)
+        self.export_pdf_button.setEnabled(False)
+
+        progress_dialog = QProgressDialog(f"جاري التصدير إلى {format_name}...", "إلغاء", 0, max(total, 1), self)
+        progress_dialog.setWindowTitle("تصدير")
+        progress_dialog.setMinimumDuration(500)
+        progress_dialog.canceled.connect(worker.cancel)
+
+        def done():
+            progress_dialog.reset()
+            self.export_excel_button.setEnabled(True)
+            self.export_pdf_button.setEnabled(True)
+
+        def finished(path):
+            done()
+            QMessageBox.information(self, "تم التصدير", f"تم تصدير الفواتير إلى ملف {format_name} بنجاح.\n{path}")
+
+        def failed(message):
+            done()
+            QMessageBox.critical(self, "خطأ", f"تعذر التصدير: {message}")
+
+        worker.signals.progress.connect(lambda done_rows, total_rows: progress_dialog.setValue(done_rows))
+        worker.signals.finished.connect(finished)
+        worker.signals.failed.connect(failed)
+        worker.signals.cancelled.connect(done)
+        self.export_worker = worker
+        QThreadPool.globalInstance().start(worker)
 
     def export_to_pdf(self):
-        from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-        from reportlab.lib import colors
-        data = []
-        data.append(["رقم الفاتورة", "التاريخ", "البيان", "مدين", "دائن", "الرصيد"])
-        for invoice in self.invoice_items:
-            data.append([invoice["invoice_number"], invoice["date"], invoice["description"], invoice["debit"], invoice["credit"], invoice["debit"] - invoice["credit"]])
-        doc = SimpleDocTemplate("invoices.pdf", pagesize=letter)
-        style = TableStyle([
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.gray),
-        ])
-        table = Table(data, style=style)
-        elements = []
-        elements.append(table)
-        doc.build(elements)
-        QMessageBox.information(self, "تم التصدير", "تم تصدير الفواتير إلى ملف PDF بنجاح.")
+        path, _ = QFileDialog.getSaveFileName(self, "تصدير إلى PDF", "invoices.pdf", "PDF (*.pdf)")
+        if not path:
+            return
+        invoices, balances = self.model.export_snapshot()
+        self.start_export(ExportWorker(export_pdf, path, invoices, balances, self.initial_balance),
+                          len(invoices), "PDF")
 
 
+    def import_invoices(self):
+        path, _ = QFileDialog.getOpenFileName(self, "استيراد فواتير", "",
+                                              "ملفات الفواتير (*.csv *.xlsx *.json)")
+        if not path:
+            return
+        self.import_button.setEnabled(False)
+        worker = ImportWorker(path, self.storage)
+
+        # عدد الصفوف غير معروف قبل القراءة لذلك نافذة التقدم بدون نسبة
+        progress_dialog = QProgressDialog("جاري قراءة الملف...", "إلغاء", 0, 0, self)
+        progress_dialog.setWindowTitle("استيراد")
+        progress_dialog.setMinimumDuration(500)
+        progress_dialog.canceled.connect(worker.cancel)
+
+        def done():
+            progress_dialog.reset()
+            self.import_button.setEnabled(True)
+
+        def finished(result):
+            done()
+            self.import_finished(result)
+
+        def failed(message):
+            done()
+            QMessageBox.critical(self, "خطأ", f"تعذر الاستيراد: {message}")
+
+        worker.signals.progress.connect(
+            lambda rows, total: progress_dialog.setLabelText(f"جاري قراءة الملف... ({rows} صف)"))
+        worker.signals.finished.connect(finished)
+        worker.signals.failed.connect(failed)
+        worker.signals.cancelled.connect(done)
+        self.import_worker = worker
+        QThreadPool.globalInstance().start(worker)
+
+    def import_finished(self, result):
+        """حفظ الفواتير المستوردة بعملية كتابة واحدة ثم إعادة تحميل القائمة مرة واحدة"""
+        if result.invoices:
+            try:
+                self.storage.add_invoices(result.invoices)
+            except Exception as e:
+                QMessageBox.critical(self, "خطأ", f"تعذر حفظ الفواتير المستوردة: {e}")
+                return
+            self.session.ledger_changed.emit()
+
+        message = (f"تم استيراد {len(result.invoices)} فاتورة.\n"
+                   f"فواتير مكررة تم تجاهلها: {result.duplicates}\n"
+                   f"صفوف بها أخطاء: {len(result.errors)}")
+        if result.errors:
+            lines = [f"صف {row_number}: {error}" for row_number, error in result.errors[:10]]
+            message += "\n\n" + "\n".join(lines)
+        if result.errors:
+            QMessageBox.warning(self, "نتيجة الاستيراد", message)
+        else:
+            QMessageBox.information(self, "نتيجة الاستيراد", message)
+
 class AddInvoiceDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -714,30 +1314,17 @@ class AddInvoiceDialog(QDialog):
         self.shortcut_cancel.activated.connect(self.reject)
 
     def validate_and_accept(self):
-        # التحقق من رقم الفاتورة
-        if not self.invoice_number_edit.text().strip():
-            QMessageBox.warning(self, "تنبيه", "الرجاء إدخال رقم الفاتورة")
-            self.invoice_number_edit.setFocus()
-            return
-
-        # التحقق من الوصف
-        if not self.description_edit.text().strip():
-            QMessageBox.warning(self, "تنبيه", "الرجاء إدخال وصف الفاتورة")
-            self.description_edit.setFocus()
-            return
-
-        # التحقق من المبالغ
-        debit = self.debit_edit.text().strip()
-        credit = self.credit_edit.text().strip()
-        
-        if not debit and not credit:
-            QMessageBox.warning(self, "تنبيه", "الرجاء إدخال قيمة في خانة مدين أو دائن")
-            self.debit_edit.setFocus()
-            return
-
-        if debit and credit:
-            QMessageBox.warning(self, "تنبيه", "لا يمكن إدخال قيم في خانتي مدين ودائن معاً")
-            self.debit_edit.setFocus()
+        # نفس الشروط المستخدمة في الاستيراد
+        error = validate_invoice(self.invoice_number_edit.text(), self.description_edit.text(),
+                                 self.debit_edit.text().strip(), self.credit_edit.text().strip())
+        if error is not None:
+            field, message = error
+            QMessageBox.warning(self, "تنبيه", message)
+            {
+                "invoice_number": self.invoice_number_edit,
+                "description": self.description_edit,
+                "debit": self.debit_edit,
+            }[field].setFocus()
             return
 
         self.accept()
@@ -751,8 +1338,192 @@ class AddInvoiceDialog(QDialog):
         return (invoice_number, date, description, debit, credit)
 
 
+class PerformanceDialog(QDialog):
+    """أزمنة العمليات الأخيرة (p50/p95) مع عدد الصفوف والبايتات، تتحدث كل ثانية"""
+
+    HEADERS = ["العملية", "العدد", "p50 (ms)", "p95 (ms)", "آخر (ms)", "الصفوف", "قراءة (KB)", "كتابة (KB)"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("الأداء")
+        self.setGeometry(250, 250, 700, 350)
+        self.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+
+        layout = QVBoxLayout(self)
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Reset | QDialogButtonBox.StandardButton.Close)
+        button_box.button(QDialogButtonBox.StandardButton.Reset).setText("مسح")
+        button_box.button(QDialogButtonBox.StandardButton.Reset).clicked.connect(self.clear)
+        button_box.rejected.connect(self.close)
+        layout.addWidget(button_box)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start()
+        self.refresh()
+
+    def refresh(self):
+        if perf.is_enabled():
+            self.status_label.setText(f"القياس مفعل، السجل في {os.path.abspath(perf.PERF_LOG)}")
+        else:
+            self.status_label.setText("القياس متوقف (قائمة الأداء أو BOX_PERF=1)")
+        rows = perf.summary()
+        self.table.setRowCount(len(rows))
+        for row, stats in enumerate(rows):
+            values = [
+                stats["name"],
+                str(stats["count"]),
+                f"{stats['p50']:.1f}",
+                f"{stats['p95']:.1f}",
+                f"{stats['last']:.1f}",
+                str(stats["rows"]),
+                f"{stats['bytes_read'] / 1024:.0f}",
+                f"{stats['bytes_written'] / 1024:.0f}",
+            ]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+
+    def clear(self):
+        perf.reset()
+        self.refresh()
+
+class SummariesDialog(QDialog):
+    """مجاميع المدين والدائن وعدد الفواتير حسب الشهر والبيان والسنة المالية.
+
+    المجاميع يحدثها المخزن مع كل إضافة وتعديل وحذف، لذلك العرض لا يمر على الفواتير.
+    """
+
+    COLUMNS = ["مدين", "دائن", "الصافي", "العدد"]
+
+    def __init__(self, ledger, year, parent=None):
+        super().__init__(parent)
+        self.ledger = ledger
+
+        self.setWindowTitle("الملخصات")
+        self.setGeometry(250, 250, 650, 450)
+        self.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+
+        layout = QVBoxLayout(self)
+        filters_layout = QHBoxLayout()
+        filters_layout.addWidget(QLabel("السنة المالية:"))
+        self.year_combo = QComboBox()
+        filters_layout.addWidget(self.year_combo)
+        filters_layout.addWidget(QLabel("الشهر:"))
+        self.month_combo = QComboBox()
+        filters_layout.addWidget(self.month_combo)
+        filters_layout.addStretch()
+        layout.addLayout(filters_layout)
+
+        self.tabs = QTabWidget()
+        self.month_table = self.create_table("الشهر")
+        self.description_table = self.create_table("البيان")
+        self.year_table = self.create_table("السنة المالية")
+        self.tabs.addTab(self.month_table, "حسب الشهر")
+        self.tabs.addTab(self.description_table, "حسب البيان")
+        self.tabs.addTab(self.year_table, "حسب السنة")
+        layout.addWidget(self.tabs)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        button_box.rejected.connect(self.close)
+        layout.addWidget(button_box)
+
+        self.year = year
+        self.month = None
+        self.refresh()
+        self.year_combo.currentIndexChanged.connect(self.year_changed)
+        self.month_combo.currentIndexChanged.connect(self.month_changed)
+
+    def create_table(self, label):
+        table = QTableWidget(0, len(self.COLUMNS) + 1)
+        table.setHorizontalHeaderLabels([label] + self.COLUMNS)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        return table
+
+    def year_changed(self):
+        self.year = self.year_combo.currentData()
+        self.month = None
+        self.refresh()
+
+    def month_changed(self):
+        self.month = self.month_combo.currentData()
+        self.refresh()
+
+    @staticmethod
+    def fill_table(table, rows, total=None):
+        if total is not None:
+            rows = rows + [dict(total, label="المجموع")]
+        table.setRowCount(len(rows))
+        for row_number, row in enumerate(rows):
+            values = [str(row["label"]), f"{row['debit']:.3f}", f"{row['credit']:.3f}",
+                      f"{row['net']:.3f}", str(row["count"])]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+                table.setItem(row_number, column, item)
+
+    def refresh(self):
+        summaries = self.ledger.summaries()
+        years = summaries.by_year()
+        months = summaries.by_month(self.year)
+
+        # قوائم السنة والشهر تتغير مع البيانات، لذلك يعاد ملؤها بدون إطلاق الإشارات
+        for combo, items, current in (
+            (self.year_combo, [(str(year), year) for year in sorted({row["label"] for row in years} | {self.year})],
+             self.year),
+            (self.month_combo, [("كل الشهور", None)] + [(row["label"], row["label"]) for row in months],
+             self.month),
+        ):
+            combo.blockSignals(True)
+            combo.clear()
+            for text, value in items:
+                combo.addItem(text, value)
+            index = combo.findData(current)
+            combo.setCurrentIndex(max(index, 0))
+            combo.blockSignals(False)
+
+        self.fill_table(self.month_table, months, summaries.total(self.year))
+        self.fill_table(self.description_table, summaries.by_description(self.year, self.month),
+                        summaries.total(self.year, self.month))
+        self.fill_table(self.year_table, years, summaries.total())
+
+
+def print_startup_profile(marks):
+    """طباعة زمن كل مرحلة من مراحل بدء التشغيل"""
+    print("زمن بدء التشغيل:")
+    previous = STARTUP_BEGIN
+    for label, moment in marks:
+        print(f"  {label}: {(moment - previous) * 1000:.1f} ms")
+        previous = moment
+    print(f"  المجموع: {(previous - STARTUP_BEGIN) * 1000:.1f} ms")
+
+
 if __name__ == "__main__":
+    profile_startup = "--profile-startup" in sys.argv
+    if profile_startup:
+        sys.argv.remove("--profile-startup")
+
+    startup_marks = [("استيراد PyQt6", PYQT_IMPORTED), ("استيراد وحدات البرنامج", IMPORTS_DONE)]
     app = QApplication(sys.argv)
+    startup_marks.append(("إنشاء QApplication", time.perf_counter()))
     main_app = MainApp()
     main_app.show()
+    startup_marks.append(("إنشاء النافذة الرئيسية", time.perf_counter()))
+
+    if profile_startup:
+        main_app.get_storage().get_initial_balance()  # تحميل ملف البيانات
+        startup_marks.append(("تحميل ملف البيانات", time.perf_counter()))
+        QTimer.singleShot(0, lambda: print_startup_profile(
+            startup_marks + [("أول دورة أحداث", time.perf_counter())]))
+
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import deque
+
+# BOX_PERF=1 لتفعيل القياس من البداية (يمكن تفعيله أيضاً من قائمة الأداء)
+PERF_LOG = os.environ.get("BOX_PERF_LOG", "box_perf.log")
+PERF_LOG_MAX_BYTES = 1024 * 1024
+PERF_LOG_BACKUPS = 3
+
+# عدد القياسات الأخيرة المحفوظة لكل عملية لحساب p50/p95
+RECENT_SAMPLES = 500
+
+_enabled = os.environ.get("BOX_PERF", "0") == "1"
+_lock = threading.Lock()
+_operations = {}
+_logger = None
+
+
+class OperationStats:
+    """القياسات الأخيرة لعملية واحدة مع العدادات الكلية"""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = deque(maxlen=RECENT_SAMPLES)
+        self.count = 0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def percentile(self, fraction):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Timer:
+    """قياس عملية واحدة؛ يمكن تحديد عدد الصفوف والبايتات قبل نهايتها"""
+
+    __slots__ = ("name", "rows", "bytes_read", "bytes_written", "_start")
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # العمليات الملغاة أو الفاشلة لا تدخل في الأزمنة
+        if exc_type is None:
+            record(self.name, time.perf_counter() - self._start, self.rows, self.bytes_read, self.bytes_written)
+        return False
+
+
+class _DisabledTimer:
+    """بديل لا يفعل شيئاً عند إيقاف القياس (بدون أي تكلفة تقريباً)"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_DISABLED = _DisabledTimer()
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def timed(name):
+    """with timed("update_invoice_list") as op: ... op.rows = len(invoices)"""
+    return Timer(name) if _enabled else _DISABLED
+
+
+def _log():
+    global _logger
+    if _logger is None:
+        import logging
+        from logging.handlers import RotatingFileHandler
+
+        _logger = logging.getLogger("box.perf")
+        _logger.propagate = False
+        _logger.setLevel(logging.INFO)
+        try:
+            handler = RotatingFileHandler(PERF_LOG, maxBytes=PERF_LOG_MAX_BYTES,
+                                          backupCount=PERF_LOG_BACKUPS, encoding="utf-8")
+        except OSError as e:
+            print(f"تعذر فتح ملف سجل الأداء: {e}")
+            handler = logging.NullHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _logger.addHandler(handler)
+    return _logger
+
+
+def record(name, seconds, rows=0, bytes_read=0, bytes_written=0):
+    if not _enabled:
+        return
+    with _lock:
+        stats = _operations.get(name)
+        if stats is None:
+            stats = _operations[name] = OperationStats(name)
+        stats.samples.append(seconds)
+        stats.count += 1
+        stats.rows += rows
+        stats.bytes_read += bytes_read
+        stats.bytes_written += bytes_written
+        _log().info("%s %.1fms rows=%d read=%d written=%d", name, seconds * 1000, rows, bytes_read, bytes_written)
+
+
+def summary():
+    """ملخص كل عملية مرتبة بالاسم (الأزمنة بالمللي ثانية)"""
+    with _lock:
+        return [
+            {
+                "name": stats.name,
+                "count": stats.count,
+                "p50": stats.percentile(0.5) * 1000,
+                "p95": stats.percentile(0.95) * 1000,
+                "last": stats.samples[-1] * 1000,
+                "rows": stats.rows,
+                "bytes_read": stats.bytes_read,
+                "bytes_written": stats.bytes_written,
+            }
+            for stats in sorted(_operations.values(), key=lambda stats: stats.name)
+        ]
+
+
+def reset():
+    with _lock:
+        _operations.clear()
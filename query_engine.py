@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from records import Invoice
+from search_index import normalize_arabic
+
+# رقم 1970-01-01 الترتيبي، لتحويل التواريخ الترتيبية إلى datetime64
+UNIX_EPOCH_ORDINAL = 719163
+
+
+class LedgerFrame:
+    """نسخة عمودية من الدفتر لتنفيذ البحث والفلترة كعمليات متجهة.
+
+    التواريخ datetime64 والمبالغ أعداد صحيحة بالألف (int64) والنصوص أعمدة فئوية،
+    لذلك يتم البحث النصي على القيم المختلفة فقط ثم يعمم على كل الصفوف.
+    """
+
+    def __init__(self, invoices):
+        self.invoices = invoices
+        self.frame = pd.DataFrame({
+            "id": np.fromiter((invoice["id"] for invoice in invoices), dtype=np.int64, count=len(invoices)),
+            "date": pd.to_datetime([invoice["date"] for invoice in invoices], format="%Y-%m-%d", errors="coerce"),
+            "debit": np.fromiter((invoice.get("debit", 0.0) for invoice in invoices), dtype=np.float64, count=len(invoices)),
+            "credit": np.fromiter((invoice.get("credit", 0.0) for invoice in invoices), dtype=np.float64, count=len(invoices)),
+            "invoice_number": pd.Categorical([invoice["invoice_number"] for invoice in invoices]),
+            "description": pd.Categorical([invoice["description"] for invoice in invoices]),
+        })
+        # المبالغ بالألف لتجنب أخطاء الجمع العشري
+        self.frame["debit"] = np.round(self.frame["debit"].to_numpy() * 1000).astype(np.int64)
+        self.frame["credit"] = np.round(self.frame["credit"].to_numpy() * 1000).astype(np.int64)
+        self.frame["year"] = self.frame["date"].dt.year
+
+    @classmethod
+    def from_table(cls, table):
+        """بناء النسخة العمودية من أعمدة InvoiceTable مباشرة بدون قراءة كل فاتورة حقلاً بحقل"""
+        positions = np.frombuffer(table.row_positions(), dtype=np.int64)
+        positions = positions[positions >= 0]
+        columns = table.columns
+        # نسخ الأعمدة أولاً لأن خيط الواجهة قد يضيف إليها أثناء البناء
+        ordinals = np.frombuffer(columns.dates[:], dtype=np.int32)[positions].astype(np.int64)
+        dates = (ordinals - UNIX_EPOCH_ORDINAL).astype("datetime64[D]")
+        dates[ordinals == 0] = np.datetime64("NaT")
+
+        self = cls.__new__(cls)
+        self.invoices = [Invoice(columns, position) for position in positions.tolist()]
+        self.frame = pd.DataFrame({
+            "id": np.frombuffer(columns.ids[:], dtype=np.int64)[positions],
+            "date": dates.astype("datetime64[ns]"),
+            "debit": np.frombuffer(columns.debits[:], dtype=np.int64)[positions],
+            "credit": np.frombuffer(columns.credits[:], dtype=np.int64)[positions],
+            "invoice_number": pd.Categorical(np.array(columns.numbers[:], dtype=object)[positions]),
+            "description": pd.Categorical(np.array(columns.descriptions[:], dtype=object)[positions]),
+        })
+        self.frame["year"] = self.frame["date"].dt.year
+        return self
+
+    def __len__(self):
+        return len(self.invoices)
+
+    @staticmethod
+    def _text_mask(column, text):
+        """البحث في القيم المختلفة للعمود الفئوي ثم تعميم النتيجة على الصفوف"""
+        categories = column.cat.categories.map(normalize_arabic)
+        hits = categories.str.contains(normalize_arabic(text), regex=False)
+        hits = np.append(np.asarray(hits, dtype=bool), False)  # الرمز -1 للقيم الفارغة
+        return hits[column.cat.codes.to_numpy()]
+
+    def mask(self, year=None, date_from=None, date_to=None, text=None, ids=None):
+        frame = self.frame
+        mask = np.ones(len(frame), dtype=bool)
+        if year is not None:
+            mask &= (frame["year"] == year).to_numpy()
+        if date_from is not None:
+            mask &= (frame["date"] >= pd.Timestamp(date_from)).to_numpy()
+        if date_to is not None:
+            mask &= (frame["date"] <= pd.Timestamp(date_to)).to_numpy()
+        if text:
+            mask &= (self._text_mask(frame["invoice_number"], text)
+                     | self._text_mask(frame["description"], text))
+        if ids is not None:
+            mask &= np.isin(frame["id"].to_numpy(), np.fromiter(ids, dtype=np.int64, count=len(ids)))
+        return mask
+
+    def query(self, year=None, date_from=None, date_to=None, text=None, ids=None):
+        """إرجاع الفواتير المطابقة بترتيب الإدخال"""
+        positions = np.flatnonzero(self.mask(year, date_from, date_to, text, ids))
+        invoices = self.invoices
+        return [invoices[i] for i in positions]
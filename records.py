@@ -0,0 +1,279 @@
+import datetime
+import re
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+from balance import to_milli
+
+# ترتيب الحقول كما في ملف JSON
+FIELDS = ("invoice_number", "date", "description", "debit", "credit", "id")
+FIELD_SET = frozenset(FIELDS)
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def ordinal_range(year=None, date_from=None, date_to=None):
+    """حدود السنة ونطاق التاريخ كأرقام ترتيبية (ValueError للتاريخ غير الصالح)"""
+    low, high = 1, datetime.date.max.toordinal()
+    if year is not None:
+        low = datetime.date(year, 1, 1).toordinal()
+        high = datetime.date(year, 12, 31).toordinal()
+    if date_from is not None:
+        low = max(low, datetime.date.fromisoformat(date_from).toordinal())
+    if date_to is not None:
+        high = min(high, datetime.date.fromisoformat(date_to).toordinal())
+    return low, high
+
+
+class InvoiceColumns:
+    """أعمدة متوازية للفواتير بدلاً من قاموس لكل فاتورة.
+
+    المبالغ أعداد صحيحة بالألف والتواريخ أرقام ترتيبية (ordinal) في array،
+    والنصوص المتكررة مثل البيان نسخة واحدة مشتركة (sys.intern).
+    الصفوف لا تعدل بعد إضافتها، لذلك تبقى أي فاتورة قديمة تم قراءتها صحيحة.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.dates = array("i")  # 0 للتاريخ غير الصالح ونصه الأصلي في raw_dates
+        self.debits = array("q")
+        self.credits = array("q")
+        self.numbers = []
+        self.descriptions = []
+        self.raw_dates = {}
+        self.extras = {}  # الحقول الإضافية النادرة حسب موقع الصف
+        self._ordinals = {}
+        self._date_strings = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _ordinal(self, date_str):
+        ordinal = self._ordinals.get(date_str)
+        if ordinal is None:
+            ordinal = 0
+            if isinstance(date_str, str) and DATE_PATTERN.fullmatch(date_str):
+                try:
+                    ordinal = datetime.date.fromisoformat(date_str).toordinal()
+                except ValueError:
+                    pass
+            self._ordinals[date_str] = ordinal
+        return ordinal
+
+    def append(self, invoice):
+        """إضافة صف وإرجاع موقعه"""
+        position = len(self.ids)
+        date_str = invoice["date"]
+        ordinal = self._ordinal(date_str)
+        if ordinal == 0:
+            self.raw_dates[position] = date_str
+        if not FIELD_SET.issuperset(invoice):
+            self.extras[position] = {key: value for key, value in invoice.items() if key not in FIELD_SET}
+        self.dates.append(ordinal)
+        self.debits.append(to_milli(invoice.get("debit", 0.0)))
+        self.credits.append(to_milli(invoice.get("credit", 0.0)))
+        self.numbers.append(_intern(invoice["invoice_number"]))
+        self.descriptions.append(_intern(invoice["description"]))
+        self.ids.append(invoice["id"])
+        return position
+
+    def extend(self, invoices):
+        """إضافة عدة صفوف عموداً بعمود (أسرع بكثير من append عند التحميل) وإرجاع موقع أولها"""
+        start = len(self.ids)
+        date_strings = [invoice["date"] for invoice in invoices]
+        for date_str in set(date_strings):
+            self._ordinal(date_str)
+        ordinals = [self._ordinals[date_str] for date_str in date_strings]
+        if 0 in ordinals:
+            for offset, ordinal in enumerate(ordinals):
+                if ordinal == 0:
+                    self.raw_dates[start + offset] = date_strings[offset]
+        for offset, invoice in enumerate(invoices):
+            if not FIELD_SET.issuperset(invoice):
+                self.extras[start + offset] = {key: value for key, value in invoice.items() if key not in FIELD_SET}
+
+        self.dates.extend(array("i", ordinals))
+        self.debits.extend(array("q", [round((invoice.get("debit") or 0.0) * 1000) for invoice in invoices]))
+        self.credits.extend(array("q", [round((invoice.get("credit") or 0.0) * 1000) for invoice in invoices]))
+        for column, field in ((self.numbers, "invoice_number"), (self.descriptions, "description")):
+            values = [invoice[field] for invoice in invoices]
+            interned = {value: _intern(value) for value in set(values)}
+            column.extend([interned[value] for value in values])
+        self.ids.extend(array("q", [invoice["id"] for invoice in invoices]))
+        return start
+
+    def date(self, position):
+        ordinal = self.dates[position]
+        if ordinal == 0:
+            return self.raw_dates[position]
+        date_str = self._date_strings.get(ordinal)
+        if date_str is None:
+            date_str = sys.intern(datetime.date.fromordinal(ordinal).isoformat())
+            self._date_strings[ordinal] = date_str
+        return date_str
+
+    def field(self, position, key):
+        if key == "date":
+            return self.date(position)
+        if key == "debit":
+            return self.debits[position] / 1000
+        if key == "credit":
+            return self.credits[position] / 1000
+        if key == "id":
+            return self.ids[position]
+        if key == "invoice_number":
+            return self.numbers[position]
+        if key == "description":
+            return self.descriptions[position]
+        extra = self.extras.get(position)
+        if extra is None or key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def extra_keys(self, position):
+        return tuple(self.extras.get(position, ()))
+
+
+class Invoice(Mapping):
+    """فاتورة واحدة كموقع في الأعمدة، بواجهة القاموس للقراءة فقط.
+
+    تعمل مع أي أعمدة توفر field و extra_keys (مثل اللقطة الثنائية).
+    """
+
+    __slots__ = ("_columns", "_position")
+
+    def __init__(self, columns, position):
+        self._columns = columns
+        self._position = position
+
+    def __getitem__(self, key):
+        return self._columns.field(self._position, key)
+
+    def __iter__(self):
+        yield from FIELDS
+        yield from self._columns.extra_keys(self._position)
+
+    def __len__(self):
+        return len(FIELDS) + len(self._columns.extra_keys(self._position))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class InvoiceTable(MutableMapping):
+    """قاموس الفواتير حسب المعرف فوق InvoiceColumns.
+
+    الترتيب حسب المعرف (وهو ترتيب الإدخال)، والتعديل يضيف صفاً جديداً ويحدث موقع المعرف.
+    المعرفات متتالية لذلك يكفي array للمواقع بدلاً من قاموس. المعرفات عامة في الدفتر المقسم،
+    لذلك يبدأ الـ array من أصغر معرف في الجدول وليس من صفر، فيبقى بحجم ملف السنة.
+    """
+
+    def __init__(self, invoices=()):
+        self.columns = InvoiceColumns()
+        self._positions = array("q")  # المعرف - _base -> موقع صفه الحالي، -1 إذا لم يكن موجوداً
+        self._base = 0
+        self._count = 0
+        if invoices:
+            self.extend(invoices)
+
+    def _reserve(self, low, high):
+        """توسيع المواقع لتشمل المعرفات من low إلى high"""
+        positions = self._positions
+        if not positions:
+            self._base = low
+        elif low < self._base:
+            # معرف أصغر من كل المعرفات (نادر لأن المعرفات تزداد)
+            self._positions = positions = array("q", [-1]) * (self._base - low) + positions
+            self._base = low
+        if high - self._base >= len(positions):
+            positions.extend(array("q", [-1]) * (high - self._base + 1 - len(positions)))
+
+    def extend(self, invoices):
+        """إضافة قائمة فواتير لكل منها معرف (تحميل ملف البيانات)"""
+        invoices = list(invoices)
+        if not invoices:
+            return
+        start = self.columns.extend(invoices)
+        ids = [invoice["id"] for invoice in invoices]
+        self._reserve(min(ids), max(ids))
+        positions = self._positions
+        base = self._base
+        for position, invoice_id in enumerate(ids, start):
+            if positions[invoice_id - base] < 0:
+                self._count += 1
+            positions[invoice_id - base] = position
+
+    def _position(self, invoice_id):
+        if isinstance(invoice_id, int) and 0 <= invoice_id - self._base < len(self._positions):
+            return self._positions[invoice_id - self._base]
+        return -1
+
+    def __getitem__(self, invoice_id):
+        position = self._position(invoice_id)
+        if position < 0:
+            raise KeyError(invoice_id)
+        return Invoice(self.columns, position)
+
+    def __setitem__(self, invoice_id, invoice):
+        if invoice.get("id") != invoice_id:
+            invoice = dict(invoice, id=invoice_id)
+        position = self.columns.append(invoice)
+        self._reserve(invoice_id, invoice_id)
+        positions = self._positions
+        if positions[invoice_id - self._base] < 0:
+            self._count += 1
+        positions[invoice_id - self._base] = position
+
+    def __delitem__(self, invoice_id):
+        if self._position(invoice_id) < 0:
+            raise KeyError(invoice_id)
+        self._positions[invoice_id - self._base] = -1
+        self._count -= 1
+
+    def __contains__(self, invoice_id):
+        return self._position(invoice_id) >= 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        # نسخة من المواقع لأن القراءة قد تكون من خيط آخر أثناء التعديل
+        for invoice_id, position in enumerate(self._positions[:], self._base):
+            if position >= 0:
+                yield invoice_id
+
+    def row_positions(self):
+        """نسخة من مواقع الصفوف حسب المعرف بداية من أصغر معرف (-1 للمعرف غير الموجود)"""
+        return self._positions[:]
+
+    def values(self):
+        """كل الفواتير بترتيب المعرف (قائمة جديدة، آمنة للاستخدام من خيط آخر)"""
+        columns = self.columns
+        return [Invoice(columns, position) for position in self._positions[:] if position >= 0]
+
+    def select(self, year, date_from, date_to, matches):
+        """الفواتير ضمن السنة ونطاق التاريخ بترتيب المعرف، بالفلترة على عمود التاريخ مباشرة"""
+        try:
+            low, high = ordinal_range(year, date_from, date_to)
+        except ValueError:
+            return [invoice for invoice in self.values() if matches(invoice, year, date_from, date_to)]
+
+        columns = self.columns
+        dates = columns.dates
+        results = []
+        for position in self._positions[:]:
+            if position < 0:
+                continue
+            ordinal = dates[position]
+            if low <= ordinal <= high:
+                results.append(Invoice(columns, position))
+            elif ordinal == 0:
+                # تاريخ غير صالح: نفس حكم الفحص العادي
+                invoice = Invoice(columns, position)
+                if matches(invoice, year, date_from, date_to):
+                    results.append(invoice)
+        return results
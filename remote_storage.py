@@ -0,0 +1,207 @@
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+
+from storage import Storage
+from summaries import Summaries
+
+# مهلة طلبات الخادم (بالثواني)
+REQUEST_TIMEOUT = 30
+
+# انتظار التعديلات الجديدة في طلب واحد، وانتظار إعادة المحاولة بعد انقطاع الخادم (بالثواني)
+CHANGES_WAIT = 20
+RECONNECT_DELAY = 2
+
+# الاتصالات المفتوحة المحفوظة لإعادة الاستخدام (خيط الواجهة وخيوط الاستعلام والتصدير)
+POOL_SIZE = 4
+
+ERRORS = {"KeyError": KeyError, "ValueError": ValueError, "TypeError": TypeError}
+
+
+class RemoteStorage(Storage):
+    """الدفتر على خادم الدفتر (ledger_server.py) بنفس واجهة المخازن المحلية.
+
+    الطلبات تستخدم اتصالات HTTP مفتوحة من مجموعة صغيرة بدلاً من اتصال جديد لكل طلب.
+    خيط في الخلفية ينتظر تعديلات الأجهزة الأخرى من الخادم ويجمعها حتى تقرأها refresh،
+    ويخبر add_change_listener فور وصولها.
+    """
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.client_id = uuid.uuid4().hex
+        self._pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        self._lock = threading.Lock()
+        self._changes = []
+        self._received_balance = None
+        self._closing = False
+        self._poll_connection = None
+        # الرقم الحالي قبل أي قراءة، حتى لا يضيع تعديل يصل بين القراءة وبدء الانتظار
+        self._seq = self._request("GET", "/changes")["seq"]
+        self._initial_balance = self._call("get_initial_balance")
+        self._poll_thread = threading.Thread(target=self._poll_main, daemon=True)
+        self._poll_thread.start()
+
+    def _connect(self, timeout=REQUEST_TIMEOUT):
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _request(self, method, path, payload=None, connection=None, retry=True):
+        """طلب واحد على اتصال من المجموعة (أو الاتصال المحدد) وإرجاع JSON الرد.
+
+        retry يعيد الطلب مرة على اتصال جديد إذا كان الاتصال المحفوظ مقطوعاً (مثلاً بعد
+        إعادة تشغيل الخادم)؛ لا يستخدم مع التعديلات حتى لا يطبق التعديل مرتين.
+        """
+        pooled = connection is None
+        body = None if payload is None else json.dumps(payload, ensure_ascii=False, default=dict).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        for attempt in range(2):
+            if pooled:
+                try:
+                    connection = self._pool.get_nowait()
+                except queue.Empty:
+                    connection = self._connect()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = json.loads(response.read())
+                break
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if attempt or not retry or self._closing:
+                    raise ConnectionError(f"تعذر الاتصال بخادم الدفتر {self.host}:{self.port}: {e}")
+        if pooled:
+            try:
+                self._pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        if response.status != 200:
+            raise ERRORS.get(data.get("type"), RuntimeError)(data.get("error", f"خطأ في خادم الدفتر ({response.status})"))
+        return data
+
+    def _call(self, name, retry=True, **arguments):
+        payload = {"arguments": arguments, "client": self.client_id}
+        return self._request("POST", f"/{name}", payload, retry=retry)["result"]
+
+    def _write(self, name, **arguments):
+        return self._call(name, retry=False, **arguments)
+
+    def get_initial_balance(self):
+        # محفوظ محلياً ويتحدث مع تعديلات الأجهزة الأخرى، لأن الواجهة تقرؤه مع كل فحص
+        return self._initial_balance
+
+    def set_initial_balance(self, value):
+        self._write("set_initial_balance", value=value)
+        self._initial_balance = value
+
+    def query(self, year=None, date_from=None, date_to=None, text=None):
+        return self._call("query", year=year, date_from=date_from, date_to=date_to, text=text)
+
+    def years(self):
+        return self._call("years")
+
+    def get_invoice(self, invoice_id):
+        return self._call("get_invoice", invoice_id=invoice_id)
+
+    def add_invoice(self, invoice):
+        invoice["id"] = self._write("add_invoice", invoice=invoice)
+
+    def add_invoices(self, invoices):
+        for invoice, invoice_id in zip(invoices, self._write("add_invoices", invoices=invoices)):
+            invoice["id"] = invoice_id
+
+    def update_invoice(self, invoice_id, new_invoice):
+        self._write("update_invoice", invoice_id=invoice_id, new_invoice=new_invoice)
+        new_invoice["id"] = invoice_id
+
+    def delete_invoice(self, invoice_id):
+        self._write("delete_invoice", invoice_id=invoice_id)
+
+    def delete_invoices(self, invoice_ids):
+        self._write("delete_invoices", invoice_ids=list(invoice_ids))
+
+    def load(self):
+        return self._call("load")
+
+    def summaries(self):
+        summaries = Summaries()
+        for month, description, debit, credit, count in self._call("summaries"):
+            summaries.add_totals(month, description, debit, credit, count)
+        return summaries
+
+    def is_archived(self, year):
+        return self._call("is_archived", year=year)
+
+    def opening_balance(self, year):
+        return self._call("opening_balance", year=year)
+
+    def close_year(self, year):
+        closing = self._write("close_year", year=year)
+        self._initial_balance = closing
+        return closing
+
+    def finished_years(self):
+        return self._call("finished_years")
+
+    def refresh(self):
+        with self._lock:
+            changes, self._changes = self._changes, []
+            if self._received_balance is not None:
+                self._initial_balance, self._received_balance = self._received_balance, None
+        return changes
+
+    def _poll_main(self):
+        """انتظار تعديلات الأجهزة الأخرى من الخادم وإضافتها إلى ما ترجعه refresh"""
+        self._poll_connection = self._connect(REQUEST_TIMEOUT + CHANGES_WAIT)
+        while not self._closing:
+            path = f"/changes?since={self._seq}&wait={CHANGES_WAIT}&client={self.client_id}"
+            try:
+                data = self._request("GET", path, connection=self._poll_connection)
+            except (OSError, RuntimeError) as e:
+                if self._closing:
+                    return
+                print(f"تعذر قراءة التعديلات من خادم الدفتر: {e}")
+                time.sleep(RECONNECT_DELAY)
+                continue
+            self._seq = data["seq"]
+            if data["events"]:
+                self._apply_events(data["events"])
+                self._report_change()
+
+    def _apply_events(self, events):
+        """التعديلات والرصيد الافتتاحي الجديد تطبق عند refresh، كما في المخازن المحلية"""
+        balance = None
+        reload = any(event.get("reload") for event in events)
+        if reload:
+            try:
+                balance = self._call("get_initial_balance")
+            except (OSError, RuntimeError) as e:
+                print(f"تعذر قراءة الرصيد الافتتاحي من خادم الدفتر: {e}")
+        with self._lock:
+            if balance is not None:
+                self._received_balance = balance
+            if reload:
+                self._changes = None
+                return
+            for event in events:
+                if "initial_balance" in event:
+                    self._received_balance = event["initial_balance"]
+                elif self._changes is not None:
+                    self._changes.append((event["old"], event["new"]))
+
+    def close(self):
+        self._closing = True
+        if self._poll_connection is not None and self._poll_connection.sock is not None:
+            # قطع الانتظار الجاري حتى لا ينتظر الإغلاق CHANGES_WAIT
+            try:
+                self._poll_connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._poll_thread.join(RECONNECT_DELAY)
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
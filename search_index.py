@@ -0,0 +1,101 @@
+import re
+
+# التشكيل وعلامة المد والتطويل
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+
+ARABIC_LETTER_FORMS = str.maketrans({
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي",
+    "ؤ": "و",
+    "ئ": "ي",
+})
+
+NGRAM_SIZE = 3
+
+
+def normalize_arabic(text):
+    """توحيد الكتابة العربية للبحث: حذف التشكيل وتوحيد الألف والتاء المربوطة والألف المقصورة"""
+    text = ARABIC_DIACRITICS.sub("", text)
+    return text.translate(ARABIC_LETTER_FORMS).casefold()
+
+
+def ngrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class SearchIndex:
+    """فهرس نصي مقلوب على رقم الفاتورة والبيان.
+
+    يتم فهرسة القيم المختلفة بعد التوحيد فقط (البيانات مثل "سولار" تتكرر كثيراً):
+    كل قيمة لها قائمة معرفات الفواتير، وكل مقطع ثلاثي يشير إلى القيم التي تحتويه.
+    التحديث عند الإضافة والتعديل والحذف تدريجي.
+    """
+
+    FIELDS = ("invoice_number", "description")
+
+    def __init__(self, invoices=()):
+        self.postings = {}  # القيمة بعد التوحيد -> معرفات الفواتير
+        self.grams = {}  # المقطع الثلاثي -> القيم التي تحتويه
+        self._normalized = {}  # القيمة الأصلية -> القيمة بعد التوحيد
+        for invoice in invoices:
+            self.add(invoice)
+
+    def _normalize(self, value):
+        normalized = self._normalized.get(value)
+        if normalized is None:
+            normalized = normalize_arabic(value)
+            self._normalized[value] = normalized
+        return normalized
+
+    def _values(self, invoice):
+        return {self._normalize(invoice[field]) for field in self.FIELDS}
+
+    def add(self, invoice):
+        for value in self._values(invoice):
+            ids = self.postings.get(value)
+            if ids is None:
+                ids = self.postings[value] = set()
+                for gram in ngrams(value):
+                    self.grams.setdefault(gram, set()).add(value)
+            ids.add(invoice["id"])
+
+    def remove(self, invoice):
+        for value in self._values(invoice):
+            ids = self.postings.get(value)
+            if ids is None:
+                continue
+            ids.discard(invoice["id"])
+            if not ids:
+                del self.postings[value]
+                for gram in ngrams(value):
+                    values = self.grams[gram]
+                    values.discard(value)
+                    if not values:
+                        del self.grams[gram]
+
+    def matching_values(self, text):
+        query = normalize_arabic(text)
+        if len(query) < NGRAM_SIZE:
+            # الاستعلامات القصيرة: فحص القيم المختلفة فقط
+            return [value for value in self.postings if query in value]
+
+        candidates = None
+        for gram in sorted(ngrams(query), key=lambda gram: len(self.grams.get(gram, ()))):
+            values = self.grams.get(gram)
+            if not values:
+                return []
+            candidates = set(values) if candidates is None else candidates & values
+            if not candidates:
+                return []
+        return [value for value in candidates if query in value]
+
+    def search(self, text):
+        """معرفات الفواتير التي يحتوي رقمها أو بيانها على النص"""
+        ids = set()
+        for value in self.matching_values(text):
+            ids |= self.postings[value]
+        return ids
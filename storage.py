@@ -0,0 +1,1573 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import perf
+from balance import invoice_amount, to_milli
+
+from binary_snapshot import (
+    binary_snapshot_is_current, binary_snapshot_path_for, file_signature,
+    open_binary_snapshot, write_binary_snapshot,
+)
+from records import InvoiceTable
+from search_index import SearchIndex, normalize_arabic
+from summaries import Summaries, invoice_month
+
+DATA_FILE = "accounting_data.json"
+
+# عدد العمليات في السجل قبل دمجه في ملف البيانات في الخلفية
+COMPACT_THRESHOLD = 500
+
+# عند قلة نتائج البحث النصي يتم فحصها مباشرة بدلاً من فلترة الدفتر كاملاً
+SMALL_RESULT_SIZE = 5000
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+# الدفتر المقسم حسب السنة: ملف السنوات وعدد السنوات المحملة في الذاكرة
+MANIFEST_FILE = "manifest.json"
+SHARD_CACHE_SIZE = 3
+# الفواتير ذات التاريخ غير الصالح تحفظ في ملف سنة 0000
+UNKNOWN_YEAR = 0
+
+# مهلة تجميع التعديلات المتتالية في كتابة واحدة إلى السجل (بالثواني)
+WRITE_BEHIND_DELAY = 0.05
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def write_temp_file(path, write, binary=False):
+    """كتابة محتوى الملف في ملف مؤقت بجانبه مع fsync، وإرجاع مسار الملف المؤقت"""
+    tmp_path = path + ".tmp"
+    with (open(tmp_path, "wb") if binary else open(tmp_path, "w", encoding="utf-8")) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def replace_file(path, write, binary=False):
+    """كتابة ملف كامل بأمان: ملف مؤقت ثم fsync ثم os.replace، فلا يبقى ملف مقطوع عند انقطاع الكتابة"""
+    os.replace(write_temp_file(path, write, binary), path)
+
+
+def journal_path_for(path):
+    """مسار سجل العمليات المجاور لملف البيانات"""
+    return os.path.splitext(path)[0] + ".journal"
+
+
+def previous_journal_path_for(path):
+    """آخر جزء دمج من السجل، تقرؤه البرامج الأخرى إذا دمج السجل قبل أن تقرأه"""
+    return journal_path_for(path) + ".1"
+
+
+def build_state(data):
+    """تحويل بيانات ملف JSON إلى فهرس فواتير حسب المعرف (أعمدة مدمجة بدلاً من القواميس).
+
+    الفواتير القديمة بدون معرف تحصل على معرف بالترتيب، وهذا ثابت طالما لم يتغير الملف.
+    """
+    items = data.get("invoice_items", [])
+    next_id = data.get("next_id", 1)
+    for item in items:
+        if "id" in item:
+            next_id = max(next_id, item["id"] + 1)
+
+    for item in items:
+        if "id" not in item:
+            item["id"] = next_id
+            next_id += 1
+    invoices = InvoiceTable(items)
+
+    return {
+        "initial_balance": data.get("initial_balance", 0.0),
+        "journal_seq": data.get("journal_seq", 0),
+        "next_id": next_id,
+        "invoices": invoices,
+    }
+
+
+def state_to_data(state):
+    """تحويل الفهرس إلى صيغة ملف JSON.
+
+    journal_seq أول مفتاح حتى تعرف البرامج الأخرى ما دمج في الملف بقراءة أوله فقط.
+    """
+    return {
+        "journal_seq": state["journal_seq"],
+        "initial_balance": state["initial_balance"],
+        "next_id": state["next_id"],
+        "invoice_items": list(state["invoices"].values()),
+    }
+
+
+JOURNAL_SEQ_HEAD = re.compile(rb'"journal_seq":\s*(\d+)')
+
+
+def read_journal_seq(path):
+    """رقم آخر عملية مدمجة في ملف البيانات من أول الملف (None للملفات القديمة أو غير الموجودة)"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+    except FileNotFoundError:
+        return None
+    match = JOURNAL_SEQ_HEAD.search(head)
+    return int(match.group(1)) if match else None
+
+
+def apply_operation(state, operation):
+    """تطبيق عملية واحدة من السجل على الفهرس"""
+    op = operation.get("op")
+    invoices = state["invoices"]
+    if op == "initial_balance":
+        state["initial_balance"] = operation["value"]
+        return
+    if op == "add_many":
+        for invoice in operation["invoices"]:
+            apply_operation(state, {"op": "add", "invoice": invoice})
+        return
+
+    if op in ("edit", "delete") and "id" not in operation:
+        # عمليات السجل القديمة كانت تحدد الفاتورة بموقعها في القائمة
+        operation["id"] = list(invoices)[operation["index"]]
+
+    if op in ("add", "edit"):
+        invoice = operation["invoice"]
+        if op == "edit":
+            invoice["id"] = operation["id"]
+        elif "id" not in invoice:
+            invoice["id"] = state["next_id"]
+        invoices[invoice["id"]] = invoice
+        state["next_id"] = max(state["next_id"], invoice["id"] + 1)
+    elif op == "delete":
+        invoices.pop(operation["id"], None)
+    elif op == "delete_many":
+        for invoice_id in operation["ids"]:
+            invoices.pop(invoice_id, None)
+    else:
+        print(f"عملية غير معروفة في سجل البيانات: {op}")
+
+
+def added_invoices(operation):
+    """الفواتير المضافة في عملية من السجل (قائمة فارغة لباقي العمليات)"""
+    if operation.get("op") == "add":
+        return [operation["invoice"]]
+    if operation.get("op") == "add_many":
+        return operation["invoices"]
+    return []
+
+
+def invoice_matches(invoice, year=None, date_from=None, date_to=None, text=None):
+    """التحقق من مطابقة الفاتورة لشروط البحث (التواريخ بصيغة yyyy-MM-dd)"""
+    date_str = invoice["date"]
+    if year is not None:
+        try:
+            if int(date_str[:4]) != year:
+                return False
+        except ValueError:
+            print(f"تنسيق تاريخ غير صالح: {date_str}")
+            return False
+    if date_from is not None and date_str < date_from:
+        return False
+    if date_to is not None and date_str > date_to:
+        return False
+    if text:
+        text = normalize_arabic(text)
+        if (text not in normalize_arabic(invoice["invoice_number"])
+                and text not in normalize_arabic(invoice["description"])):
+            return False
+    return True
+
+
+def invoice_year(invoice):
+    """سنة الفاتورة من تاريخها، أو None إذا كان التاريخ غير صالح"""
+    try:
+        return int(invoice["date"][:4])
+    except ValueError:
+        return None
+
+
+def select_invoices(invoices, year=None, date_from=None, date_to=None):
+    """الفواتير ضمن السنة ونطاق التاريخ بترتيب الإدخال بدون النسخة العمودية"""
+    if hasattr(invoices, "select"):
+        # فواتير اللقطة الثنائية تفلتر على عمود التاريخ بدون فك الصفوف
+        return invoices.select(year, date_from, date_to, invoice_matches)
+    return [
+        invoice
+        for invoice in list(invoices.values())
+        if invoice_matches(invoice, year, date_from, date_to)
+    ]
+
+
+class Storage:
+    """الواجهة المشتركة لطرق تخزين دفتر الفواتير"""
+
+    def get_initial_balance(self):
+        raise NotImplementedError
+
+    def set_initial_balance(self, value):
+        raise NotImplementedError
+
+    def query(self, year=None, date_from=None, date_to=None, text=None):
+        """إرجاع الفواتير المطابقة بترتيب الإدخال"""
+        raise NotImplementedError
+
+    def years(self):
+        """السنوات التي فيها فواتير بترتيب تصاعدي"""
+        raise NotImplementedError
+
+    def add_invoice(self, invoice):
+        raise NotImplementedError
+
+    def add_invoices(self, invoices):
+        """إضافة عدة فواتير كعملية واحدة"""
+        raise NotImplementedError
+
+    def get_invoice(self, invoice_id):
+        raise NotImplementedError
+
+    def update_invoice(self, invoice_id, new_invoice):
+        """استبدال الفاتورة ذات المعرف المحدد مع الإبقاء على معرفها"""
+        raise NotImplementedError
+
+    def delete_invoice(self, invoice_id):
+        raise NotImplementedError
+
+    def delete_invoices(self, invoice_ids):
+        """حذف عدة فواتير كعملية واحدة"""
+        raise NotImplementedError
+
+    def load(self):
+        """إرجاع كل البيانات بصيغة ملف JSON"""
+        raise NotImplementedError
+
+    def summaries(self):
+        """مجاميع الدفتر حسب الشهر والسنة والبيان (Summaries).
+
+        المخازن تحفظ الملخص في الذاكرة بعد أول طلب وتحدثه مع كل تعديل؛ هذا الافتراضي يحسبه من كل الفواتير.
+        """
+        return Summaries(self.query())
+
+    def refresh(self):
+        """قراءة ما كتبته برامج أخرى في ملف البيانات منذ آخر استدعاء.
+
+        ترجع قائمة (الفاتورة القديمة، الجديدة) لكل فاتورة تغيرت (None للمضافة أو المحذوفة)،
+        أو None إذا أعيد تحميل الدفتر كاملاً.
+        """
+        return []
+
+    def sync(self):
+        """كتابة التعديلات المعلقة على القرص الآن بدون دمج (False عند الفشل).
+
+        خادم الدفتر يستدعيها مرة واحدة بعد كل مجموعة تعديلات قبل الرد على العملاء.
+        """
+        return True
+
+    def flush(self):
+        """كتابة أي تغييرات معلقة على القرص"""
+        pass
+
+    def flush_in_background(self):
+        """مثل flush بدون انتظار القرص (مثلاً عند إغلاق نافذة والبرنامج ما زال يعمل)"""
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+    def add_error_listener(self, callback):
+        """callback(message) عند فشل الحفظ في الخلفية؛ قد تستدعى من خيط آخر"""
+        self.__dict__.setdefault("_error_listeners", []).append(callback)
+
+    def _report_error(self, message):
+        print(message)
+        for callback in self.__dict__.get("_error_listeners", ()):
+            callback(message)
+
+    def add_change_listener(self, callback):
+        """callback() عند وصول تعديلات يمكن قراءتها بـ refresh؛ قد تستدعى من خيط آخر.
+
+        المخازن المحلية لا تستدعيها (تعديلات البرامج الأخرى تقرأ بالفحص الدوري).
+        """
+        self.__dict__.setdefault("_change_listeners", []).append(callback)
+
+    def _report_change(self):
+        for callback in self.__dict__.get("_change_listeners", ()):
+            callback()
+
+
+class JsonStorage(Storage):
+    """تخزين البيانات كملف JSON كامل مع سجل عمليات (JSON Lines) يضاف إليه فقط.
+
+    كل حفظ يضيف سطراً واحداً إلى السجل، ويتم دمج السجل في ملف البيانات
+    في الخلفية عند تجاوز حد معين أو عند الإغلاق.
+
+    التعديل يطبق في الذاكرة فوراً، وسطر السجل يكتب في خيط الكتابة الخلفي: التعديلات
+    المتتالية خلال WRITE_BEHIND_DELAY تكتب معاً بعملية fsync واحدة، لذلك لا ينتظر
+    خيط الواجهة القرص. أخطاء الكتابة ترسل إلى add_error_listener ويعاد المحاولة لاحقاً.
+
+    إذا كانت هناك لقطة ثنائية (.snap) مكتوبة من نسخة ملف JSON الحالية يتم فتحها
+    بـ mmap بدلاً من قراءة ملف JSON، وإلا يتم التحميل من JSON وكتابة اللقطة في الخلفية.
+
+    برامج أخرى (مثل cle.py أو سطر الأوامر) قد تكتب في نفس الملف: refresh تقرأ فقط أسطر
+    السجل الجديدة بعد آخر إزاحة مقروءة وتطبقها على الذاكرة. لا يكتب هذا البرنامج في السجل
+    قبل قراءة ما أضافته البرامج الأخرى، وتعاد ترقيم أسطره المعلقة بعدها حتى لا يتكرر seq.
+    """
+
+    def __init__(self, path=DATA_FILE, compact_threshold=COMPACT_THRESHOLD, binary_snapshot=True,
+                 background_frame=True):
+        self.path = path
+        self.journal_path = journal_path_for(path)
+        self.binary_path = binary_snapshot_path_for(path) if binary_snapshot else None
+        self._binary = None  # اللقطة المفتوحة بـ mmap التي تعتمد عليها البيانات الحالية
+        self._binary_thread = None
+        self._binary_lock = threading.Lock()
+        self.compact_threshold = compact_threshold
+        self.state = None
+        self._frame = None
+        self._version = 0
+        self._frame_thread = None
+        # الأوامر التي تنفذ استعلاماً واحداً ثم تغلق (سطر الأوامر) لا تحتاج النسخة العمودية
+        self.background_frame = background_frame
+        self._search_index = None
+        self._summaries = None
+        self._index_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # ترتيب الكتابة في ملف السجل بين خيط الكتابة والدمج (لا يستخدمه خيط الواجهة)
+        self._journal_lock = threading.Lock()
+        # دمج واحد في كل مرة (خيط الدمج وflush يكتبان نفس الملف المؤقت)
+        self._compact_lock = threading.Lock()
+        self._compact_thread = None
+        self._seq = 0
+        self._pending = 0
+        self._unwritten = []  # أسطر السجل التي لم تكتب بعد بترتيب seq
+        self._writer_wakeup = threading.Event()
+        self._writer_thread = None
+        self._closing = False
+        # ما تعكسه الذاكرة من الملفات: حجم السجل المقروء وآخر seq وتوقيع ملف البيانات
+        self._journal_offset = 0
+        self._applied_seq = 0
+        self._base_signature = None
+        self._partial_tail = None
+        self._changes = []  # تعديلات البرامج الأخرى التي لم ترجعها refresh بعد (None: إعادة تحميل)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            print("خطأ في قراءة ملف البيانات. سيتم إنشاء بيانات جديدة")
+            return {}
+
+    def _replay(self, state, lines):
+        """تطبيق عمليات السجل التي لم تدمج بعد في ملف البيانات"""
+        applied_seq = state["journal_seq"]
+        last_seq = applied_seq
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                operation = json.loads(line)
+            except json.JSONDecodeError:
+                # سطر غير مكتمل بسبب انقطاع الكتابة
+                print("تم تجاهل سطر تالف في سجل البيانات")
+                continue
+            seq = operation.get("seq", 0)
+            if seq <= applied_seq:
+                continue
+            apply_operation(state, operation)
+            last_seq = max(last_seq, seq)
+        state["journal_seq"] = last_seq
+        return state
+
+    def _read_journal(self, offset=0, complete_only=False):
+        """أسطر السجل بعد الإزاحة مع الإزاحة الجديدة بالبايت.
+
+        complete_only لا يقرأ سطراً أخيراً غير مكتمل (برنامج آخر ما زال يكتبه)، إلا إذا بقي
+        كما هو منذ القراءة السابقة (انقطعت كتابته) فيقرأ ويتم تجاهله كسطر تالف.
+        """
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = len(data)
+        if complete_only:
+            complete = data.rfind(b"\n") + 1
+            tail = (offset + end, data[complete:])
+            if complete < end and tail != self._partial_tail:
+                self._partial_tail = tail
+                end = complete
+        return data[:end].decode("utf-8", errors="replace").splitlines(), offset + end
+
+    def _read_base_state(self):
+        """حالة ملف البيانات قبل تطبيق السجل: من اللقطة الثنائية إن كانت صالحة وإلا من JSON"""
+        # التوقيع يؤخذ قبل القراءة حتى لا تعتبر اللقطة صالحة لملف تغير أثناء قراءته
+        signature = file_signature(self.path)
+        if self.binary_path is not None:
+            binary = open_binary_snapshot(self.binary_path, signature)
+            if binary is not None:
+                self._binary = binary
+                self._base_signature = signature
+                return binary.state()
+
+        self._base_signature = signature
+        state = build_state(self._read_snapshot())
+        if self.binary_path is not None and signature is not None:
+            base = dict(state, invoices=dict(state["invoices"]))
+            self._binary_thread = threading.Thread(
+                target=self._write_binary_snapshot, args=(base, signature), daemon=True)
+            self._binary_thread.start()
+        return state
+
+    def _write_binary_snapshot(self, state, signature):
+        with self._binary_lock:
+            write_binary_snapshot(self.binary_path, state, signature)
+
+    def _load_state(self):
+        """تحميل ملف البيانات مع تطبيق سجل العمليات"""
+        # ترتيب الأقفال دائماً: السجل ثم الحالة (مثل خيط الكتابة)
+        with self._journal_lock, self._lock, perf.timed("load_data") as op:
+            state = self._read_base_state()
+            snapshot_seq = state["journal_seq"]
+            lines, self._journal_offset = self._read_journal()
+            state = self._replay(state, lines)
+            self._seq = state["journal_seq"]
+            self._applied_seq = self._seq
+            self._pending = self._seq - snapshot_seq
+            op.rows = len(state["invoices"])
+            if perf.is_enabled():
+                op.bytes_read = _file_size(self.binary_path if self._binary is not None else self.path)
+                op.bytes_read += sum(len(line) for line in lines)
+        self.state = state
+        self._invalidate_frame()
+        with self._index_lock:
+            self._search_index = None
+            self._summaries = None
+        return state
+
+    def load(self):
+        return state_to_data(self._load_state())
+
+    def _state(self):
+        if self.state is None:
+            # بدون تحويل إلى صيغة JSON حتى لا يتم فك كل صفوف اللقطة الثنائية
+            self._load_state()
+        return self.state
+
+    def get_initial_balance(self):
+        return self._state()["initial_balance"]
+
+    def set_initial_balance(self, value):
+        self._state()["initial_balance"] = value
+        self._append({"op": "initial_balance", "value": value})
+
+    def _invalidate_frame(self):
+        self._version += 1
+        self._frame = None
+
+    def frame(self):
+        """النسخة العمودية من الدفتر، يعاد بناؤها بعد أي تعديل عند أول استعلام.
+
+        قد يتم استدعاؤها من خيط البحث، لذلك لا تحفظ النسخة إذا تغيرت البيانات أثناء بنائها.
+        """
+        frame = self._frame
+        if frame is None:
+            from query_engine import LedgerFrame
+            version = self._version
+            invoices = self._state()["invoices"]
+            if isinstance(invoices, InvoiceTable):
+                frame = LedgerFrame.from_table(invoices)
+            else:
+                frame = LedgerFrame(list(invoices.values()))
+            if version == self._version:
+                self._frame = frame
+        return frame
+
+    def search(self, text):
+        """معرفات الفواتير المطابقة للنص من الفهرس النصي (يبنى عند أول بحث)"""
+        invoices = self._state()["invoices"]
+        with self._index_lock:
+            if self._search_index is None:
+                self._search_index = SearchIndex(list(invoices.values()))
+            return self._search_index.search(text)
+
+    def summaries(self):
+        """ملخص الدفتر (يبنى عند أول طلب ثم يحدث مع كل تعديل مثل الفهرس النصي)"""
+        invoices = self._state()["invoices"]
+        with self._index_lock:
+            if self._summaries is None:
+                with perf.timed("build_summaries") as op:
+                    self._summaries = Summaries(list(invoices.values()))
+                    op.rows = len(invoices)
+            return self._summaries
+
+    def _index_update(self, old_invoice=None, new_invoice=None):
+        with self._index_lock:
+            for index in (self._search_index, self._summaries):
+                if index is None:
+                    continue
+                if old_invoice is not None:
+                    index.remove(old_invoice)
+                if new_invoice is not None:
+                    index.add(new_invoice)
+
+    def _build_frame_in_background(self):
+        """بناء النسخة العمودية في الخلفية حتى لا يؤخر استيراد pandas بدء التشغيل"""
+        if self._frame_thread is not None and self._frame_thread.is_alive():
+            return
+        self._frame_thread = threading.Thread(target=self.frame, daemon=True)
+        self._frame_thread.start()
+
+    def query(self, year=None, date_from=None, date_to=None, text=None):
+        frame = self._frame
+        if frame is None and self.background_frame:
+            # حتى تجهز النسخة العمودية يتم الفحص مباشرة
+            self._build_frame_in_background()
+
+        invoices = self._state()["invoices"]
+        if not text:
+            if frame is not None:
+                return frame.query(year, date_from, date_to)
+            return select_invoices(invoices, year, date_from, date_to)
+
+        ids = self.search(text)
+        if frame is not None and len(ids) > SMALL_RESULT_SIZE:
+            return frame.query(year, date_from, date_to, ids=ids)
+        results = []
+        # ترتيب المعرفات هو ترتيب الإدخال
+        for invoice_id in sorted(ids):
+            invoice = invoices.get(invoice_id)
+            if invoice is not None and invoice_matches(invoice, year, date_from, date_to):
+                results.append(invoice)
+        return results
+
+    def years(self):
+        invoices = self._state()["invoices"]
+        if hasattr(invoices, "years"):
+            return invoices.years()
+        return sorted({year for year in map(invoice_year, list(invoices.values())) if year is not None})
+
+    def get_invoice(self, invoice_id):
+        return self._state()["invoices"][invoice_id]
+
+    def _insert(self, invoice):
+        """إضافة فاتورة إلى الفهرس، مع الإبقاء على معرفها إن وجد (كما في SQLite)"""
+        state = self._state()
+        if invoice.get("id") is None:
+            invoice["id"] = state["next_id"]
+        state["next_id"] = max(state["next_id"], invoice["id"] + 1)
+        state["invoices"][invoice["id"]] = invoice
+        self._index_update(new_invoice=invoice)
+
+    def add_invoice(self, invoice):
+        self._insert(invoice)
+        self._invalidate_frame()
+        self._append({"op": "add", "invoice": invoice})
+
+    def add_invoices(self, invoices):
+        """إضافة عدة فواتير في سطر واحد من السجل"""
+        for invoice in invoices:
+            self._insert(invoice)
+        self._invalidate_frame()
+        self._append({"op": "add_many", "invoices": invoices}, len(invoices))
+
+    def update_invoice(self, invoice_id, new_invoice):
+        invoices = self._state()["invoices"]
+        if invoice_id not in invoices:
+            raise KeyError(f"الفاتورة رقم {invoice_id} غير موجودة")
+        new_invoice["id"] = invoice_id
+        old_invoice = invoices[invoice_id]
+        invoices[invoice_id] = new_invoice
+        self._invalidate_frame()
+        self._index_update(old_invoice, new_invoice)
+        self._append({"op": "edit", "id": invoice_id, "invoice": new_invoice})
+
+    def delete_invoice(self, invoice_id):
+        invoice = self._state()["invoices"].pop(invoice_id)
+        self._invalidate_frame()
+        self._index_update(old_invoice=invoice)
+        self._append({"op": "delete", "id": invoice_id})
+
+    def delete_invoices(self, invoice_ids):
+        """حذف عدة فواتير في سطر واحد من السجل"""
+        invoices = self._state()["invoices"]
+        invoice_ids = list(invoice_ids)
+        for invoice_id in invoice_ids:
+            self._index_update(old_invoice=invoices.pop(invoice_id))
+        self._invalidate_frame()
+        self._append({"op": "delete_many", "ids": invoice_ids}, len(invoice_ids))
+
+    def _append(self, operation, weight=1):
+        """إضافة عملية إلى طابور السجل؛ الكتابة على القرص في خيط الكتابة"""
+        with self._lock:
+            self._seq += 1
+            # التحويل الآن لأن القاموس قد يتغير قبل الكتابة
+            try:
+                line = json.dumps(dict(operation, seq=self._seq), ensure_ascii=False, default=dict) + "\n"
+            except Exception as e:
+                self._seq -= 1
+                self._report_error(f"خطأ في حفظ البيانات: {e}")
+                return
+            self._unwritten.append(line)
+            self._pending += weight
+        if self._writer_thread is None:
+            self._writer_thread = threading.Thread(target=self._writer_main, daemon=True)
+            self._writer_thread.start()
+        self._writer_wakeup.set()
+
+    def _writer_main(self):
+        while not self._closing:
+            self._writer_wakeup.wait()
+            # انتظار قصير لتجميع التعديلات المتتالية في كتابة واحدة
+            time.sleep(WRITE_BEHIND_DELAY)
+            self._writer_wakeup.clear()
+            # عند الفشل تبقى الأسطر في الطابور ويعاد المحاولة مع التعديل التالي أو عند flush
+            if self._catch_up_before_write() and self._write_journal():
+                with self._lock:
+                    should_compact = self._pending >= self.compact_threshold
+                if should_compact:
+                    self.compact_in_background()
+
+    def _changed_outside(self):
+        """هل كتب برنامج آخر في السجل أو ملف البيانات بعد آخر قراءة؟ (مع قفل السجل)"""
+        return (_file_size(self.journal_path) != self._journal_offset
+                or file_signature(self.path) != self._base_signature)
+
+    def _write_journal(self):
+        """كتابة الأسطر المعلقة في السجل بعملية fsync واحدة (False عند الفشل).
+
+        إذا كتب برنامج آخر في السجل تنتظر الأسطر حتى تقرأ refresh تعديلاته أولاً.
+        """
+        with self._journal_lock:
+            if self.state is not None and self._changed_outside():
+                return False
+            with self._lock:
+                lines, self._unwritten = self._unwritten, []
+                last_seq = self._seq
+            if not lines:
+                return True
+            with perf.timed("journal_append") as op:
+                data = "".join(lines).encode("utf-8")
+                try:
+                    with open(self.journal_path, "ab") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                except OSError as e:
+                    with self._lock:
+                        self._unwritten[:0] = lines
+                    self._report_error(f"خطأ في حفظ البيانات: {e}")
+                    return False
+                self._journal_offset += len(data)
+                self._applied_seq = max(self._applied_seq, last_seq)
+                op.rows = len(lines)
+                op.bytes_written = len(data)
+        return True
+
+    def compact(self):
+        """دمج السجل في ملف البيانات ثم حذف العمليات المدمجة من السجل.
+
+        يتم دمج الجزء المقروء من السجل فقط؛ ما أضافته برامج أخرى بعده يبقى لتقرأه refresh.
+        """
+        with self._compact_lock:
+            self._compact()
+
+    def _compact(self):
+        with self._journal_lock:
+            if self.state is not None and file_signature(self.path) != self._base_signature:
+                # برنامج آخر دمج السجل؛ refresh تقرأ ملفه أولاً
+                return
+            base_signature = file_signature(self.path)
+            offset = self._journal_offset if self.state is not None else _file_size(self.journal_path)
+            if offset == 0:
+                return
+            # القراءة بالبايت لأن الإزاحة محسوبة بالبايت
+            with open(self.journal_path, "rb") as f:
+                merged_data = f.read(offset)
+            merged = merged_data.decode("utf-8").splitlines()
+
+        with perf.timed("save_data") as op:
+            op.bytes_read = offset
+            state = self._replay(build_state(self._read_snapshot()), merged)
+            try:
+                tmp_path = write_temp_file(self.path, lambda f: json.dump(
+                    state_to_data(state), f, indent=4, ensure_ascii=False, default=dict))
+            except Exception as e:
+                self._report_error(f"خطأ في حفظ البيانات: {e}")
+                return
+
+            with self._journal_lock:
+                if file_signature(self.path) != base_signature:
+                    # برنامج آخر دمج السجل أثناء الكتابة، فلا يتم استبدال ملفه
+                    os.remove(tmp_path)
+                    return
+                try:
+                    replace_file(previous_journal_path_for(self.path), lambda f: f.write(merged_data), binary=True)
+                except OSError as e:
+                    print(f"تعذر حفظ آخر جزء من السجل: {e}")
+                os.replace(tmp_path, self.path)
+                with open(self.journal_path, "rb") as f:
+                    f.seek(offset)
+                    tail = f.read()
+                # الأسطر الباقية كتبت بـ fsync قبل الدمج، لذلك تستبدل بنفس الأمان وليس بالكتابة فوق السجل
+                try:
+                    replace_file(self.journal_path, lambda f: f.write(tail), binary=True)
+                except OSError as e:
+                    # ملف البيانات الجديد يحتوي الأسطر المدمجة، وتكرارها في السجل يتم تجاهله حسب seq
+                    self._base_signature = file_signature(self.path)
+                    self._report_error(f"خطأ في حفظ البيانات: {e}")
+                    return
+                self._base_signature = file_signature(self.path)
+                self._journal_offset = max(0, self._journal_offset - offset)
+                with self._lock:
+                    self._pending = self._seq - state["journal_seq"]
+            op.rows = len(state["invoices"])
+            op.bytes_written = _file_size(self.path)
+        # لا يمكن استبدال ملف مفتوح بـ mmap على ويندوز، لذلك تحدث اللقطة عند الإغلاق
+        if self.binary_path is not None and self._binary is None:
+            self._write_binary_snapshot(state, file_signature(self.path))
+
+    def compact_in_background(self):
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self.compact, daemon=True)
+        self._compact_thread.start()
+
+    def _apply_external(self, lines):
+        """تطبيق أسطر السجل التي كتبتها برامج أخرى مع تسجيل الفواتير المتغيرة (مع قفل الحالة)"""
+        invoices = self.state["invoices"]
+        operations = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                operation = json.loads(line)
+            except json.JSONDecodeError:
+                print("تم تجاهل سطر تالف في سجل البيانات")
+                continue
+            if operation.get("seq", 0) > self._applied_seq:
+                operations.append(operation)
+        self._move_colliding_ids(operations)
+
+        for operation in operations:
+            seq = operation.get("seq", 0)
+            op = operation.get("op")
+            if op in ("add", "add_many"):
+                ids = [invoice.get("id") for invoice in added_invoices(operation)]
+            elif op == "delete_many":
+                ids = list(operation["ids"])
+            else:
+                ids = [operation.get("id")]
+            old_invoices = [invoices.get(invoice_id) for invoice_id in ids]
+            apply_operation(self.state, operation)
+            for invoice_id, old_invoice in zip(ids, old_invoices):
+                new_invoice = invoices.get(invoice_id)
+                if old_invoice is None and new_invoice is None:
+                    continue
+                self._index_update(old_invoice, new_invoice)
+                if self._changes is not None:
+                    self._changes.append((old_invoice, new_invoice))
+            self._applied_seq = seq
+        self.state["journal_seq"] = max(self.state["journal_seq"], self._applied_seq)
+
+    def _move_colliding_ids(self, operations):
+        """الفواتير المضافة هنا ولم تكتب بعد تنقل إلى معرفات جديدة إذا أضاف برنامج آخر فواتير
+        بنفس المعرفات (كل برنامج يعطي المعرف التالي قبل أن يرى إضافات الآخر)"""
+        if not self._unwritten:
+            return
+        external_ids = {invoice.get("id") for operation in operations for invoice in added_invoices(operation)}
+        unwritten = [json.loads(line) for line in self._unwritten]
+        colliding = external_ids.intersection(invoice.get("id") for operation in unwritten
+                                              for invoice in added_invoices(operation))
+        if not colliding:
+            return
+        invoices = self.state["invoices"]
+        next_id = max(self.state["next_id"], max(external_ids) + 1)
+        moved = {}
+        for old_id in sorted(colliding):
+            moved[old_id] = next_id
+            next_id += 1
+            old_invoice = invoices.pop(old_id, None)
+            if old_invoice is not None:
+                new_invoice = dict(old_invoice, id=moved[old_id])
+                invoices[new_invoice["id"]] = new_invoice
+                self._index_update(old_invoice, new_invoice)
+                if self._changes is not None:
+                    self._changes.append((old_invoice, new_invoice))
+        self.state["next_id"] = next_id
+
+        for operation in unwritten:
+            for invoice in added_invoices(operation):
+                invoice["id"] = moved.get(invoice.get("id"), invoice.get("id"))
+            if "id" in operation:
+                operation["id"] = moved.get(operation["id"], operation["id"])
+                if "invoice" in operation:
+                    operation["invoice"]["id"] = operation["id"]
+            if "ids" in operation:
+                operation["ids"] = [moved.get(invoice_id, invoice_id) for invoice_id in operation["ids"]]
+        self._unwritten = [json.dumps(operation, ensure_ascii=False, default=dict) + "\n" for operation in unwritten]
+
+    def _read_previous_journal(self):
+        try:
+            with open(previous_journal_path_for(self.path), "rb") as f:
+                return f.read().decode("utf-8", errors="replace").splitlines()
+        except FileNotFoundError:
+            return []
+
+    def _covers(self, lines, base_seq):
+        """هل تحتوي الأسطر كل العمليات من بعد آخر عملية مقروءة حتى base_seq بدون فجوات؟"""
+        seqs = set()
+        for line in lines:
+            try:
+                seq = json.loads(line).get("seq", 0)
+            except json.JSONDecodeError:
+                continue
+            if seq > self._applied_seq:
+                seqs.add(seq)
+        return all(seq in seqs for seq in range(self._applied_seq + 1, base_seq + 1))
+
+    def _renumber_unwritten(self):
+        """الأسطر المعلقة تأخذ أرقاماً بعد آخر عملية مقروءة من البرامج الأخرى (مع قفل الحالة)"""
+        if self._unwritten and json.loads(self._unwritten[0]).get("seq", 0) <= self._applied_seq:
+            lines = []
+            for number, line in enumerate(self._unwritten, self._applied_seq + 1):
+                operation = json.loads(line)
+                operation["seq"] = number
+                lines.append(json.dumps(operation, ensure_ascii=False, default=dict) + "\n")
+            self._unwritten = lines
+        self._seq = max(self._seq, self._applied_seq + len(self._unwritten))
+
+    def _catch_up(self, blocking=False):
+        """قراءة ما كتبته برامج أخرى منذ آخر قراءة: أسطر السجل الجديدة فقط، أو إعادة التحميل
+        إذا دمج برنامج آخر في ملف البيانات عمليات لم تقرأ بعد."""
+        if self.state is None:
+            return
+        if not self._journal_lock.acquire(blocking):
+            # كتابة أو دمج جارٍ؛ المحاولة في المرة القادمة
+            return
+        reload = False
+        try:
+            signature = file_signature(self.path)
+            size = _file_size(self.journal_path)
+            if signature == self._base_signature and size == self._journal_offset:
+                return
+            offset = self._journal_offset
+            previous = []
+            if signature != self._base_signature or size < offset:
+                # السجل دمج في ملف البيانات: العمليات غير المقروءة تؤخذ من آخر جزء مدمج إن كان
+                # يحتويها كلها، وإلا يعاد التحميل
+                base_seq = read_journal_seq(self.path)
+                offset = 0
+                if base_seq is None:
+                    reload = True
+                elif base_seq > self._applied_seq:
+                    previous = self._read_previous_journal()
+                    reload = not self._covers(previous, base_seq)
+            if not reload:
+                with perf.timed("external_changes") as op:
+                    lines, end = self._read_journal(offset, complete_only=True)
+                    lines = previous + lines
+                    with self._lock:
+                        self._apply_external(lines)
+                        self._renumber_unwritten()
+                    self._journal_offset = end
+                    self._base_signature = signature
+                    self._invalidate_frame()
+                    op.rows = len(lines)
+                    op.bytes_read = end - offset
+        finally:
+            self._journal_lock.release()
+
+        if reload:
+            self._reload()
+        if self._unwritten:
+            self._writer_wakeup.set()
+
+    def _catch_up_before_write(self):
+        """قراءة تعديلات البرامج الأخرى قبل الكتابة في السجل (False مع رسالة خطأ عند الفشل)"""
+        try:
+            self._catch_up(blocking=True)
+        except OSError as e:
+            self._report_error(f"خطأ في حفظ البيانات: {e}")
+            return False
+        return True
+
+    def _reload(self):
+        """إعادة تحميل الملف كاملاً مع الإبقاء على تعديلات هذا البرنامج التي لم تكتب بعد"""
+        with self._lock:
+            unwritten = list(self._unwritten)
+        self._load_state()
+        with self._lock:
+            for line in unwritten:
+                apply_operation(self.state, json.loads(line))
+            self._renumber_unwritten()
+        self._changes = None
+
+    def refresh(self):
+        self._catch_up()
+        changes, self._changes = self._changes, []
+        return changes
+
+    def sync(self):
+        """كتابة الأسطر المعلقة في السجل بدون انتظار خيط الكتابة وبدون دمج"""
+        return self._catch_up_before_write() and self._write_journal()
+
+    def flush(self):
+        """كتابة الأسطر المعلقة وانتظار أي دمج جارٍ ثم دمج ما تبقى من السجل"""
+        self.sync()
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+        self.compact()
+
+    def flush_in_background(self):
+        # الأسطر المعلقة يكتبها خيط الكتابة، والدمج في خيطه
+        self.compact_in_background()
+
+    def close(self):
+        """دمج السجل ثم تحرير اللقطة المفتوحة وتحديثها إذا تغير ملف JSON"""
+        self.flush()
+        if self._writer_thread is not None:
+            self._closing = True
+            self._writer_wakeup.set()
+            self._writer_thread.join()
+            self._writer_thread = None
+            self._closing = False
+        for thread in (self._frame_thread, self._binary_thread):
+            if thread is not None:
+                thread.join()
+        if self._binary is None:
+            return
+        # لا يتم إغلاق mmap صراحة لأن الجدول قد يعرض فواتير تقرأ منه؛ يغلق عند تحرير آخر فاتورة
+        self.state = None
+        self._invalidate_frame()
+        self._binary = None
+
+        signature = file_signature(self.path)
+        if signature is not None and not binary_snapshot_is_current(self.binary_path, signature):
+            self._write_binary_snapshot(build_state(self._read_snapshot()), signature)
+
+
+class SqliteStorage(Storage):
+    """تخزين الفواتير في قاعدة SQLite محلية مع فهارس على التاريخ والسنة ورقم الفاتورة.
+
+    يتم تنفيذ فلترة السنة ونطاق التاريخ كمسح لنطاق الفهرس داخل SQLite،
+    لذلك لا يلزم تحميل الدفتر بالكامل في الذاكرة.
+    """
+
+    COLUMNS = "id, invoice_number, date, description, debit, credit"
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = self._connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_schema()
+        self._owner_thread = threading.get_ident()
+        self._local = threading.local()
+        self._summaries = None
+        self._data_version = self._read_data_version()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        # البحث النصي يتجاهل اختلاف الإملاء العربي (ة/ه، أشكال الألف، التشكيل)
+        conn.create_function("normalize_arabic", 1, normalize_arabic, deterministic=True)
+        return conn
+
+    def _read_connection(self):
+        """اتصال القراءة للخيط الحالي (الاستعلامات قد تنفذ في خيط البحث)"""
+        if threading.get_ident() == self._owner_thread:
+            return self.conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def create_schema(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    invoice_number TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    description TEXT NOT NULL,
+                    debit REAL NOT NULL DEFAULT 0,
+                    credit REAL NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date);
+                CREATE INDEX IF NOT EXISTS idx_invoices_year ON invoices(year);
+                CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices(invoice_number);
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+
+    @staticmethod
+    def _row_to_invoice(row):
+        return {
+            "id": row[0],
+            "invoice_number": row[1],
+            "date": row[2],
+            "description": row[3],
+            "debit": row[4],
+            "credit": row[5],
+        }
+
+    @staticmethod
+    def _values(invoice):
+        date_str = invoice["date"]
+        return (
+            invoice.get("id"),
+            invoice["invoice_number"],
+            date_str,
+            int(date_str[:4]),
+            invoice["description"],
+            invoice.get("debit", 0.0),
+            invoice.get("credit", 0.0),
+        )
+
+    def get_initial_balance(self):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'initial_balance'").fetchone()
+        return float(row[0]) if row else 0.0
+
+    def set_initial_balance(self, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('initial_balance', ?)",
+                (str(value),))
+
+    def query(self, year=None, date_from=None, date_to=None, text=None):
+        conditions = []
+        params = []
+        if year is not None:
+            conditions.append("year = ?")
+            params.append(year)
+        if date_from is not None:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        if text:
+            conditions.append("(instr(normalize_arabic(invoice_number), ?) > 0 "
+                              "OR instr(normalize_arabic(description), ?) > 0)")
+            text = normalize_arabic(text)
+            params.extend([text, text])
+
+        sql = f"SELECT {self.COLUMNS} FROM invoices"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        return [self._row_to_invoice(row) for row in self._read_connection().execute(sql, params)]
+
+    def years(self):
+        rows = self._read_connection().execute("SELECT DISTINCT year FROM invoices ORDER BY year")
+        return [row[0] for row in rows]
+
+    def summaries(self):
+        """الملخص يبنى من GROUP BY داخل SQLite عند أول طلب ثم يحدث مع كل تعديل"""
+        if self._summaries is None:
+            summaries = Summaries()
+            rows = self.conn.execute(
+                "SELECT substr(date, 1, 7), description, SUM(CAST(round(debit * 1000) AS INTEGER)), "
+                "SUM(CAST(round(credit * 1000) AS INTEGER)), COUNT(*) FROM invoices GROUP BY 1, 2")
+            for month, description, debit, credit, count in rows:
+                summaries.add_totals(invoice_month({"date": month}), description, debit, credit, count)
+            self._summaries = summaries
+        return self._summaries
+
+    def _read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        """الاستعلامات ترى تعديلات البرامج الأخرى مباشرة؛ data_version يتغير عند أي تعديل منها
+        فيعاد حساب الملخص وتعيد النوافذ تحميل السنة المعروضة"""
+        version = self._read_data_version()
+        if version == self._data_version:
+            return []
+        self._data_version = version
+        self._summaries = None
+        return None
+
+    def _summaries_update(self, old_invoices=(), new_invoices=()):
+        if self._summaries is None:
+            return
+        for invoice in old_invoices:
+            self._summaries.remove(invoice)
+        for invoice in new_invoices:
+            self._summaries.add(invoice)
+
+    def _existing(self, invoice_ids):
+        """الفواتير قبل تعديلها أو حذفها (فقط إذا كان الملخص محملاً)"""
+        if self._summaries is None:
+            return []
+        invoices = []
+        for invoice_id in invoice_ids:
+            try:
+                invoices.append(self.get_invoice(invoice_id))
+            except KeyError:
+                pass
+        return invoices
+
+    INSERT = ("INSERT INTO invoices (id, invoice_number, date, year, description, debit, credit) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+    def get_invoice(self, invoice_id):
+        row = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"الفاتورة رقم {invoice_id} غير موجودة")
+        return self._row_to_invoice(row)
+
+    def add_invoice(self, invoice):
+        with self.conn:
+            cursor = self.conn.execute(self.INSERT, self._values(invoice))
+        invoice["id"] = cursor.lastrowid
+        self._summaries_update(new_invoices=[invoice])
+
+    def add_invoices(self, invoices):
+        """إضافة عدة فواتير في معاملة واحدة مع معرف كل فاتورة فيها (كما في add_invoice)"""
+        with self.conn:
+            for invoice in invoices:
+                invoice["id"] = self.conn.execute(self.INSERT, self._values(invoice)).lastrowid
+        self._summaries_update(new_invoices=invoices)
+
+    def update_invoice(self, invoice_id, new_invoice):
+        new_invoice["id"] = invoice_id
+        old_invoices = self._existing([invoice_id])
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE invoices SET id = ?, invoice_number = ?, date = ?, year = ?, description = ?, "
+                "debit = ?, credit = ? WHERE id = ?",
+                self._values(new_invoice) + (invoice_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(f"الفاتورة رقم {invoice_id} غير موجودة")
+        self._summaries_update(old_invoices, [new_invoice])
+
+    def delete_invoice(self, invoice_id):
+        self.delete_invoices([invoice_id])
+
+    def delete_invoices(self, invoice_ids):
+        invoice_ids = list(invoice_ids)
+        old_invoices = self._existing(invoice_ids)
+        with self.conn:
+            self.conn.executemany("DELETE FROM invoices WHERE id = ?", ((invoice_id,) for invoice_id in invoice_ids))
+        self._summaries_update(old_invoices)
+
+    def load(self):
+        return {"initial_balance": self.get_initial_balance(), "invoice_items": self.query()}
+
+    def import_json(self, path):
+        """استيراد ملف بيانات JSON (مع سجل عملياته) إلى قاعدة البيانات"""
+        data = JsonStorage(path).load()
+        # add_invoices يضع المعرف الجديد في كل فاتورة، والفواتير المحملة للقراءة فقط
+        self.add_invoices([dict(invoice) for invoice in data["invoice_items"]])
+        self.set_initial_balance(data.get("initial_balance", 0.0))
+
+    def export_json(self, path):
+        """تصدير قاعدة البيانات إلى ملف بيانات JSON"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.load(), f, indent=4, ensure_ascii=False, default=dict)
+
+    def close(self):
+        self.conn.close()
+
+
+class ShardedStorage(Storage):
+    """دفتر مقسم حسب السنة المالية: ملف JSON (مع سجله ولقطته الثنائية) لكل سنة في مجلد واحد.
+
+    ملف manifest.json يحفظ الرصيد الافتتاحي وآخر معرف، ولكل سنة عدد الفواتير وصافي
+    الحركات والرصيد الختامي، لذلك لا يتم تحميل أي سنة قبل طلبها. السنوات المحملة
+    تحفظ في ذاكرة مؤقتة LRU.
+
+    ملف السنوات يكتب قبل تعديل ملف السنة ويحفظ رقم آخر عملية في سجلها؛ إذا لم يطابق
+    السجل عند تحميل السنة (انقطاع أثناء الحفظ) يعاد حساب بيانات تلك السنة.
+    """
+
+    def __init__(self, directory, cache_size=SHARD_CACHE_SIZE, background_frame=True):
+        self.directory = directory
+        self.background_frame = background_frame
+        # نقل فاتورة بين سنتين يحتاج السنتين معاً في الذاكرة
+        self.cache_size = max(cache_size, 2)
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self._shards = OrderedDict()
+        self._lock = threading.RLock()
+        self._summaries = None
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_signature = file_signature(self.manifest_path)
+        self.manifest = self._read_manifest()
+        self._sync_manifest()
+
+    def _shard_path(self, year):
+        return os.path.join(self.directory, f"{year:04d}.json")
+
+    @staticmethod
+    def _year_of(invoice):
+        year = invoice_year(invoice)
+        return UNKNOWN_YEAR if year is None else year
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except json.JSONDecodeError:
+            print("خطأ في قراءة ملف السنوات. سيعاد بناؤه من ملفات السنوات")
+            data = {}
+        return {
+            "initial_balance": data.get("initial_balance", 0.0),
+            "next_id": data.get("next_id", 1),
+            "years": {int(year): entry for year, entry in data.get("years", {}).items()},
+        }
+
+    def _write_manifest(self):
+        initial = to_milli(self.manifest["initial_balance"])
+        years = {}
+        for year, entry in sorted(self.manifest["years"].items()):
+            years[f"{year:04d}"] = dict(entry, closing_balance=(initial + entry["net"]) / 1000)
+        data = {
+            "initial_balance": self.manifest["initial_balance"],
+            "next_id": self.manifest["next_id"],
+            "years": years,
+        }
+        try:
+            replace_file(self.manifest_path, lambda f: json.dump(data, f, indent=4, ensure_ascii=False))
+        except Exception as e:
+            self._report_error(f"خطأ في حفظ ملف السنوات: {e}")
+            return
+        self._manifest_signature = file_signature(self.manifest_path)
+
+    def _sync_manifest(self):
+        """مطابقة ملف السنوات مع ملفات السنوات الموجودة في المجلد"""
+        years_on_disk = set()
+        for name in os.listdir(self.directory):
+            base, ext = os.path.splitext(name)
+            if ext in (".json", ".journal") and base.isdigit():
+                years_on_disk.add(int(base))
+        changed = False
+        for year in list(self.manifest["years"]):
+            if year not in years_on_disk:
+                del self.manifest["years"][year]
+                changed = True
+        if changed:
+            self._write_manifest()
+        for year in sorted(years_on_disk - set(self.manifest["years"])):
+            # تحميل السنة يعيد حساب بياناتها في ملف السنوات
+            self._shard(year)
+
+    def _recompute_entry(self, year, shard):
+        invoices = list(shard._state()["invoices"].values())
+        entry = {
+            "count": len(invoices),
+            "net": sum(invoice_amount(invoice) for invoice in invoices),
+            "max_id": max((invoice["id"] for invoice in invoices), default=0),
+            "journal_seq": shard._seq,
+        }
+        self.manifest["years"][year] = entry
+        self.manifest["next_id"] = max(self.manifest["next_id"], entry["max_id"] + 1)
+
+    def _shard(self, year):
+        """ملف السنة من الذاكرة المؤقتة، أو تحميله عند أول طلب"""
+        with self._lock:
+            shard = self._shards.get(year)
+            if shard is not None:
+                self._shards.move_to_end(year)
+                return shard
+
+            shard = JsonStorage(self._shard_path(year), background_frame=self.background_frame)
+            for callback in self.__dict__.get("_error_listeners", ()):
+                shard.add_error_listener(callback)
+            shard._state()
+            entry = self.manifest["years"].get(year)
+            if entry is None or entry.get("journal_seq") != shard._seq:
+                self._recompute_entry(year, shard)
+                self._write_manifest()
+            self._shards[year] = shard
+            while len(self._shards) > self.cache_size:
+                _, evicted = self._shards.popitem(last=False)
+                evicted.close()
+            return shard
+
+    def _change_entry(self, year, shard, old_invoice=None, new_invoice=None):
+        """تحديث بيانات السنة قبل تنفيذ عملية واحدة على سجلها"""
+        entry = self.manifest["years"].setdefault(
+            year, {"count": 0, "net": 0, "max_id": 0, "journal_seq": shard._seq})
+        if old_invoice is not None:
+            entry["count"] -= 1
+            entry["net"] -= invoice_amount(old_invoice)
+        if new_invoice is not None:
+            entry["count"] += 1
+            entry["net"] += invoice_amount(new_invoice)
+            entry["max_id"] = max(entry["max_id"], new_invoice["id"])
+        # كل عملية تضيف سطراً واحداً إلى سجل السنة
+        entry["journal_seq"] = shard._seq + 1
+        if self._summaries is not None:
+            if old_invoice is not None:
+                self._summaries.remove(old_invoice)
+            if new_invoice is not None:
+                self._summaries.add(new_invoice)
+
+    def _find(self, invoice_id):
+        """السنة التي تحتوي الفاتورة: السنوات المحملة أولاً ثم الباقي"""
+        with self._lock:
+            years = list(reversed(self._shards))
+            years += [year for year in sorted(self.manifest["years"], reverse=True) if year not in years]
+            for year in years:
+                entry = self.manifest["years"].get(year)
+                if entry is not None and entry["max_id"] < invoice_id:
+                    continue
+                shard = self._shard(year)
+                if invoice_id in shard._state()["invoices"]:
+                    return year, shard
+        raise KeyError(f"الفاتورة رقم {invoice_id} غير موجودة")
+
+    def refresh(self):
+        """تعديلات البرامج الأخرى: أسطر السجل الجديدة للسنوات المحملة، وبيانات باقي السنوات
+        والرصيد الافتتاحي من ملف السنوات (None إذا تغيرت سنة غير محملة)"""
+        with self._lock:
+            changes = []
+            for year, shard in list(self._shards.items()):
+                shard_changes = shard.refresh()
+                if shard_changes is None:
+                    self._recompute_entry(year, shard)
+                    self._summaries = None
+                    changes = None
+                    continue
+                for old_invoice, new_invoice in shard_changes:
+                    self._change_entry(year, shard, old_invoice, new_invoice)
+                    self.manifest["next_id"] = max(self.manifest["next_id"], self.manifest["years"][year]["max_id"] + 1)
+                if year in self.manifest["years"]:
+                    self.manifest["years"][year]["journal_seq"] = shard._seq
+                if changes is not None:
+                    changes.extend(shard_changes)
+
+            if file_signature(self.manifest_path) != self._manifest_signature:
+                self._manifest_signature = file_signature(self.manifest_path)
+                disk = self._read_manifest()
+                self.manifest["initial_balance"] = disk["initial_balance"]
+                self.manifest["next_id"] = max(self.manifest["next_id"], disk["next_id"])
+                for year, entry in disk["years"].items():
+                    if year not in self._shards and entry != self.manifest["years"].get(year):
+                        self.manifest["years"][year] = entry
+                        self._summaries = None
+                        changes = None
+                for year in set(self.manifest["years"]) - set(disk["years"]) - set(self._shards):
+                    del self.manifest["years"][year]
+                    self._summaries = None
+                    changes = None
+            return changes
+
+    def get_initial_balance(self):
+        return self.manifest["initial_balance"]
+
+    def set_initial_balance(self, value):
+        with self._lock:
+            self.manifest["initial_balance"] = value
+            self._write_manifest()
+
+    def years(self):
+        return sorted(year for year, entry in self.manifest["years"].items()
+                      if entry["count"] > 0 and year != UNKNOWN_YEAR)
+
+    def query(self, year=None, date_from=None, date_to=None, text=None):
+        with self._lock:
+            if year is not None:
+                years = [year] if year in self.manifest["years"] else []
+            else:
+                first = int(date_from[:4]) if date_from else None
+                last = int(date_to[:4]) if date_to else None
+                years = [
+                    y for y in sorted(self.manifest["years"])
+                    if y == UNKNOWN_YEAR or ((first is None or y >= first) and (last is None or y <= last))
+                ]
+            results = []
+            for y in years:
+                results.extend(self._shard(y).query(year, date_from, date_to, text))
+        if len(years) > 1:
+            results.sort(key=lambda invoice: invoice["id"])
+        return results
+
+    def summaries(self):
+        """ملخص كل السنوات: يبنى بتحميل كل سنة مرة واحدة ثم يحدث مع بيانات السنة في ملف السنوات"""
+        with self._lock:
+            if self._summaries is None:
+                summaries = Summaries()
+                for year in sorted(self.manifest["years"]):
+                    summaries.merge(Summaries(list(self._shard(year)._state()["invoices"].values())))
+                self._summaries = summaries
+            return self._summaries
+
+    def get_invoice(self, invoice_id):
+        _, shard = self._find(invoice_id)
+        return shard.get_invoice(invoice_id)
+
+    def add_invoice(self, invoice):
+        self.add_invoices([invoice])
+
+    def add_invoices(self, invoices):
+        """إضافة الفواتير إلى ملفات سنواتها، بعملية واحدة لكل سنة"""
+        with self._lock:
+            by_year = {}
+            for invoice in invoices:
+                if invoice.get("id") is None:
+                    invoice["id"] = self.manifest["next_id"]
+                self.manifest["next_id"] = max(self.manifest["next_id"], invoice["id"] + 1)
+                by_year.setdefault(self._year_of(invoice), []).append(invoice)
+
+            for year, year_invoices in by_year.items():
+                shard = self._shard(year)
+                for invoice in year_invoices:
+                    self._change_entry(year, shard, new_invoice=invoice)
+                self._write_manifest()
+                if len(year_invoices) == 1:
+                    shard.add_invoice(year_invoices[0])
+                else:
+                    shard.add_invoices(year_invoices)
+
+    def update_invoice(self, invoice_id, new_invoice):
+        with self._lock:
+            old_year, old_shard = self._find(invoice_id)
+            old_invoice = old_shard.get_invoice(invoice_id)
+            new_invoice["id"] = invoice_id
+            new_year = self._year_of(new_invoice)
+            if new_year == old_year:
+                self._change_entry(old_year, old_shard, old_invoice, new_invoice)
+                self._write_manifest()
+                old_shard.update_invoice(invoice_id, new_invoice)
+                return
+
+            # نقل الفاتورة إلى سنة أخرى: الإضافة أولاً حتى لا تضيع الفاتورة عند الانقطاع
+            new_shard = self._shard(new_year)
+            self._change_entry(new_year, new_shard, new_invoice=new_invoice)
+            self._change_entry(old_year, old_shard, old_invoice=old_invoice)
+            self._write_manifest()
+            new_shard.add_invoice(new_invoice)
+            old_shard.delete_invoice(invoice_id)
+
+    def delete_invoice(self, invoice_id):
+        with self._lock:
+            year, shard = self._find(invoice_id)
+            self._change_entry(year, shard, old_invoice=shard.get_invoice(invoice_id))
+            self._write_manifest()
+            shard.delete_invoice(invoice_id)
+
+    def delete_invoices(self, invoice_ids):
+        """حذف الفواتير من ملفات سنواتها، بعملية واحدة لكل سنة"""
+        with self._lock:
+            by_year = {}
+            for invoice_id in invoice_ids:
+                year, _ = self._find(invoice_id)
+                by_year.setdefault(year, []).append(invoice_id)
+
+            for year, year_ids in by_year.items():
+                shard = self._shard(year)
+                for invoice_id in year_ids:
+                    self._change_entry(year, shard, old_invoice=shard.get_invoice(invoice_id))
+                self._write_manifest()
+                shard.delete_invoices(year_ids)
+
+    def load(self):
+        return {
+            "initial_balance": self.manifest["initial_balance"],
+            "next_id": self.manifest["next_id"],
+            "invoice_items": self.query(),
+        }
+
+    def import_json(self, path):
+        """تقسيم ملف بيانات JSON (مع سجل عملياته) إلى ملفات السنوات"""
+        data = JsonStorage(path, binary_snapshot=False).load()
+        self.add_invoices(data["invoice_items"])
+        self.set_initial_balance(data.get("initial_balance", 0.0))
+
+    def export_json(self, path):
+        """تجميع كل السنوات في ملف بيانات JSON واحد"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.load(), f, indent=4, ensure_ascii=False, default=dict)
+
+    def sync(self):
+        with self._lock:
+            return all([shard.sync() for shard in self._shards.values()])
+
+    def flush(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.flush()
+            self._write_manifest()
+
+    def flush_in_background(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.flush_in_background()
+
+    def close(self):
+        with self._lock:
+            while self._shards:
+                _, shard = self._shards.popitem(last=False)
+                shard.close()
+            self._write_manifest()
+
+
+def open_storage(path=None, background_frame=True):
+    """فتح طريقة التخزين المناسبة حسب امتداد الملف.
+
+    يمكن تحديد الملف بمتغير البيئة BOX_DATA_FILE، مثلاً ledger.db لاستخدام SQLite
+    أو مجلد (ينتهي بـ /) لاستخدام الدفتر المقسم حسب السنة، أو عنوان خادم الدفتر
+    (http://المضيف:المنفذ) لمشاركة دفتر واحد بين عدة أجهزة.
+    background_frame=False لعدم بناء نسخة pandas في الخلفية (استعلام واحد ثم إغلاق).
+    """
+    # archive و remote_storage يستوردان هذه الوحدة، لذلك يتم استيرادهما هنا
+    from archive import ArchivedStorage, YearArchive, archive_dir_for
+
+    if path is None:
+        path = os.environ.get("BOX_DATA_FILE", DATA_FILE)
+    if path.startswith("http://"):
+        # الخادم يفتح الأرشيف بنفسه
+        from remote_storage import RemoteStorage
+
+        return RemoteStorage(path)
+    if os.path.isdir(path) or path.endswith(("/", "\\")):
+        live = ShardedStorage(path, background_frame=background_frame)
+    elif path.lower().endswith(SQLITE_EXTENSIONS):
+        live = SqliteStorage(path)
+    else:
+        # BOX_BINARY_SNAPSHOT=0 لإيقاف اللقطة الثنائية
+        live = JsonStorage(path, binary_snapshot=os.environ.get("BOX_BINARY_SNAPSHOT", "1") != "0",
+                           background_frame=background_frame)
+    # السنوات المقفلة تقرأ من مجلد الأرشيف المجاور
+    return ArchivedStorage(live, YearArchive(archive_dir_for(path)))
+
+
+if __name__ == "__main__":
+    # python storage.py import accounting_data.json ledger.db
+    # python storage.py import accounting_data.json ledger/
+    # python storage.py export ledger.db accounting_data.json
+    if len(sys.argv) != 4 or sys.argv[1] not in ("import", "export"):
+        print("الاستخدام: python storage.py import|export <المصدر> <الهدف>")
+        sys.exit(1)
+
+    command, source, target = sys.argv[1:]
+    storage = open_storage(target if command == "import" else source)
+    if isinstance(storage.live, JsonStorage):
+        print("يجب أن تكون قاعدة البيانات ملف SQLite أو مجلد سنوات")
+        sys.exit(1)
+    if command == "import":
+        storage.import_json(source)
+    else:
+        storage.export_json(target)
+    storage.close()
+    print("تمت العملية بنجاح.")
@@ -0,0 +1,132 @@
+import re
+
+from balance import to_milli
+from search_index import normalize_arabic
+
+# الفواتير ذات التاريخ غير الصالح تجمع تحت هذا الشهر (السنة 0 كما في الدفتر المقسم)
+UNKNOWN_MONTH = "0000-00"
+
+SPACES = re.compile(r"\s+")
+
+
+def normalize_description(text):
+    """توحيد البيان للتجميع: "سولار" و"  سولار " و"سولاّر" بيان واحد"""
+    return SPACES.sub(" ", normalize_arabic(str(text))).strip()
+
+
+def invoice_month(invoice):
+    """الشهر بصيغة yyyy-MM (أو UNKNOWN_MONTH للتاريخ غير الصالح)"""
+    month = invoice["date"][:7]
+    if len(month) == 7 and month[:4].isdigit() and month[4] == "-" and month[5:].isdigit():
+        return month
+    return UNKNOWN_MONTH
+
+
+class Summaries:
+    """مجاميع الدفتر المحدثة تدريجياً: المدين والدائن (بالألف) وعدد الفواتير لكل شهر
+    ولكل سنة مالية ولكل بيان في كل شهر.
+
+    الإضافة والحذف O(1)، والتعديل حذف ثم إضافة، لذلك لا يعاد الحساب من الفواتير.
+    """
+
+    def __init__(self, invoices=()):
+        self.months = {}  # "yyyy-MM" -> [مدين، دائن، عدد]
+        self.descriptions = {}  # ("yyyy-MM", البيان بعد التوحيد) -> [مدين، دائن، عدد]
+        self.labels = {}  # البيان بعد التوحيد -> أول كتابة له (للعرض)
+        self._normalized = {}
+        for invoice in invoices:
+            self.add(invoice)
+
+    def _description(self, text):
+        normalized = self._normalized.get(text)
+        if normalized is None:
+            normalized = normalize_description(text)
+            self._normalized[text] = normalized
+            self.labels.setdefault(normalized, str(text).strip())
+        return normalized
+
+    @staticmethod
+    def _change(table, key, debit, credit, count):
+        totals = table.get(key)
+        if totals is None:
+            totals = table[key] = [0, 0, 0]
+        totals[0] += debit
+        totals[1] += credit
+        totals[2] += count
+        if totals[2] == 0:
+            del table[key]
+
+    def add_totals(self, month, description, debit, credit, count):
+        """إضافة مجاميع جاهزة بالألف (مثلاً من GROUP BY في SQLite أو من ملخص آخر)"""
+        self._change(self.months, month, debit, credit, count)
+        self._change(self.descriptions, (month, self._description(description)), debit, credit, count)
+
+    def _apply(self, invoice, sign):
+        self.add_totals(invoice_month(invoice), invoice["description"],
+                        sign * to_milli(invoice.get("debit", 0.0)),
+                        sign * to_milli(invoice.get("credit", 0.0)), sign)
+
+    def add(self, invoice):
+        self._apply(invoice, 1)
+
+    def remove(self, invoice):
+        self._apply(invoice, -1)
+
+    def update(self, old_invoice, new_invoice):
+        self.remove(old_invoice)
+        self.add(new_invoice)
+
+    def merge(self, other):
+        """إضافة ملخص آخر (سنة مؤرشفة أو ملف سنة) إلى هذا الملخص"""
+        for (month, description), (debit, credit, count) in other.descriptions.items():
+            self.add_totals(month, other.labels.get(description, description), debit, credit, count)
+        return self
+
+    @staticmethod
+    def _row(label, totals):
+        debit, credit, count = totals
+        return {
+            "label": label,
+            "debit": debit / 1000,
+            "credit": credit / 1000,
+            "net": (debit - credit) / 1000,
+            "count": count,
+        }
+
+    def by_month(self, year=None):
+        """صف لكل شهر بالترتيب (لكل السنوات أو لسنة واحدة)"""
+        prefix = None if year is None else f"{year:04d}-"
+        return [self._row(month, totals) for month, totals in sorted(self.months.items())
+                if prefix is None or month.startswith(prefix)]
+
+    def by_year(self):
+        years = {}
+        for month, (debit, credit, count) in self.months.items():
+            self._change(years, int(month[:4]), debit, credit, count)
+        return [self._row(year, totals) for year, totals in sorted(years.items())]
+
+    def by_description(self, year=None, month=None):
+        """صف لكل بيان مرتب حسب المبلغ (المدين + الدائن) تنازلياً، لسنة أو شهر أو للكل"""
+        descriptions = {}
+        for (entry_month, description), (debit, credit, count) in self.descriptions.items():
+            if month is not None and entry_month != month:
+                continue
+            if year is not None and entry_month[:4] != f"{year:04d}":
+                continue
+            self._change(descriptions, description, debit, credit, count)
+        rows = [self._row(self.labels.get(description, description), totals)
+                for description, totals in descriptions.items()]
+        rows.sort(key=lambda row: (-(row["debit"] + row["credit"]), row["label"]))
+        return rows
+
+    def total(self, year=None, month=None):
+        """مجموع سنة أو شهر (أو الدفتر كاملاً) في صف واحد"""
+        totals = [0, 0, 0]
+        for entry_month, values in self.months.items():
+            if month is not None and entry_month != month:
+                continue
+            if year is not None and entry_month[:4] != f"{year:04d}":
+                continue
+            for i in range(3):
+                totals[i] += values[i]
+        return self._row(month or year, totals)
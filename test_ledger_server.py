@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from ledger_server import LedgerServer
+from remote_storage import RemoteStorage
+
+# أطول انتظار لوصول تعديلات عميل إلى العميل الآخر (بالثواني)
+DELIVERY_TIMEOUT = 5
+
+
+def invoice(number, date, debit=0.0, credit=0.0):
+    return {"invoice_number": str(number), "date": date, "description": "سولار", "debit": debit, "credit": credit}
+
+
+class LedgerServerTest(unittest.TestCase):
+    """خادم الدفتر على منفذ متاح في localhost وعميلان متصلان به"""
+
+    data_file = "accounting_data.json"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = LedgerServer(os.path.join(self.directory.name, self.data_file), "127.0.0.1", 0)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.server.start())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        self.assertTrue(started.wait(DELIVERY_TIMEOUT))
+        url = f"http://127.0.0.1:{self.server.port}"
+        self.first = RemoteStorage(url)
+        self.second = RemoteStorage(url)
+
+    def tearDown(self):
+        self.first.close()
+        self.second.close()
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result(DELIVERY_TIMEOUT)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(DELIVERY_TIMEOUT)
+        self.loop.close()
+        self.directory.cleanup()
+
+    def _received(self, storage, count):
+        """التعديلات التي تصل إلى العميل حتى يصل عددها count"""
+        changes = []
+        deadline = time.monotonic() + DELIVERY_TIMEOUT
+        while len(changes) < count and time.monotonic() < deadline:
+            received = storage.refresh()
+            self.assertIsNotNone(received)
+            changes.extend(received)
+            time.sleep(0.01)
+        self.assertEqual(len(changes), count)
+        return changes
+
+    def test_changes_reach_other_client(self):
+        single = invoice(1, "2024-02-01", debit=100.0)
+        self.first.add_invoice(single)
+        [(old, new)] = self._received(self.second, 1)
+        self.assertIsNone(old)
+        self.assertEqual((new["id"], new["invoice_number"], new["debit"]), (single["id"], "1", 100.0))
+
+        batch = [invoice(2, "2024-03-01", credit=30.0), invoice(3, "2024-04-01", debit=5.5)]
+        self.first.add_invoices(batch)
+        ids = [new["id"] for _, new in self._received(self.second, 2)]
+        self.assertEqual(ids, [item["id"] for item in batch])
+        self.assertEqual(len({single["id"], *ids}), 3)
+        self.assertEqual(sorted(row["id"] for row in self.second.query()), sorted([single["id"], *ids]))
+
+        self.second.update_invoice(single["id"], invoice("1a", "2024-02-02", debit=120.0))
+        [(old, new)] = self._received(self.first, 1)
+        self.assertEqual((old["invoice_number"], new["invoice_number"], new["id"]), ("1", "1a", single["id"]))
+        self.assertEqual(self.first.get_invoice(single["id"])["debit"], 120.0)
+
+        self.first.delete_invoices(ids)
+        changes = self._received(self.second, 2)
+        self.assertEqual(sorted(old["id"] for old, _ in changes), sorted(ids))
+        self.assertTrue(all(new is None for _, new in changes))
+        self.assertEqual([row["id"] for row in self.second.query()], [single["id"]])
+
+        # التعديلات محفوظة في ملف الخادم
+        self.assertEqual(self.first.query(year=2024)[0]["invoice_number"], "1a")
+
+    def test_initial_balance_reaches_other_client(self):
+        self.first.set_initial_balance(250.0)
+        deadline = time.monotonic() + DELIVERY_TIMEOUT
+        while self.second.get_initial_balance() != 250.0 and time.monotonic() < deadline:
+            self.second.refresh()
+            time.sleep(0.01)
+        self.assertEqual(self.second.get_initial_balance(), 250.0)
+
+    def test_errors_keep_their_type(self):
+        self.first.add_invoice(invoice(1, "2024-02-01", debit=10.0))
+        with self.assertRaises(KeyError):
+            self.first.update_invoice(999999, invoice(2, "2024-02-01"))
+        with self.assertRaises(KeyError):
+            self.first.delete_invoices([999999])
+        with self.assertRaises(ValueError):
+            self.first.add_invoice(invoice(2, "2024-13-45"))
+        with self.assertRaises(ValueError):
+            self.first.add_invoices([invoice(2, "2024-02-01"), invoice(3, "not a date")])
+        with self.assertRaises(ValueError):
+            self.first.close_year(datetime.date.today().year)
+        # الطلبات الخاطئة لا تغير الدفتر
+        self.assertEqual([row["invoice_number"] for row in self.second.query()], ["1"])
+
+
+class SqliteLedgerServerTest(LedgerServerTest):
+    data_file = "ledger.db"
+
+
+if __name__ == "__main__":
+    unittest.main()
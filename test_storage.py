@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from storage import JsonStorage, open_storage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def invoice(number, date, debit=0.0, credit=0.0):
+    return {"invoice_number": str(number), "date": date, "description": "سولار", "debit": debit, "credit": credit}
+
+
+class ImportJsonTest(unittest.TestCase):
+    """نقل ملف البيانات JSON إلى SQLite أو مجلد سنوات بأمر storage.py import"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "accounting_data.json")
+        storage = JsonStorage(self.source, binary_snapshot=False)
+        storage.set_initial_balance(500.0)
+        storage.add_invoices([invoice(1, "2024-03-01", debit=100.0), invoice(2, "2024-07-15", credit=40.0),
+                              invoice(3, "2025-01-10", debit=25.5),
+                              invoice(4, "2025-02-01", credit=10.0)])
+        storage.delete_invoice(storage.query(text="2")[0]["id"])
+        self.expected = sorted((row["invoice_number"], row["date"], row["debit"], row["credit"])
+                               for row in storage.query())
+        storage.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _import(self, target):
+        target = os.path.join(self.directory.name, target)
+        result = subprocess.run([sys.executable, os.path.join(HERE, "storage.py"), "import", self.source, target],
+                                cwd=self.directory.name, capture_output=True, text=True, encoding="utf-8")
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        return open_storage(target, background_frame=False)
+
+    def _check(self, storage):
+        try:
+            self.assertEqual(storage.years(), [2024, 2025])
+            self.assertEqual(storage.get_initial_balance(), 500.0)
+            rows = storage.query()
+            self.assertEqual(sorted((row["invoice_number"], row["date"], row["debit"], row["credit"])
+                                    for row in rows), self.expected)
+            ids = [row["id"] for row in rows]
+            self.assertEqual(len(set(ids)), len(ids))
+            for row in rows:
+                self.assertEqual(storage.get_invoice(row["id"])["invoice_number"], row["invoice_number"])
+        finally:
+            storage.close()
+
+    def test_import_to_sqlite(self):
+        self._check(self._import("ledger.db"))
+
+    def test_import_to_sharded(self):
+        self._check(self._import("ledger" + os.sep))
+
+
+if __name__ == "__main__":
+    unittest.main()
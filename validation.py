@@ -0,0 +1,61 @@
+import datetime
+import functools
+import math
+
+# نفس حدود QDoubleValidator في نافذة إضافة الفاتورة
+MAX_AMOUNT = 999999999
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d")
+
+
+def parse_amount(value):
+    """تحويل المبلغ من نص أو رقم إلى float بثلاث خانات عشرية (الخانة الفارغة = 0)"""
+    if value is None:
+        return 0.0
+    if isinstance(value, str):
+        value = value.strip().replace(",", "")
+        if not value:
+            return 0.0
+    try:
+        amount = round(float(value), 3)
+    except (TypeError, ValueError):
+        raise ValueError(f"مبلغ غير صالح: {value}")
+    if not math.isfinite(amount):
+        raise ValueError(f"مبلغ غير صالح: {value}")
+    return amount
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    # التواريخ تتكرر كثيراً في ملفات الاستيراد و strptime بطيئة
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"تاريخ غير صالح: {text}")
+
+
+def parse_date(value):
+    """تحويل التاريخ إلى نص yyyy-MM-dd (يقبل خلايا التاريخ في Excel)"""
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return _parse_date_text(str(value or "").strip())
+
+
+def validate_invoice(invoice_number, description, debit, credit):
+    """شروط الفاتورة في نافذة الإضافة والاستيراد.
+
+    ترجع (الحقل، الرسالة) لأول خطأ أو None. المبالغ نص من النافذة أو أرقام من الاستيراد.
+    """
+    if not str(invoice_number or "").strip():
+        return "invoice_number", "الرجاء إدخال رقم الفاتورة"
+    if not str(description or "").strip():
+        return "description", "الرجاء إدخال وصف الفاتورة"
+    if not debit and not credit:
+        return "debit", "الرجاء إدخال قيمة في خانة مدين أو دائن"
+    if debit and credit:
+        return "debit", "لا يمكن إدخال قيم في خانتي مدين ودائن معاً"
+    return None